@@ -0,0 +1,215 @@
+'''Projections and insights over a user's budget history, computed with NumPy'''
+
+import math
+from collections import namedtuple
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db.models import FloatField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from shelf.budget.models import MonthlyBudget, Category, Transaction, MonthlyRollup
+
+ForecastCategory = namedtuple('ForecastCategory', ['label', 'budgeted', 'recurring', 'spent'])
+ForecastMonth = namedtuple('ForecastMonth', [
+    'year', 'month', 'income', 'spent', 'net', 'cumulative_net', 'categories'
+])
+SpendingInsight = namedtuple('SpendingInsight', [
+    'year', 'month', 'label', 'spent', 'budgeted', 'rolling_average', 'change',
+    'budget_ratio', 'z_score', 'anomaly'
+])
+
+def _history(user, latest, months):
+    '''
+    Loads the budget months of the history window ending at the latest
+    budget and the non-recurring spend of each (month, category label) in it
+    '''
+    start = latest.date - relativedelta(months=months - 1)
+    dates = list(MonthlyBudget.objects.filter(
+        user=user, date__range=(start, latest.date)
+    ).order_by('date').values_list('date', flat=True))
+    spend = Transaction.objects.filter(
+        category__budget__user=user,
+        category__budget__date__range=(start, latest.date),
+        recurring=False
+    ).values_list('category__budget__date', 'category__label').annotate(
+        spent=Sum('amount')
+    ).order_by()
+
+    return dates, spend
+
+def _latest_categories(latest):
+    '''Loads the categories of the latest budget with the sum of their recurring transactions'''
+    return list(Category.objects.filter(budget=latest).annotate(
+        recurring=Coalesce(
+            Sum('transactions__amount', filter=Q(transactions__recurring=True)),
+            Value(0.0),
+            output_field=FloatField()
+        )
+    ).order_by('created'))
+
+def _spend_matrix(categories, dates, spend):
+    '''
+    Lays out the history spend as a (category, history month) matrix, leaving
+    out labels none of the categories has
+    '''
+    labels = {category.label: row for row, category in enumerate(categories)}
+    columns = {day: column for column, day in enumerate(dates)}
+
+    history = np.zeros((len(categories), len(dates)))
+    cells = [
+        (labels[label], columns[day], spent) for day, label, spent in spend if label in labels
+    ]
+    if cells:
+        rows, cols, amounts = zip(*cells)
+        np.add.at(history, (np.array(rows), np.array(cols)), amounts)
+
+    return history
+
+def _forecast_months(latest, categories, projected):
+    '''Builds the months after the latest budget from the (category, forecast month) projection'''
+    months = projected.shape[1]
+    spent = projected.sum(axis=0)
+    income = np.full(months, latest.income)
+    net = income - spent
+    cumulative_net = np.cumsum(net)
+
+    forecast_dates = [latest.date + relativedelta(months=offset) for offset in range(1, months + 1)]
+    projected = projected.tolist()
+    totals = zip(income.tolist(), spent.tolist(), net.tolist(), cumulative_net.tolist())
+
+    return [
+        ForecastMonth(
+            day.year,
+            day.month,
+            *month_totals,
+            categories=[
+                ForecastCategory(
+                    label=category.label,
+                    budgeted=float(category.monthly_amount),
+                    recurring=float(category.recurring),
+                    spent=projected[row][index]
+                ) for row, category in enumerate(categories)
+            ]
+        ) for index, (day, month_totals) in enumerate(zip(forecast_dates, totals))
+    ]
+
+def forecast(user, months):
+    '''
+    Projects the next months after the user's latest budget without creating
+    any rows. Each category of the latest budget is expected to spend its
+    recurring transactions plus the mean of its other spending over the last
+    GRAPHQL_FORECAST['HISTORY_MONTHS'] budgets; income stays as budgeted
+    '''
+    config = settings.GRAPHQL_FORECAST
+    if not 1 <= months <= config['MAX_MONTHS']:
+        raise ValueError(f"months must be between 1 and {config['MAX_MONTHS']}")
+
+    latest = MonthlyBudget.objects.filter(user=user).order_by('date').last()
+    if latest is None:
+        return []
+
+    categories = _latest_categories(latest)
+    dates, spend = _history(user, latest, config['HISTORY_MONTHS'])
+    history = _spend_matrix(categories, dates, spend)
+
+    recurring = np.array([category.recurring for category in categories], dtype=float)
+    expected = recurring + (history.mean(axis=1) if dates else 0.0)
+
+    # (category, forecast month) projection
+    return _forecast_months(
+        latest, categories, np.repeat(expected[:, np.newaxis], months, axis=1)
+    )
+
+def _nullable(values):
+    '''Converts an array to a list, NaN (no value for that month) becoming None'''
+    return [[None if math.isnan(value) else value for value in row] for row in values.tolist()]
+
+def _trailing_sum(values, window):
+    '''Sums each row of a matrix over a trailing window of columns'''
+    totals = np.cumsum(values, axis=1)
+    return totals - np.pad(totals, ((0, 0), (window, 0)))[:, :-window]
+
+def _rollup_matrices(rows, labels, year):
+    '''
+    Lays out rollup rows as dense (category, month) matrices over 24 months,
+    month 12 being January of year: whether the category had a budget in the
+    month, what it spent and what it budgeted
+    '''
+    index = {label: row for row, label in enumerate(labels)}
+    cells = (
+        np.array([index[row[0]] for row in rows]),
+        np.array([(row[1] - year + 1) * 12 + row[2] - 1 for row in rows])
+    )
+    shape = (len(labels), 24)
+    exists = np.zeros(shape, dtype=bool)
+    spent = np.zeros(shape)
+    budgeted = np.zeros(shape)
+    exists[cells] = True
+    spent[cells] = [row[3] for row in rows]
+    budgeted[cells] = [row[4] for row in rows]
+
+    return exists, spent, budgeted
+
+def _rolling_average(exists, spent, window):
+    '''Mean over the months of the trailing window the category had a budget in'''
+    window_spent = _trailing_sum(spent, window)
+    window_months = _trailing_sum(exists, window)
+    return np.divide(window_spent, window_months, out=np.full(spent.shape, np.nan),
+                     where=exists & (window_months > 0))
+
+def _statistics(exists, spent, budgeted, config):
+    '''Computes every insight as a (category, month) list of lists, None where undefined'''
+    missing = np.full(exists.shape, np.nan)
+    observed = np.where(exists, spent, np.nan)
+
+    change = observed - np.pad(observed, ((0, 0), (1, 0)), constant_values=np.nan)[:, :-1]
+    budget_ratio = np.divide(spent, budgeted, out=missing.copy(), where=exists & (budgeted > 0))
+
+    months = exists.sum(axis=1, keepdims=True)
+    mean = np.nanmean(observed, axis=1, keepdims=True)
+    deviation = np.nanstd(observed, axis=1, keepdims=True)
+    z_score = np.divide(observed - mean, deviation, out=missing.copy(),
+                        where=exists & (deviation > 0))
+    anomaly = exists & (months >= config['MIN_MONTHS']) & \
+        (np.nan_to_num(np.abs(z_score)) >= config['ANOMALY_Z'])
+
+    return {
+        'spent': spent.tolist(),
+        'budgeted': budgeted.tolist(),
+        'rolling_average': _nullable(_rolling_average(exists, spent, config['WINDOW'])),
+        'change': _nullable(change),
+        'budget_ratio': _nullable(budget_ratio),
+        'z_score': _nullable(z_score),
+        'anomaly': anomaly.tolist(),
+    }
+
+def spending_insights(user, year):
+    '''
+    Returns rolling averages, month over month changes, spent to budgeted
+    ratios and z-score anomaly flags of each category for every month of
+    the year. They come from the per-category monthly rollups of the year
+    and the one before it, which gives January a rolling window and the
+    z-scores a longer baseline
+    '''
+    rows = list(MonthlyRollup.objects.filter(
+        user=user, year__range=(year - 1, year), label__isnull=False
+    ).values_list('label', 'year', 'month', 'spent', 'budgeted'))
+    labels = sorted({row[0] for row in rows})
+    if not labels:
+        return []
+
+    exists, spent, budgeted = _rollup_matrices(rows, labels, year)
+    statistics = _statistics(exists, spent, budgeted, settings.GRAPHQL_INSIGHTS)
+
+    # the months of year, month by month
+    present = zip(*(indices.tolist() for indices in np.nonzero(exists[:, 12:].T)))
+    return [
+        SpendingInsight(
+            year=year,
+            month=month + 1,
+            label=labels[row],
+            **{name: values[row][month + 12] for name, values in statistics.items()}
+        ) for month, row in present
+    ]
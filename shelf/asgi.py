@@ -9,8 +9,16 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+
+from shelf.cache import check_shared_backend
+from shelf.concurrency import StreamingASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shelf.settings')
+# serve /graphql from the async view, resolving root fields concurrently
+os.environ.setdefault('GRAPHQL_ASYNC', '1')
 
-application = get_asgi_application()
+# like get_asgi_application(), with streamed responses (/export) produced off the event loop
+django.setup(set_prefix=False)
+application = StreamingASGIHandler()
+check_shared_backend()
@@ -0,0 +1,128 @@
+'''JWT authentication with the token to user resolution cached per request and across requests'''
+
+import copy
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from graphql_jwt.backends import JSONWebTokenBackend
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_credentials, get_payload, get_user_by_payload
+
+from shelf.documents import LRUDict
+
+class TokenUserCache:
+    '''
+    Bounded cache of the users tokens resolve to, keyed by a hash of the
+    token. Entries live at most timeout seconds and never past the token's
+    own expiry, and saving or deleting a user drops the entries for them
+    '''
+
+    def __init__(self, max_entries=10000, timeout=60):
+        self.entries = LRUDict(max_entries)
+        self.timeout = timeout
+        self.generations = {}
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        '''Returns the cache key of a token, so tokens are never kept as they are'''
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token):
+        '''Returns a copy of the cached user for the token, or None'''
+        entry = self.entries.get(self.key(token))
+        if entry is None:
+            return None
+
+        user, expires, generation = entry
+        if expires <= time.time() or generation != self.generations.get(user.pk, 0):
+            self.entries.pop(self.key(token))
+            return None
+
+        return copy.copy(user)
+
+    def set(self, token, user, payload, invalidations):
+        '''
+        Caches the user a token resolved to, unless a user changed since
+        invalidations was read (the lookup may have raced with the change)
+        '''
+        expires = time.time() + self.timeout
+        if 'exp' in payload:
+            expires = min(expires, payload['exp'])
+
+        with self.lock:
+            if invalidations != self.invalidations:
+                return
+            generation = self.generations.get(user.pk, 0)
+        self.entries.set(self.key(token), (copy.copy(user), expires, generation))
+
+    def invalidate(self, user_id):
+        '''Drops the cached entries of a user, and any lookup racing with the change'''
+        with self.lock:
+            self.generations[user_id] = self.generations.get(user_id, 0) + 1
+            self.invalidations += 1
+
+_token_user_cache = None
+
+def get_token_user_cache():
+    '''Returns the process-wide token user cache configured by GRAPHQL_JWT_USER_CACHE'''
+    global _token_user_cache #pylint: disable=global-statement
+    if _token_user_cache is None:
+        config = settings.GRAPHQL_JWT_USER_CACHE
+        _token_user_cache = TokenUserCache(config['MAX_ENTRIES'], config['TIMEOUT'])
+
+    return _token_user_cache
+
+def get_user_by_token(token, context=None):
+    '''graphql_jwt's get_user_by_token, skipping decoding and the user query on cache hits'''
+    cache = get_token_user_cache()
+    user = cache.get(token)
+    if user is not None:
+        return user
+
+    invalidations = cache.invalidations
+    payload = get_payload(token, context)
+    user = get_user_by_payload(payload)
+    if user is not None:
+        cache.set(token, user, payload, invalidations)
+
+    return user
+
+class CachedJSONWebTokenBackend(JSONWebTokenBackend):
+    '''
+    JSONWebTokenBackend resolving each token once per request, even when the
+    view and the JWT middleware of every root field authenticate again, and
+    through the token user cache across requests
+    '''
+
+    def authenticate(self, request=None, **kwargs):
+        if request is None or getattr(request, '_jwt_token_auth', False):
+            return None
+
+        token = get_credentials(request, **kwargs)
+        if token is None:
+            return None
+
+        resolved = getattr(request, '_jwt_resolved', None)
+        if resolved is None:
+            resolved = request._jwt_resolved = {} #pylint: disable=protected-access
+        if token not in resolved:
+            try:
+                resolved[token] = get_user_by_token(token, request)
+            except JSONWebTokenError as error:
+                resolved[token] = error
+
+        if isinstance(resolved[token], JSONWebTokenError):
+            raise resolved[token]
+        return resolved[token]
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs): #pylint: disable=unused-argument
+    '''Drops the cached token lookups of a user who changed'''
+    get_token_user_cache().invalidate(instance.pk)
@@ -7,3 +7,7 @@ class BudgetConfig(AppConfig):
 
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shelf.budget'
+
+    def ready(self):
+        # connects the signals invalidating cached JWT users
+        import shelf.auth #pylint: disable=import-outside-toplevel,unused-import
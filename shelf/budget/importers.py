@@ -0,0 +1,243 @@
+'''Streaming bank statement importers (CSV and OFX) for transactions'''
+
+import csv
+import re
+from collections import Counter, namedtuple
+from contextlib import nullcontext
+from datetime import datetime
+from itertools import islice
+
+from django.db import transaction as db_transaction
+
+from shelf.budget.models import Category, Transaction
+from shelf.cache import bump_user_version
+
+ImportedRow = namedtuple('ImportedRow', ['date', 'amount', 'source', 'description'])
+
+class ImportResult:
+    '''Counts of what happened to each imported row'''
+
+    def __init__(self):
+        self.created = 0
+        self.duplicates = 0
+        self.uncategorized = 0
+        self.skipped = 0
+
+    def __str__(self):
+        return (
+            f'{self.created} created, {self.duplicates} duplicates, '
+            f'{self.uncategorized} uncategorized, {self.skipped} skipped'
+        )
+
+class CategoryRules:
+    '''
+    Maps imported rows to category labels. Rules are checked in order and the
+    first pattern matching the row's source or description wins, e.g.
+    {"rules": [{"match": "whole foods|safeway", "category": "Groceries"}], "default": "Misc"}
+    '''
+
+    def __init__(self, config=None):
+        config = config or {}
+        self.rules = [
+            (re.compile(rule['match'], re.IGNORECASE), rule['category'])
+            for rule in config.get('rules', [])
+        ]
+        self.default = config.get('default')
+
+    def categorize(self, row):
+        '''Returns the category label for a row, or None if no rule applies'''
+        text = f'{row.source} {row.description}'
+        for pattern, label in self.rules:
+            if pattern.search(text):
+                return label
+
+        return self.default
+
+def parse_csv(lines, date_format='%Y-%m-%d', columns=None):
+    '''
+    Yields rows from a CSV export with a header line. columns maps the
+    date/amount/source/description fields to the export's header names.
+    Raises ValueError naming the line of a row that can't be read
+    '''
+    columns = {
+        'date': 'date',
+        'amount': 'amount',
+        'source': 'source',
+        'description': 'description',
+        **(columns or {})
+    }
+
+    reader = csv.DictReader(lines)
+    for record in reader:
+        # DictReader fills the fields of short rows with None
+        missing = [
+            columns[field] for field in ('date', 'amount', 'source')
+            if record.get(columns[field]) is None
+        ]
+        if missing:
+            raise ValueError(f"Line {reader.line_num}: no value for {', '.join(missing)}")
+
+        try:
+            row = ImportedRow(
+                date=datetime.strptime(record[columns['date']].strip(), date_format).date(),
+                amount=float(record[columns['amount']].replace(',', '')),
+                source=record[columns['source']].strip()[:100],
+                description=(record.get(columns['description']) or '').strip()[:200]
+            )
+        except ValueError as error:
+            raise ValueError(f'Line {reader.line_num}: {error}') from error
+        yield row
+
+OFX_TAG = re.compile(r'<(/?)(\w+)>([^<\r\n]*)')
+
+def parse_ofx(lines):
+    '''
+    Yields rows from the STMTTRN blocks of an OFX (SGML or XML) export.
+    Raises ValueError naming the line of a block that can't be read
+    '''
+    current = None
+
+    for number, line in enumerate(lines, 1):
+        for closing, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                if not closing:
+                    current = {}
+                elif current is not None:
+                    yield _ofx_row(current, number)
+                    current = None
+            elif current is not None and not closing:
+                current[tag] = value.strip() #pylint: disable=unsupported-assignment-operation
+
+def _ofx_row(fields, number):
+    '''Builds an ImportedRow from the tags of one STMTTRN block, ending on line number'''
+    name = fields.get('NAME') or fields.get('PAYEE') or fields.get('MEMO', '')
+
+    try:
+        return ImportedRow(
+            date=datetime.strptime(fields['DTPOSTED'][:8], '%Y%m%d').date(),
+            amount=float(fields['TRNAMT']),
+            source=name[:100],
+            description=fields.get('MEMO', name)[:200]
+        )
+    except KeyError as error:
+        raise ValueError(f'Line {number}: transaction without {error.args[0]}') from error
+    except ValueError as error:
+        raise ValueError(f'Line {number}: {error}') from error
+
+PARSERS = {
+    'csv': parse_csv,
+    'ofx': parse_ofx,
+}
+
+def import_transactions( #pylint: disable=too-many-arguments
+        user, rows, rules, chunk_size=1000, spend_sign=-1, atomic=False
+):
+    '''
+    Writes parsed rows as transactions of the user's budgets, chunk_size rows
+    per bulk insert. Rows whose sign doesn't match spend_sign (income) are
+    skipped, rows matching a transaction with the same (date, amount, source)
+    that existed before the import are dropped as duplicates and rows
+    without a matching budget category are uncategorized. Identical rows
+    within the export are all kept, so each of them needs its own existing
+    transaction to be dropped.
+
+    Each chunk commits on its own, so when a row fails to parse the chunks
+    before it stay imported; with atomic the import is a single transaction
+    and nothing is kept. The user's cached results are invalidated either way
+    '''
+    result = ImportResult()
+    categories = CategoryCache(user)
+    consumed = Counter()
+    rows = iter(rows)
+
+    try:
+        with db_transaction.atomic() if atomic else nullcontext():
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    return result
+
+                _import_chunk(chunk, rules, categories, spend_sign, result, consumed)
+    finally:
+        bump_user_version(user.id)
+
+def _import_chunk( #pylint: disable=too-many-arguments
+        chunk, rules, categories, spend_sign, result, consumed
+):
+    '''
+    Dedupes, categorizes and bulk inserts a single chunk of rows. consumed
+    counts the transactions with each key already accounted for by earlier
+    rows of the import: either matched as a duplicate or inserted by it
+    '''
+    spending = []
+    for row in chunk:
+        if row.amount * spend_sign <= 0:
+            result.skipped += 1
+        else:
+            spending.append(row._replace(amount=abs(row.amount)))
+
+    if not spending:
+        return
+
+    existing = Counter(Transaction.objects.filter(
+        category__budget__user=categories.user,
+        date__range=(min(r.date for r in spending), max(r.date for r in spending))
+    ).values_list('date', 'amount', 'source'))
+    categories.load({row.date.replace(day=1) for row in spending})
+
+    created = []
+    for row in spending:
+        key = (row.date, row.amount, row.source)
+        if existing[key] > consumed[key]:
+            consumed[key] += 1
+            result.duplicates += 1
+            continue
+
+        category = categories.get(row.date, rules.categorize(row))
+        if category is None:
+            result.uncategorized += 1
+            continue
+
+        consumed[key] += 1
+        created.append(Transaction(
+            amount=row.amount,
+            source=row.source,
+            date=row.date,
+            description=row.description,
+            category=category
+        ))
+
+    with db_transaction.atomic():
+        Transaction.objects.bulk_create(created)
+        Category.objects.add_spent(((t.category, t.amount) for t in created), count=1)
+
+    result.created += len(created)
+
+class CategoryCache:
+    '''Looks up a user's categories by (month, label), loading each month once'''
+
+    def __init__(self, user):
+        self.user = user
+        self.months = set()
+        self.categories = {}
+
+    def load(self, months):
+        '''Loads the categories of every month not seen before in one query'''
+        missing = months - self.months
+        if not missing:
+            return
+
+        for category in Category.objects.select_related('budget').filter(
+                budget__user=self.user, budget__date__in=missing
+        ).order_by('pk'):
+            self.categories.setdefault((category.budget.date, category.label), category)
+
+        self.months |= missing
+
+    def get(self, date, label):
+        '''Returns the category for a label in the budget of date's month'''
+        if label is None:
+            return None
+
+        return self.categories.get((date.replace(day=1), label))
@@ -0,0 +1,300 @@
+'''Contains the benchmark command'''
+
+import json
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.models import User, MonthlyBudget, Transaction
+from shelf.cache import bump_user_version
+from shelf.schema import encode_sync_cursor
+from shelf.views import ShelfGraphQLView
+
+BUDGET_FIELDS = '''
+    id month year income net transactionCount
+    categories { id label monthlyAmount spent transactions { id amount date source } }
+'''
+
+# (name, query, variables) per operation; variables are built from the fixture
+QUERIES = [
+    ('monthlyBudgets', f'''query($year: String) {{
+        monthlyBudgets(year: $year) {{ {BUDGET_FIELDS} }}
+    }}''', lambda f: {'year': str(f['budget'].date.year)}),
+    ('allBudgetYears', '{ allBudgetYears }', lambda f: {}),
+    ('allCategories', '''query($budgetId: ID!) {
+        allCategories(budgetId: $budgetId) { id label spent transactionCount month }
+    }''', lambda f: {'budgetId': f['budget'].id}),
+    ('monthlyBudget', f'''query($id: ID!) {{
+        monthlyBudget(id: $id) {{ {BUDGET_FIELDS} user {{ username }} }}
+    }}''', lambda f: {'id': f['budget'].id}),
+    ('category', '''query($id: ID!) {
+        category(id: $id) { id label spent year transactions { id amount date } }
+    }''', lambda f: {'id': f['category'].id}),
+    ('transactionsConnection', '''query($id: ID!) {
+        category(id: $id) {
+            transactionsConnection(first: 20) {
+                edges { cursor node { id amount date source } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    }''', lambda f: {'id': f['category'].id}),
+    ('transaction', '''query($id: ID!) {
+        transaction(id: $id) { id amount category { label budget { month net } } }
+    }''', lambda f: {'id': f['transactions'][0]}),
+    ('spendingHistory', '''query($fromYear: Int!, $toYear: Int!) {
+        spendingHistory(fromYear: $fromYear, toYear: $toYear) { year month label spent count }
+    }''', lambda f: {'fromYear': f['first_year'], 'toYear': f['budget'].date.year}),
+    ('searchTransactions', '''query($query: String!) {
+        searchTransactions(query: $query, first: 20) {
+            edges { cursor node { id amount date source description } }
+            pageInfo { hasNextPage endCursor }
+        }
+    }''', lambda f: {'query': f['category'].label}),
+    ('changesSince', '''query($cursor: String) {
+        changesSince(cursor: $cursor) {
+            cursor reset
+            monthlyBudgets { id income net }
+            categories { id label monthlyAmount spent }
+            transactions { id amount date source description recurring }
+            deleted { model objectId }
+        }
+    }''', lambda f: {'cursor': encode_sync_cursor(now() - timedelta(hours=1))}),
+    ('forecast', '''query {
+        forecast(months: 24) {
+            year month income spent net cumulativeNet
+            categories { label budgeted recurring spent }
+        }
+    }''', lambda f: {}),
+    ('spendingInsights', '''query($year: Int!) {
+        spendingInsights(year: $year) {
+            month label spent budgeted rollingAverage change budgetRatio zScore anomaly
+        }
+    }''', lambda f: {'year': f['budget'].date.year}),
+]
+
+MUTATIONS = [
+    ('createMonthlyBudget', '''mutation($year: String) {
+        createMonthlyBudget(year: $year, month: "January", income: 5000) { monthlyBudget { id } }
+    }''', lambda f: {'year': str(f['budget'].date.year + 10)}),
+    ('autoCreateMonthlyBudget', '''mutation {
+        autoCreateMonthlyBudget { monthlyBudget { id net categories { id } } }
+    }''', lambda f: {}),
+    ('editMonthlyBudget', '''mutation($id: ID, $year: String, $month: String) {
+        editMonthlyBudget(id: $id, year: $year, month: $month, income: 6000) {
+            monthlyBudget { id net }
+        }
+    }''', lambda f: {
+        'id': f['budget'].id,
+        'year': str(f['budget'].date.year),
+        'month': f['budget'].date.strftime('%B')
+    }),
+    ('deleteMonthlyBudget', '''mutation($id: ID) {
+        deleteMonthlyBudget(id: $id) { deletedCategories deletedTransactions }
+    }''', lambda f: {'id': f['budget'].id}),
+    ('createCategory', '''mutation($budgetId: ID) {
+        createCategory(label: "Benchmark", monthlyAmount: 100, budgetId: $budgetId) {
+            category { id }
+        }
+    }''', lambda f: {'budgetId': f['budget'].id}),
+    ('editCategory', '''mutation($id: ID) {
+        editCategory(id: $id, label: "Benchmark", monthlyAmount: 100) { category { id } }
+    }''', lambda f: {'id': f['category'].id}),
+    ('deleteCategory', '''mutation($id: ID) {
+        deleteCategory(id: $id) { deletedTransactions }
+    }''', lambda f: {'id': f['category'].id}),
+    ('createTransaction', '''mutation($categoryId: ID) {
+        createTransaction(
+            amount: 12.5, source: "Benchmark", day: 3, description: "benchmark",
+            categoryId: $categoryId, recurring: false
+        ) { transaction { id category { spent } } }
+    }''', lambda f: {'categoryId': f['category'].id}),
+    ('editTransaction', '''mutation($id: ID) {
+        editTransaction(
+            id: $id, amount: 12.5, source: "Benchmark", day: 3, description: "benchmark",
+            recurring: false
+        ) { transaction { id } }
+    }''', lambda f: {'id': f['transactions'][0]}),
+    ('deleteTransaction', '''mutation($id: ID) {
+        deleteTransaction(id: $id) { transaction { amount } }
+    }''', lambda f: {'id': f['transactions'][0]}),
+    ('createTransactions', '''mutation($transactions: [CreateTransactionInput!]!) {
+        createTransactions(transactions: $transactions) { transactions { id } }
+    }''', lambda f: {'transactions': [{
+        'amount': 1.0 + index, 'source': 'Benchmark', 'day': 1 + index % 28,
+        'description': 'benchmark', 'recurring': False, 'categoryId': f['category'].id
+    } for index in range(10)]}),
+    ('editTransactions', '''mutation($transactions: [EditTransactionInput!]!) {
+        editTransactions(transactions: $transactions) { transactions { id } }
+    }''', lambda f: {'transactions': [{
+        'id': transaction_id, 'amount': 2.0, 'source': 'Benchmark', 'day': 2,
+        'description': 'benchmark', 'recurring': False
+    } for transaction_id in f['transactions']]}),
+    ('deleteTransactions', '''mutation($ids: [ID!]!) {
+        deleteTransactions(ids: $ids) { transactions { id } }
+    }''', lambda f: {'ids': f['transactions']}),
+    ('deleteMonthlyBudgets', '''mutation($ids: [ID!]!) {
+        deleteMonthlyBudgets(ids: $ids) { deletedBudgets deletedCategories deletedTransactions }
+    }''', lambda f: {'ids': f['budgets']}),
+    ('importTransactions', '''mutation($rules: JSONString) {
+        importTransactions(file: "statement", rules: $rules) { created duplicates }
+    }''', lambda f: {'rules': json.dumps({'default': f['category'].label})}),
+]
+
+IMPORT_ROWS = 100
+
+BENCHMARK_VIEW = ShelfGraphQLView.as_view()
+
+def percentile(samples, fraction):
+    '''Nearest-rank percentile of a list of samples'''
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Command(BaseCommand):
+    '''Benchmarks every query and mutation of the schema against a seeded user'''
+
+    help = (
+        'Runs each GraphQL query and mutation against the data of a user (see seed_data), '
+        'reporting latency percentiles and SQL query counts'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', nargs='?', default='seed0')
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--only', nargs='*', help='Names of the operations to run')
+        parser.add_argument('--save', help='Write the results to this JSON baseline file')
+        parser.add_argument('--baseline', help='Compare the results with this JSON baseline file')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Relative p95 slowdown over the baseline reported as a regression'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist as error:
+            raise CommandError(f"User {options['username']} does not exist") from error
+
+        budgets = MonthlyBudget.objects.filter(user=user).order_by('date')
+        budget = budgets.last()
+        category = budget and budget.categories.order_by('pk').first()
+        if category is None:
+            raise CommandError(f'{user} has no budget with categories, run seed_data first')
+        fixture = {
+            'budget': budget,
+            'category': category,
+            'budgets': list(budgets.reverse().values_list('pk', flat=True)[:3]),
+            'first_year': budgets.first().date.year,
+            'transactions': list(Transaction.objects.filter(
+                category=category
+            ).order_by('pk').values_list('pk', flat=True)[:10]),
+        }
+        if not fixture['transactions']:
+            raise CommandError(f'{category} has no transactions, run seed_data first')
+
+        results = {}
+        for operation in QUERIES + MUTATIONS:
+            name = operation[0]
+            if options['only'] and name not in options['only']:
+                continue
+            result = results[name] = self.measure(user, fixture, operation, options)
+            self.stdout.write(
+                f"{name:<26} p50 {result['p50']:8.2f}ms  p95 {result['p95']:8.2f}ms  "
+                f"p99 {result['p99']:8.2f}ms  {result['queries']:4} queries"
+            )
+
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as baseline:
+                json.dump(results, baseline, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved baseline to {options['save']}")
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['tolerance'])
+
+    def measure(self, user, fixture, operation, options):
+        '''
+        Posts an operation to the GraphQL view repeatedly, rolling back writes
+        after every run, and returns its latency percentiles and SQL count
+        '''
+        name, query, variables = operation
+        data = {'query': query, 'variables': json.dumps(variables(fixture))}
+        durations = []
+        queries = 0
+        for iteration in range(options['warmup'] + options['iterations']):
+            body, duration, sql_count = self.run_once(user, fixture, data)
+            if body.get('errors'):
+                raise CommandError(f"{name} failed: {body['errors'][0]['message']}")
+            if iteration >= options['warmup']:
+                durations.append(duration * 1000)
+                queries = max(queries, sql_count)
+
+        return {
+            'p50': percentile(durations, 0.5),
+            'p95': percentile(durations, 0.95),
+            'p99': percentile(durations, 0.99),
+            'queries': queries,
+        }
+
+    def run_once(self, user, fixture, data):
+        '''
+        Posts data as the user with a JWT, like a client would, returning the
+        response body, its duration and SQL count. The run starts at a new
+        data version, so nothing the warmup or the previous run cached is reused
+        '''
+        bump_user_version(user.id)
+        request = RequestFactory().post(
+            '/graphql',
+            dict(data, statement=self.statement(fixture['budget'].date)),
+            HTTP_AUTHORIZATION=f'JWT {get_token(user)}'
+        )
+        request.user = AnonymousUser()
+
+        with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = BENCHMARK_VIEW(request)
+            duration = time.perf_counter() - start
+            transaction.set_rollback(True)
+        return json.loads(response.content), duration, len(captured.captured_queries)
+
+    @staticmethod
+    def statement(month):
+        '''Builds the CSV statement uploaded to importTransactions, dated in month'''
+        lines = ['date,amount,source,description'] + [
+            f'{month + timedelta(days=index % 28)},-{index + 1}.5,Import {index},benchmark'
+            for index in range(IMPORT_ROWS)
+        ]
+        return SimpleUploadedFile('statement.csv', '\n'.join(lines).encode())
+
+    def compare(self, results, path, tolerance):
+        '''Reports operations slower or issuing more SQL than in the baseline'''
+        with open(path, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = []
+        for name, result in results.items():
+            previous = baseline.get(name)
+            if previous is None:
+                continue
+            if result['queries'] > previous['queries']:
+                regressions.append(
+                    f"{name}: {result['queries']} queries, was {previous['queries']}"
+                )
+            if result['p95'] > previous['p95'] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: p95 {result['p95']:.2f}ms, was {previous['p95']:.2f}ms"
+                )
+
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+
+        self.stdout.write(self.style.SUCCESS(f'No regressions against {path}'))
@@ -0,0 +1,80 @@
+'''Contains the explain_queries command'''
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from shelf.budget.models import User, MonthlyBudget, Category, Transaction, MonthlyRollup
+
+class Command(BaseCommand):
+    '''Prints the query plan of every resolver's access path for a user'''
+
+    help = "EXPLAINs the queries behind each GraphQL resolver and flags sequential scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument(
+            '--no-seqscan',
+            action='store_true',
+            help='Discourage sequential scans, to check an index is usable on small tables'
+        )
+        parser.add_argument('--analyze', action='store_true', help='Run EXPLAIN ANALYZE')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('explain_queries needs PostgreSQL')
+
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist as error:
+            raise CommandError(f"User {options['username']} does not exist") from error
+
+        budget = MonthlyBudget.objects.filter(user=user).order_by('date').last()
+        if budget is None:
+            raise CommandError(f'{user} has no budgets')
+        category_ids = list(budget.categories.values_list('id', flat=True)) or [0]
+
+        access_paths = {
+            'monthlyBudgets(year)': MonthlyBudget.objects.filter(
+                user=user, date__year=budget.date.year
+            ).order_by('date__month'),
+            'allBudgetYears': MonthlyRollup.objects.filter(
+                user=user, label__isnull=True
+            ).values_list('year', flat=True).distinct().order_by('-year'),
+            'autoCreateMonthlyBudget (latest budget)': MonthlyBudget.objects.filter(
+                user=user
+            ).order_by('date').reverse()[:1],
+            'allCategories(budgetId)': Category.objects.filter(
+                budget_id=budget.id, budget__user=user
+            ).order_by('created'),
+            'categories by budget loader': Category.objects.filter(
+                budget_id__in=[budget.id]
+            ).order_by('created'),
+            'transactions by category loader': Transaction.objects.filter(
+                category_id__in=category_ids
+            ).order_by('-date'),
+            'copy_from (recurring transactions)': Transaction.objects.filter(
+                category__budget=budget, recurring=True
+            ),
+            'searchTransactions(query)': Transaction.objects.filter(
+                category__budget__user=user
+            ).search('groceries').order_by('-search_rank', '-date', '-id')[:21],
+            'changesSince (transactions)': Transaction.objects.filter(
+                category__budget__user=user, modified__gt=budget.modified
+            ).order_by('pk'),
+        }
+
+        unindexed = 0
+        with transaction.atomic():
+            if options['no_seqscan']:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for name, queryset in access_paths.items():
+                plan = queryset.explain(analyze=options['analyze'])
+                uses_index = 'Seq Scan' not in plan
+                unindexed += not uses_index
+
+                status = 'index' if uses_index else 'SEQUENTIAL SCAN'
+                self.stdout.write(f'== {name}: {status}\n{plan}\n')
+
+        self.stdout.write(f'{len(access_paths) - unindexed}/{len(access_paths)} use index scans')
@@ -0,0 +1,100 @@
+'''Contains the import_transactions command'''
+
+import json
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shelf.budget.importers import PARSERS, CategoryRules, import_transactions
+from shelf.budget.models import User
+from shelf.cache import stale_results_warning
+
+class Command(BaseCommand):
+    '''Streams a bank export (CSV or OFX) into a user's transactions'''
+
+    help = "Imports a CSV or OFX bank export into a user's transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format',
+            choices=sorted(PARSERS),
+            help='Export format, guessed from the file extension by default'
+        )
+        parser.add_argument(
+            '--rules',
+            help='JSON file mapping sources/descriptions to category labels'
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--date-format',
+            default='%Y-%m-%d',
+            help='strptime format of the CSV date column'
+        )
+        parser.add_argument(
+            '--columns',
+            help='JSON object mapping date/amount/source/description to CSV headers'
+        )
+        parser.add_argument(
+            '--spend-positive',
+            action='store_true',
+            help='Treat positive amounts as spending (most banks export them negative)'
+        )
+        parser.add_argument('--encoding', default='utf-8')
+        parser.add_argument(
+            '--atomic',
+            action='store_true',
+            help='Import every row or none, instead of keeping the chunks before a bad row'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist as error:
+            raise CommandError(f"User {options['username']} does not exist") from error
+
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in PARSERS:
+            raise CommandError(f'Unknown format {file_format}, pass --format')
+
+        rules = None
+        if options['rules']:
+            rules = json.loads(Path(options['rules']).read_text(encoding='utf-8'))
+        rules = CategoryRules(rules)
+        if options['columns']:
+            options['columns'] = json.loads(options['columns'])
+        warning = stale_results_warning()
+        if warning:
+            self.stderr.write(warning, self.style.WARNING)
+        start = time.monotonic()
+
+        try:
+            with path.open(newline='', encoding=options['encoding']) as lines:
+                result = import_transactions(
+                    user,
+                    self.parse(lines, file_format, options),
+                    rules,
+                    chunk_size=options['chunk_size'],
+                    spend_sign=1 if options['spend_positive'] else -1,
+                    atomic=options['atomic']
+                )
+        except ValueError as error:
+            kept = 'nothing was imported' if options['atomic'] else \
+                'the chunks before it were imported'
+            raise CommandError(f'{error}, {kept}') from error
+
+        self.stdout.write(f'{result} in {time.monotonic() - start:.1f}s')
+
+    @staticmethod
+    def parse(lines, file_format, options):
+        '''Returns the rows parsed from the export's lines'''
+        if file_format == 'csv':
+            return PARSERS['csv'](
+                lines,
+                date_format=options['date_format'],
+                columns=options['columns']
+            )
+        return PARSERS[file_format](lines)
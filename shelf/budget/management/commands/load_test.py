@@ -0,0 +1,109 @@
+'''Contains the load_test command'''
+
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.management.commands.benchmark import percentile
+from shelf.budget.models import User, MonthlyBudget
+
+DASHBOARD_QUERY = '''query Dashboard($year: String, $fromYear: Int!, $toYear: Int!) {
+    monthlyBudgets(year: $year) {
+        id month net categories { id label spent monthlyAmount transactionCount }
+    }
+    allBudgetYears
+    spendingHistory(fromYear: $fromYear, toYear: $toYear) { year month label spent }
+}'''
+
+class Command(BaseCommand):
+    '''Measures the throughput of a running server under concurrent GraphQL requests'''
+
+    help = (
+        'Sends a multi root field dashboard query from many concurrent clients to a running '
+        'server (e.g. runserver/WSGI or uvicorn shelf.asgi:application) and reports throughput'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='?', default='http://localhost:8000/graphql')
+        parser.add_argument('--username', default='seed0', help='User the requests run as')
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for')
+        parser.add_argument(
+            '--no-cache',
+            action='store_true',
+            help='Vary every request so the result cache never answers it'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist as error:
+            raise CommandError(f"User {options['username']} does not exist") from error
+
+        latest = MonthlyBudget.objects.filter(user=user).order_by('date').last()
+        year = latest.date.year if latest else 2020
+        headers = {'Authorization': f'JWT {get_token(user)}', 'Content-Type': 'application/json'}
+        variables = {'year': str(year), 'fromYear': year - 1, 'toYear': year}
+
+        latencies, statuses, elapsed = self.run_clients(options, headers, variables)
+        if not latencies:
+            raise CommandError('No requests completed')
+
+        self.stdout.write(
+            f'{len(latencies)} requests in {elapsed:.1f}s: '
+            f'{len(latencies) / elapsed:.1f} req/s with {options["concurrency"]} clients'
+        )
+        self.stdout.write(
+            f'latency p50 {percentile(latencies, 0.5):.1f}ms  '
+            f'p95 {percentile(latencies, 0.95):.1f}ms  p99 {percentile(latencies, 0.99):.1f}ms'
+        )
+        self.stdout.write('status ' + '  '.join(
+            f'{status}: {count}' for status, count in sorted(statuses.items(), key=str)
+        ))
+
+    @staticmethod
+    def run_clients(options, headers, variables):
+        '''
+        Sends the dashboard query from concurrent clients until the duration
+        is up, returning the latencies, the count of each status and the time taken
+        '''
+        deadline = time.monotonic() + options['duration']
+        latencies = []
+        statuses = Counter()
+        lock = threading.Lock()
+        sequence = iter(range(10 ** 12))
+
+        def client():
+            while time.monotonic() < deadline:
+                body = {'query': DASHBOARD_QUERY, 'variables': dict(variables)}
+                if options['no_cache']:
+                    with lock:
+                        body['variables']['nonce'] = next(sequence)
+                start = time.perf_counter()
+                request = Request(options['url'], json.dumps(body).encode(), headers)
+                try:
+                    with urlopen(request) as response:
+                        response.read()
+                        status = response.status
+                except HTTPError as error:
+                    status = error.code
+                except URLError:
+                    status = 'error'
+                with lock:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    statuses[status] += 1
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as clients:
+            for _ in range(options['concurrency']):
+                clients.submit(client)
+        elapsed = time.monotonic() - started
+
+        return latencies, statuses, elapsed
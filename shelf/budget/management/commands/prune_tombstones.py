@@ -0,0 +1,25 @@
+'''Contains the prune_tombstones command'''
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from shelf.budget.models import Tombstone
+
+class Command(BaseCommand):
+    '''Deletes tombstones older than delta sync serves'''
+
+    help = (
+        "Deletes tombstones older than GRAPHQL_DELTA_SYNC['TOMBSTONE_DAYS'], whose "
+        "cursors changesSince answers with a full reset anyway"
+    )
+
+    def handle(self, *args, **options):
+        days = settings.GRAPHQL_DELTA_SYNC['TOMBSTONE_DAYS']
+        deleted, _ = Tombstone.objects.filter(
+            deleted__lt=now() - timedelta(days=days)
+        ).delete()
+
+        self.stdout.write(f'Deleted {deleted} tombstones older than {days} days')
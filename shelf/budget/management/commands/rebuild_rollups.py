@@ -0,0 +1,56 @@
+'''Contains the rebuild_rollups command'''
+
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shelf.budget.models import MonthlyBudget, MonthlyRollup
+from shelf.cache import bump_user_version, stale_results_warning
+
+class Command(BaseCommand):
+    '''Rebuilds the monthly rollup table from the budget tables'''
+
+    help = 'Rebuilds the monthly spending rollups, for every user or the given ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of budget months recomputed per batch'
+        )
+
+    def handle(self, *args, **options):
+        warning = stale_results_warning()
+        if warning:
+            self.stderr.write(warning, self.style.WARNING)
+        budgets = MonthlyBudget.objects.order_by('user_id', 'date')
+        rollups = MonthlyRollup.objects.all()
+        if options['usernames']:
+            budgets = budgets.filter(user__username__in=options['usernames'])
+            rollups = rollups.filter(user__username__in=options['usernames'])
+
+        start = time.monotonic()
+        rebuilt = 0
+        with transaction.atomic():
+            user_ids = set(rollups.values_list('user_id', flat=True).distinct())
+            rollups.delete()
+
+            months = budgets.values_list('user_id', 'date').iterator()
+            while True:
+                chunk = list(islice(months, options['chunk_size']))
+                if not chunk:
+                    break
+
+                MonthlyRollup.objects.refresh(chunk)
+                user_ids.update(user_id for user_id, _ in chunk)
+                rebuilt += len(chunk)
+
+        # cached results, insights among them, were computed from the old rollups
+        for user_id in user_ids:
+            bump_user_version(user_id)
+
+        self.stdout.write(f'Rebuilt {rebuilt} budget months in {time.monotonic() - start:.1f}s')
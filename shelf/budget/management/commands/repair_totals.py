@@ -0,0 +1,90 @@
+'''Contains the repair_totals command'''
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Abs
+from django.utils.timezone import now
+
+from shelf.budget.models import MonthlyBudget, Category, MonthlyRollup
+from shelf.cache import bump_user_version, stale_results_warning
+
+TOLERANCE = 0.005
+
+class Command(BaseCommand):
+    '''Verifies stored spent/net totals against transactions and repairs any drift'''
+
+    help = 'Verifies stored category and budget totals and repairs any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only report drifted rows, without repairing them'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows written per UPDATE'
+        )
+
+    def handle(self, *args, **options):
+        warning = None if options['check'] else stale_results_warning()
+        if warning:
+            self.stderr.write(warning, self.style.WARNING)
+
+        with transaction.atomic():
+            categories = self.repair(
+                Category.objects.with_totals(), 'spent', 'computed_spent', options
+            )
+            budgets = self.repair(
+                MonthlyBudget.objects.with_totals(), 'net', 'computed_net', options
+            )
+            budget_ids = {category.budget_id for category in categories} | \
+                {budget.id for budget in budgets}
+            if not options['check']:
+                MonthlyRollup.objects.refresh_budgets(budget_ids)
+
+        if not options['check']:
+            # cached results, insights among them, show the drifted totals
+            repaired = MonthlyBudget.objects.filter(id__in=budget_ids)
+            for user_id in set(repaired.values_list('user_id', flat=True)):
+                bump_user_version(user_id)
+
+        verb = 'Found' if options['check'] else 'Repaired'
+        self.stdout.write(
+            f'{verb} {len(categories)} categories and {len(budgets)} budgets with drift'
+        )
+
+    def repair(self, queryset, field, computed, options):
+        '''
+        Finds rows whose stored total differs from the computed one and fixes
+        them. Unless only checking, the rows are locked and their totals read
+        again before writing: a write committed since the first read has
+        already added its F() delta, and later ones wait for the repair
+        '''
+        drifted = queryset.annotate(
+            drift=Abs(F(field) - F(computed))
+        ).filter(drift__gt=TOLERANCE).order_by('pk')
+        if not options['check']:
+            locked = queryset.model.objects.select_for_update().filter(
+                pk__in=drifted.values('pk')
+            ).order_by('pk')
+            drifted = drifted.filter(pk__in=list(locked.values_list('pk', flat=True)))
+        drifted = list(drifted)
+
+        for row in drifted:
+            self.stdout.write(
+                f'{queryset.model.__name__} {row.pk}: {field} is {getattr(row, field)}, '
+                f'expected {getattr(row, computed)}'
+            )
+            setattr(row, field, getattr(row, computed))
+            row.modified = now()
+
+        if not options['check']:
+            queryset.model.objects.bulk_update(
+                drifted, [field, 'modified'], batch_size=options['batch_size']
+            )
+
+        return drifted
@@ -0,0 +1,119 @@
+'''Contains the rollover_month command'''
+
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from itertools import islice
+
+import django
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connections
+
+from shelf.budget.models import User, MonthlyBudget
+from shelf.cache import bump_user_version, stale_results_warning
+
+RETRIES = 3
+
+def roll_over_chunk(user_ids, month):
+    '''
+    Rolls a chunk of users over to month and invalidates their cached
+    results, retrying when a user created the month's budget themselves
+    while the chunk was being copied
+    '''
+    attempt = 1
+    while True:
+        try:
+            counts = MonthlyBudget.objects.roll_over(user_ids, month)
+            for user_id in user_ids:
+                bump_user_version(user_id)
+            return (len(user_ids), *counts)
+        except IntegrityError:
+            if attempt == RETRIES:
+                raise
+            attempt += 1
+
+def init_worker():
+    '''Sets Django up in a pool process, which must not reuse the parent's connections'''
+    django.setup()
+    connections.close_all()
+
+class Command(BaseCommand):
+    '''Creates a month's budgets for every user in one batch'''
+
+    help = (
+        "Creates the month's budget (next month by default) for every user who has "
+        "none yet, copying categories and recurring transactions from their latest "
+        "budget. Safe to re-run: users who already have the month are skipped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='Month to create, as YYYY-MM')
+        parser.add_argument('--workers', type=int, default=4, help='Worker processes')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=200,
+            help='Number of users rolled over per transaction'
+        )
+
+    def handle(self, *args, **options):
+        month = self.target_month(options['month'])
+        warning = stale_results_warning()
+        if warning:
+            self.stderr.write(warning, self.style.WARNING)
+        user_ids = list(User.objects.filter(budgets__date__lt=month).exclude(
+            budgets__date=month
+        ).distinct().order_by('id').values_list('id', flat=True))
+        ids = iter(user_ids)
+        chunks = list(iter(lambda: list(islice(ids, options['chunk_size'])), []))
+        self.stdout.write(
+            f"Rolling {len(user_ids)} users over to {month:%B %Y} in {len(chunks)} chunks"
+        )
+
+        start = time.monotonic()
+        users, budgets, categories, transactions = self.roll_over(
+            chunks, month, options['workers'], len(user_ids)
+        )
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {budgets} budgets, {categories} categories and {transactions} '
+            f'transactions for {users} users in {elapsed:.1f}s'
+        ))
+
+    @staticmethod
+    def target_month(value):
+        '''Parses the --month option, defaulting to next month'''
+        if not value:
+            return date.today().replace(day=1) + relativedelta(months=1)
+        try:
+            return datetime.strptime(value, '%Y-%m').date()
+        except ValueError as error:
+            raise CommandError(f'Invalid month {value}, expected YYYY-MM') from error
+
+    def roll_over(self, chunks, month, workers, total_users):
+        '''Rolls the chunks over, in worker processes if there are several, summing their counts'''
+        start = time.monotonic()
+        totals = [0, 0, 0, 0]
+        if workers > 1:
+            # forked workers must open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(workers, initializer=init_worker) as pool:
+                futures = [pool.submit(roll_over_chunk, chunk, month) for chunk in chunks]
+                for future in as_completed(futures):
+                    self.report(totals, future.result(), total_users, start)
+        else:
+            for chunk in chunks:
+                self.report(totals, roll_over_chunk(chunk, month), total_users, start)
+        return totals
+
+    def report(self, totals, counts, total_users, start):
+        '''Adds a chunk's counts to the totals and prints progress'''
+        for index, count in enumerate(counts):
+            totals[index] += count
+
+        elapsed = max(time.monotonic() - start, 1e-6)
+        self.stdout.write(
+            f'{totals[0]}/{total_users} users, {totals[1]} budgets '
+            f'({totals[1] / elapsed:.0f} budgets/s)'
+        )
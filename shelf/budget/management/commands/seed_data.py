@@ -0,0 +1,140 @@
+'''Contains the seed_data command'''
+
+import random
+import time
+from datetime import date
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction as db_transaction
+
+from shelf.budget.models import User, MonthlyBudget, Category, Transaction, MonthlyRollup
+
+CATEGORY_LABELS = [
+    'Rent', 'Groceries', 'Utilities', 'Transport', 'Dining', 'Health', 'Insurance',
+    'Entertainment', 'Clothing', 'Gifts', 'Travel', 'Education', 'Savings', 'Pets',
+    'Subscriptions', 'Household', 'Personal care', 'Charity', 'Phone', 'Misc',
+]
+SOURCES = [
+    'Safeway', 'Whole Foods', 'Shell', 'Amazon', 'Netflix', 'Comcast', 'Uber',
+    'Walgreens', 'Target', 'Costco', 'Starbucks', 'PG&E', 'Delta', 'Chipotle',
+]
+
+ROLLUP_CHUNK_SIZE = 500
+
+class Command(BaseCommand):
+    '''Generates a deterministic synthetic dataset for load testing and benchmarks'''
+
+    help = 'Bulk inserts seeded users with monthly budgets, categories and transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument(
+            '--years', type=int, default=2, help='Years of monthly budgets per user'
+        )
+        parser.add_argument('--start-year', type=int, default=2020)
+        parser.add_argument('--categories', type=int, default=8, help='Categories per budget')
+        parser.add_argument(
+            '--transactions', type=int, default=20, help='Transactions per category'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+        parser.add_argument(
+            '--prefix', default='seed', help='Usernames are <prefix>0, <prefix>1, ...'
+        )
+        parser.add_argument('--password', default='password')
+        parser.add_argument(
+            '--flush', action='store_true', help='Delete existing users with the prefix first'
+        )
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['categories'] > len(CATEGORY_LABELS):
+            raise CommandError(f'At most {len(CATEGORY_LABELS)} categories per budget')
+
+        usernames = [f"{options['prefix']}{index}" for index in range(options['users'])]
+        existing = User.objects.filter(username__in=usernames)
+        if options['flush']:
+            existing.delete()
+        elif existing.exists():
+            raise CommandError('Seeded users already exist, pass --flush to replace them')
+
+        start = time.monotonic()
+        rand = random.Random(options['seed'])
+        password = make_password(options['password'])
+
+        with db_transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=username, email=f'{username}@example.com', password=password)
+                for username in usernames
+            ])
+            budgets, categories, created = self.create_budgets(rand, users, options)
+
+        self.stdout.write(
+            f'Created {len(users)} users, {len(budgets)} budgets, {len(categories)} '
+            f'categories and {created} transactions in {time.monotonic() - start:.1f}s'
+        )
+
+    def create_budgets(self, rand, users, options):
+        '''
+        Bulk inserts the users' monthly budgets with their categories and transactions,
+        then fills in the totals and rollups
+        '''
+        batch_size = options['batch_size']
+        months = [
+            date(options['start_year'] + index // 12, index % 12 + 1, 1)
+            for index in range(options['years'] * 12)
+        ]
+        budgets = MonthlyBudget.objects.bulk_create([
+            MonthlyBudget(user=user, date=month, income=rand.randrange(3000, 9000, 100))
+            for user in users for month in months
+        ], batch_size=batch_size)
+
+        categories = Category.objects.bulk_create([
+            Category(budget=budget, label=label, monthly_amount=rand.randrange(50, 1500, 50))
+            for budget in budgets
+            for label in rand.sample(CATEGORY_LABELS, options['categories'])
+        ], batch_size=batch_size)
+
+        created = self.create_transactions(rand, categories, options['transactions'], batch_size)
+
+        Category.objects.bulk_update(categories, ['spent'], batch_size=batch_size)
+        for budget in budgets:
+            budget.net = budget.income
+        for category in categories:
+            category.budget.net -= category.spent
+        MonthlyBudget.objects.bulk_update(budgets, ['net'], batch_size=batch_size)
+
+        for index in range(0, len(budgets), ROLLUP_CHUNK_SIZE):
+            MonthlyRollup.objects.refresh(
+                (budget.user_id, budget.date)
+                for budget in budgets[index:index + ROLLUP_CHUNK_SIZE]
+            )
+        return budgets, categories, created
+
+    @staticmethod
+    def create_transactions(rand, categories, per_category, batch_size):
+        '''Bulk inserts transactions batch by batch, adding them to each category's spent'''
+        def generate():
+            for category in categories:
+                month = category.budget.date
+                for _ in range(per_category):
+                    amount = round(rand.uniform(1, 2 * category.monthly_amount / per_category), 2)
+                    category.spent += amount
+                    yield Transaction(
+                        category=category,
+                        amount=amount,
+                        source=rand.choice(SOURCES),
+                        date=month.replace(day=rand.randint(1, 28)),
+                        recurring=rand.random() < 0.1,
+                        description=f'{category.label} purchase'
+                    )
+
+        created = 0
+        transactions = generate()
+        while True:
+            batch = list(islice(transactions, batch_size))
+            if not batch:
+                return created
+            Transaction.objects.bulk_create(batch)
+            created += len(batch)
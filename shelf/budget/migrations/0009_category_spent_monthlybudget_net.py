@@ -0,0 +1,42 @@
+# Generated by Django 3.2.7 on 2021-12-04 18:30
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_totals(apps, schema_editor):
+    Category = apps.get_model('budget', 'Category')
+    MonthlyBudget = apps.get_model('budget', 'MonthlyBudget')
+    Transaction = apps.get_model('budget', 'Transaction')
+
+    spent = Transaction.objects.filter(category=OuterRef('pk')).values('category').annotate(
+        total=Sum('amount')
+    ).values('total')
+    Category.objects.update(spent=Coalesce(Subquery(spent), Value(0.0)))
+
+    categories_spent = Category.objects.filter(budget=OuterRef('pk')).values('budget').annotate(
+        total=Sum('spent')
+    ).values('total')
+    MonthlyBudget.objects.update(net=F('income') - Coalesce(Subquery(categories_spent), Value(0.0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0008_alter_monthlybudget_income'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='spent',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='monthlybudget',
+            name='net',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.RunPython(populate_totals, migrations.RunPython.noop),
+    ]
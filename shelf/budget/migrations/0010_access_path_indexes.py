@@ -0,0 +1,29 @@
+# Generated by Django 3.2.7 on 2021-12-05 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0009_category_spent_monthlybudget_net'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['budget', 'created'], name='category_budget_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', 'date'], name='transaction_category_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('recurring', True)), fields=['category'], name='transaction_recurring_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlybudget',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='unique_user_month_budget'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 3.2.7 on 2021-12-11 16:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def populate_rollups(apps, schema_editor):
+    MonthlyBudget = apps.get_model('budget', 'MonthlyBudget')
+    Category = apps.get_model('budget', 'Category')
+    MonthlyRollup = apps.get_model('budget', 'MonthlyRollup')
+
+    rollups = {}
+    for budget in MonthlyBudget.objects.iterator():
+        rollups[budget.id, None] = MonthlyRollup(
+            user_id=budget.user_id,
+            year=budget.date.year,
+            month=budget.date.month,
+            budgeted=budget.income
+        )
+
+    for category in Category.objects.annotate(transaction_count=Count('transactions')).iterator():
+        total = rollups[category.budget_id, None]
+        key = (category.budget_id, category.label)
+        if key not in rollups:
+            rollups[key] = MonthlyRollup(
+                user_id=total.user_id, year=total.year, month=total.month, label=category.label
+            )
+
+        for rollup in (total, rollups[key]):
+            rollup.spent += category.spent
+            rollup.count += category.transaction_count
+        rollups[key].budgeted += category.monthly_amount
+
+    MonthlyRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0010_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('label', models.CharField(max_length=100, null=True)),
+                ('spent', models.FloatField(default=0.0)),
+                ('count', models.IntegerField(default=0)),
+                ('budgeted', models.FloatField(default=0.0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('label__isnull', False)), fields=('user', 'year', 'month', 'label'), name='unique_user_month_label_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyrollup',
+            constraint=models.UniqueConstraint(condition=models.Q(('label__isnull', True)), fields=('user', 'year', 'month'), name='unique_user_month_total_rollup'),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
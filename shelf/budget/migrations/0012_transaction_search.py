@@ -0,0 +1,36 @@
+# Generated by Django 3.2.7 on 2021-12-19 11:05
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0011_monthlyrollup'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunSQL(
+            sql=[
+                '''
+                ALTER TABLE budget_transaction ADD COLUMN search_vector tsvector
+                GENERATED ALWAYS AS (
+                    setweight(to_tsvector('english', coalesce(source, '')), 'A') ||
+                    setweight(to_tsvector('english', coalesce(description, '')), 'B')
+                ) STORED
+                ''',
+                'CREATE INDEX transaction_search_idx ON budget_transaction USING gin (search_vector)',
+                '''
+                CREATE INDEX transaction_search_trgm_idx ON budget_transaction
+                USING gin ((source || ' ' || description) gin_trgm_ops)
+                ''',
+            ],
+            reverse_sql=[
+                'DROP INDEX transaction_search_trgm_idx',
+                'DROP INDEX transaction_search_idx',
+                'ALTER TABLE budget_transaction DROP COLUMN search_vector',
+            ],
+        ),
+    ]
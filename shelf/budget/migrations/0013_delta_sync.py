@@ -0,0 +1,46 @@
+# Generated by Django 3.2.7 on 2021-12-20 18:24
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0012_transaction_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.IntegerField()),
+                ('deleted', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['budget', 'modified'], name='category_budget_modified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='monthlybudget',
+            index=models.Index(fields=['user', 'modified'], name='budget_user_modified_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', 'modified'], name='transaction_modified_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'deleted'], name='tombstone_user_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.7 on 2021-12-22 20:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def replace_foreign_key(table, name, column, target, on_delete=''):
+    '''Re-creates a foreign key constraint under its Django name with another ON DELETE action'''
+    return f'''
+        ALTER TABLE {table}
+        DROP CONSTRAINT {name},
+        ADD CONSTRAINT {name} FOREIGN KEY ({column}) REFERENCES {target} (id)
+        {on_delete} DEFERRABLE INITIALLY DEFERRED
+    '''
+
+
+CATEGORY_BUDGET = (
+    'budget_category',
+    'budget_category_budget_id_96d850b6_fk_budget_monthlybudget_id',
+    'budget_id',
+    'budget_monthlybudget',
+)
+TRANSACTION_CATEGORY = (
+    'budget_transaction',
+    'budget_transaction_category_id_a7dd94ad_fk_budget_category_id',
+    'category_id',
+    'budget_category',
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0013_delta_sync'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='category',
+            name='budget',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='categories', to='budget.monthlybudget'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='transactions', to='budget.category'),
+        ),
+        migrations.RunSQL(
+            sql=[
+                replace_foreign_key(*CATEGORY_BUDGET, on_delete='ON DELETE CASCADE'),
+                replace_foreign_key(*TRANSACTION_CATEGORY, on_delete='ON DELETE CASCADE'),
+            ],
+            reverse_sql=[
+                replace_foreign_key(*TRANSACTION_CATEGORY),
+                replace_foreign_key(*CATEGORY_BUDGET),
+            ],
+        ),
+    ]
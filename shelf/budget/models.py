@@ -1,7 +1,15 @@
-'''Models for budget app (User, MonthlyBudget, Category, Transaction)'''
+'''Models for budget app (User, MonthlyBudget, Category, Transaction, MonthlyRollup, Tombstone)'''
 
-from django.db import models
+from collections import defaultdict
+from django.db import models, transaction as db_transaction
+from django.db.models import (
+    BooleanField, Case, Count, F, FloatField, IntegerField, Max, Q, Sum, Value, When
+)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import AbstractUser
+from django.utils.timezone import now
+from dateutil.relativedelta import relativedelta
 from model_utils.models import TimeStampedModel
 
 class User(AbstractUser, TimeStampedModel):
@@ -10,9 +18,137 @@ class User(AbstractUser, TimeStampedModel):
     first_name = None
     last_name = None
 
+def _by_pk(amounts):
+    '''Builds a CASE expression picking each row's amount by primary key'''
+    return Case(
+        *[When(pk=pk, then=Value(amount)) for pk, amount in amounts.items()],
+        default=Value(0.0),
+        output_field=FloatField()
+    )
+
+class MonthlyBudgetQuerySet(models.QuerySet):
+    '''QuerySet for MonthlyBudget'''
+
+    def with_totals(self):
+        '''Annotates computed_net and transaction_count, aggregated in the database'''
+        return self.annotate(
+            computed_net=F('income') - Coalesce(
+                Sum('categories__transactions__amount'), Value(0.0)
+            ),
+            transaction_count=Count('categories__transactions')
+        )
+
+    def copy_contents(self, pairs):
+        '''
+        Copies the categories and recurring transactions of each source budget
+        into its target budget in a handful of set-wise statements, moving the
+        transactions into the target's month. Returns the number of categories
+        and transactions created
+        '''
+        pairs = {source.pk: (source, target) for source, target in pairs}
+        recurring = list(Transaction.objects.filter(
+            category__budget_id__in=pairs, recurring=True
+        ).order_by('pk'))
+
+        spent = defaultdict(float)
+        counts = defaultdict(int)
+        for transaction in recurring:
+            spent[transaction.category_id] += transaction.amount
+            counts[transaction.category_id] += 1
+
+        with db_transaction.atomic():
+            categories = list(Category.objects.filter(
+                budget_id__in=pairs
+            ).order_by('budget_id', 'pk'))
+            copies = Category.objects.bulk_create([
+                Category(
+                    label=category.label,
+                    monthly_amount=category.monthly_amount,
+                    budget=pairs[category.budget_id][1],
+                    spent=spent[category.id]
+                ) for category in categories
+            ])
+            copied = {category.id: copy for category, copy in zip(categories, copies)}
+            months = {
+                category.id: _months_between(
+                    pairs[category.budget_id][0].date, pairs[category.budget_id][1].date
+                ) for category in categories
+            }
+
+            Transaction.objects.bulk_create([
+                Transaction(
+                    amount=transaction.amount,
+                    source=transaction.source,
+                    date=transaction.date + relativedelta(months=months[transaction.category_id]),
+                    recurring=True,
+                    description=transaction.description,
+                    category_id=copied[transaction.category_id].id
+                ) for transaction in recurring
+            ])
+
+            net = defaultdict(float)
+            for category_id, amount in spent.items():
+                net[copied[category_id].budget_id] -= amount
+            if net:
+                self.model.objects.filter(pk__in=net).update(
+                    net=F('net') + _by_pk(net), modified=now()
+                )
+            MonthlyRollup.objects.add(
+                (copy.budget.user_id, copy.budget.date, copy.label, copy.spent,
+                 counts[category.id], copy.monthly_amount)
+                for category, copy in zip(categories, copies)
+            )
+
+        return len(copies), len(recurring)
+
+    def roll_over(self, user_ids, month):
+        '''
+        Creates the budget for month of each of the users who has none yet,
+        copying their latest earlier budget like AutoCreateMonthlyBudget.
+        Users without an earlier budget are skipped. Returns the number of
+        budgets, categories and transactions created
+        '''
+        with db_transaction.atomic():
+            latest = self.filter(user_id__in=user_ids, date__lt=month).exclude(
+                user_id__in=self.filter(user_id__in=user_ids, date=month).values('user_id')
+            ).values('user_id').annotate(latest=Max('date')).values_list('user_id', 'latest')
+            if not latest:
+                return 0, 0, 0
+
+            sources = list(self.filter(_any_of(
+                Q(user_id=user_id, date=day) for user_id, day in latest
+            )).order_by('user_id'))
+            budgets = self.bulk_create([
+                self.model(
+                    user_id=source.user_id, date=month, income=source.income, net=source.income
+                ) for source in sources
+            ])
+            MonthlyRollup.objects.add(
+                (budget.user_id, budget.date, None, 0.0, 0, budget.income) for budget in budgets
+            )
+            categories, transactions = self.copy_contents(zip(sources, budgets))
+
+        return len(budgets), categories, transactions
+
+    def delete_cascading(self):
+        '''
+        Deletes the budgets with a single DELETE, the database cascading to
+        their categories and transactions, and returns the number of
+        budgets, categories and transactions deleted
+        '''
+        counts = Category.objects.filter(budget__in=self).aggregate(
+            categories=Count('id', distinct=True),
+            transactions=Count('transactions')
+        )
+        budgets, _ = self.delete()
+
+        return budgets, counts['categories'], counts['transactions']
+
 class MonthlyBudget(TimeStampedModel):
     '''Represents a budget for a given month/year'''
 
+    objects = MonthlyBudgetQuerySet.as_manager()
+
     user = models.ForeignKey(
         User,
         related_name='budgets',
@@ -20,41 +156,126 @@ class MonthlyBudget(TimeStampedModel):
     )
     income = models.FloatField()
     date = models.DateField()
+    net = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            # also serves as the (user, date) index every budget lookup filters on
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_user_month_budget')
+        ]
+        indexes = [
+            models.Index(fields=['user', 'modified'], name='budget_user_modified_idx')
+        ]
 
     def copy_from(self, other_budget):
-        '''Copies categories and recurring transactions from another budget'''
-        categories = other_budget.categories.all()
+        '''
+        Copies categories and recurring transactions from another budget,
+        moving the transactions into this budget's month
+        '''
+        MonthlyBudget.objects.copy_contents([(other_budget, self)])
+
+class CategoryQuerySet(models.QuerySet):
+    '''QuerySet for Category'''
 
-        for category in categories:
-            transactions = category.transactions.all()
-            category.id = None
-            category.budget = self
-            category.save()
+    def with_totals(self):
+        '''Annotates computed_spent and transaction_count, aggregated in the database'''
+        return self.annotate(
+            computed_spent=Coalesce(Sum('transactions__amount'), Value(0.0)),
+            transaction_count=Count('transactions')
+        )
 
-            for transaction in transactions:
-                transaction.id = None
-                transaction.category = category
-                transaction.save()
+    def add_spent(self, amounts, count=0):
+        '''
+        Adds (category, amount) pairs to the stored spent of each category,
+        subtracts them from the stored net of the owning budgets and adds
+        them, with count transactions per pair, to the monthly rollups
+        '''
+        spent = defaultdict(float)
+        counts = defaultdict(int)
+        net = defaultdict(float)
+        for category, amount in amounts:
+            spent[category.pk] += amount
+            counts[category.pk] += count
+            net[category.budget_id] -= amount
+
+        if not spent:
+            return
+
+        # update() skips TimeStampedModel's modified, which delta sync relies on
+        self.model.objects.filter(pk__in=spent).update(
+            spent=F('spent') + _by_pk(spent), modified=now()
+        )
+        MonthlyBudget.objects.filter(pk__in=net).update(
+            net=F('net') + _by_pk(net), modified=now()
+        )
+        # read once the category rows are locked, so a concurrent rename is already visible
+        MonthlyRollup.objects.add(
+            (user_id, day, label, spent[pk], counts[pk], 0.0)
+            for pk, label, user_id, day in self.model.objects.filter(pk__in=spent).values_list(
+                'pk', 'label', 'budget__user_id', 'budget__date'
+            )
+        )
+
+    def delete_cascading(self):
+        '''
+        Deletes the categories with a single DELETE, the database cascading to
+        their transactions, and returns the number of categories and
+        transactions deleted
+        '''
+        transactions = Transaction.objects.filter(category__in=self).count()
+        categories, _ = self.delete()
+
+        return categories, transactions
 
 class Category(TimeStampedModel):
     '''Represents a specific category for a budget (i.e. food, rent, etc.)'''
 
+    objects = CategoryQuerySet.as_manager()
+
     verbose_name_plural = "categories"
 
     label = models.CharField(max_length=100)
     budget = models.ForeignKey(
         MonthlyBudget,
         related_name='categories',
-        on_delete=models.CASCADE
+        # ON DELETE CASCADE in the database, so deleting budgets is a single DELETE
+        on_delete=models.DO_NOTHING
     )
     monthly_amount = models.IntegerField()
+    spent = models.FloatField(default=0.0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['budget', 'created'], name='category_budget_created_idx'),
+            models.Index(fields=['budget', 'modified'], name='category_budget_modified_idx')
+        ]
 
     def __str__(self):
         return self.label
 
-    def spent(self):
-        '''Calculates the cost of all related transactions'''
-        return sum(t.amount for t in self.transactions.all())
+class TransactionQuerySet(models.QuerySet):
+    '''QuerySet for Transaction'''
+
+    def search(self, terms):
+        '''
+        Filters to transactions matching terms and annotates their search_rank.
+        Words are matched through the generated search_vector column, and
+        misspelt ones by trigram word similarity with source and description
+        (see migration 0012 for the column and the GIN indexes serving both)
+        '''
+        table = self.model._meta.db_table
+        document = f'"{table}"."source" || \' \' || "{table}"."description"'
+        query = "websearch_to_tsquery('english', %s)"
+
+        return self.annotate(search_rank=RawSQL(
+            f'ts_rank_cd("{table}"."search_vector", {query}) + word_similarity(%s, {document})',
+            (terms, terms),
+            output_field=FloatField()
+        )).filter(RawSQL(
+            f'"{table}"."search_vector" @@ {query} OR %s <%% ({document})',
+            (terms, terms),
+            output_field=BooleanField()
+        ))
 
 class Transaction(TimeStampedModel):
     '''Represents a specific transaction in a given day'''
@@ -66,9 +287,234 @@ class Transaction(TimeStampedModel):
     category = models.ForeignKey(
         Category,
         related_name='transactions',
-        on_delete=models.CASCADE
+        # ON DELETE CASCADE in the database, so deleting categories is a single DELETE
+        on_delete=models.DO_NOTHING
     )
     description = models.CharField(max_length=200)
 
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'date'], name='transaction_category_date_idx'),
+            models.Index(
+                fields=['category'],
+                condition=models.Q(recurring=True),
+                name='transaction_recurring_idx'
+            ),
+            models.Index(fields=['category', 'modified'], name='transaction_modified_idx')
+        ]
+
     def __str__(self):
         return self.description
+
+class MonthlyRollupQuerySet(models.QuerySet):
+    '''
+    QuerySet for MonthlyRollup. Writes keep the rollups in step by adding
+    their changes to the affected rows; refresh rebuilds months from the
+    budget tables and is only meant for the maintenance commands
+    '''
+
+    def add(self, changes):
+        '''
+        Adds (user_id, date, label, spent, count, budgeted) changes to the
+        rollup rows of their months. The spent and count of a label also go
+        to the month's total row, while changes without a label (income) only
+        apply to the total row. Missing rows are created first, then the sums
+        are added with F() expressions in one UPDATE, so concurrent writes to
+        a month wait on its row locks instead of racing to re-create rows
+        '''
+        deltas = defaultdict(lambda: [0.0, 0, 0.0])
+        for user_id, day, label, spent, count, budgeted in changes:
+            if label is not None:
+                total = deltas[user_id, day.year, day.month, None]
+                total[0] += spent
+                total[1] += count
+
+            delta = deltas[user_id, day.year, day.month, label]
+            delta[0] += spent
+            delta[1] += count
+            delta[2] += budgeted
+
+        if not deltas:
+            return
+
+        rows = {
+            key: Q(user_id=key[0], year=key[1], month=key[2], label=key[3])
+            for key, delta in deltas.items() if any(delta)
+        }
+
+        def by_row(index, output_field):
+            return Case(
+                *[When(row, then=Value(deltas[key][index])) for key, row in rows.items()],
+                default=Value(0),
+                output_field=output_field
+            )
+
+        with db_transaction.atomic(savepoint=False):
+            self.bulk_create([
+                self.model(user_id=user_id, year=year, month=month, label=label)
+                for user_id, year, month, label in deltas
+            ], ignore_conflicts=True)
+            if rows:
+                self.model.objects.filter(_any_of(rows.values())).update(
+                    spent=F('spent') + by_row(0, FloatField()),
+                    count=F('count') + by_row(1, IntegerField()),
+                    budgeted=F('budgeted') + by_row(2, FloatField())
+                )
+
+    def prune(self, user_id, day, labels):
+        '''Deletes the month's rows of labels that none of its budget's categories carry anymore'''
+        remaining = Category.objects.filter(
+            budget__user_id=user_id, budget__date=day, label__in=labels
+        ).values_list('label', flat=True)
+        self.model.objects.filter(
+            user_id=user_id, year=day.year, month=day.month, label__in=set(labels) - set(remaining)
+        ).delete()
+
+    def move(self, user_id, previous, day):
+        '''Moves the rows of a month to another one, after its budget's date changed'''
+        self.model.objects.filter(
+            user_id=user_id, year=previous.year, month=previous.month
+        ).update(year=day.year, month=day.month)
+
+    def delete_months(self, months):
+        '''Deletes the rows of (user_id, date) months whose budgets were deleted'''
+        self.model.objects.filter(_any_of(
+            Q(user_id=user_id, year=day.year, month=day.month) for user_id, day in months
+        )).delete()
+
+    def refresh_budgets(self, budget_ids):
+        '''Recomputes the rollup rows of the months the given budgets belong to'''
+        self.refresh(MonthlyBudget.objects.filter(pk__in=budget_ids).values_list('user_id', 'date'))
+
+    def refresh(self, months):
+        '''
+        Recomputes the rollup rows of (user_id, date) months from the stored
+        category totals, replacing whatever was there before
+        '''
+        months = {(user_id, day.replace(day=1)) for user_id, day in months}
+        if not months:
+            return
+
+        rollups = {}
+        with db_transaction.atomic():
+            self.model.objects.filter(_any_of(
+                Q(user_id=user_id, year=day.year, month=day.month) for user_id, day in months
+            )).delete()
+
+            for budget in MonthlyBudget.objects.filter(_any_of(
+                    Q(user_id=user_id, date=day) for user_id, day in months
+            )):
+                rollups[budget.id, None] = self.model(
+                    user_id=budget.user_id,
+                    year=budget.date.year,
+                    month=budget.date.month,
+                    label=None,
+                    budgeted=budget.income
+                )
+
+            for category in Category.objects.filter(budget_id__in=[
+                    budget_id for budget_id, _ in rollups
+            ]).annotate(transaction_count=Count('transactions')):
+                total = rollups[category.budget_id, None]
+                if (category.budget_id, category.label) not in rollups:
+                    rollups[category.budget_id, category.label] = self.model(
+                        user_id=total.user_id,
+                        year=total.year,
+                        month=total.month,
+                        label=category.label
+                    )
+
+                for rollup in (total, rollups[category.budget_id, category.label]):
+                    rollup.spent += category.spent
+                    rollup.count += category.transaction_count
+                    if rollup is not total:
+                        rollup.budgeted += category.monthly_amount
+
+            self.model.objects.bulk_create(rollups.values())
+
+def _months_between(earlier, later):
+    '''Number of calendar months from one date to another'''
+    return (later.year - earlier.year) * 12 + later.month - earlier.month
+
+def _any_of(conditions):
+    '''ORs Q objects together'''
+    combined = Q(pk__in=[])
+    for condition in conditions:
+        combined |= condition
+
+    return combined
+
+class MonthlyRollup(models.Model):
+    '''
+    Spending per user, month and category label, kept in step with the
+    budget tables. Rows with no label hold the whole month, with the
+    budget's income as the budgeted amount
+    '''
+
+    objects = MonthlyRollupQuerySet.as_manager()
+
+    user = models.ForeignKey(
+        User,
+        related_name='rollups',
+        on_delete=models.CASCADE
+    )
+    year = models.IntegerField()
+    month = models.IntegerField()
+    label = models.CharField(max_length=100, null=True)
+    spent = models.FloatField(default=0.0)
+    count = models.IntegerField(default=0)
+    budgeted = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'year', 'month', 'label'],
+                condition=models.Q(label__isnull=False),
+                name='unique_user_month_label_rollup'
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'year', 'month'],
+                condition=models.Q(label__isnull=True),
+                name='unique_user_month_total_rollup'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.year}-{self.month:02} {self.label or "total"}'
+
+class TombstoneQuerySet(models.QuerySet):
+    '''QuerySet for Tombstone'''
+
+    def record(self, user, model, ids):
+        '''Records that the rows of model with the given ids were deleted'''
+        self.bulk_create([
+            self.model(user=user, model=model.__name__, object_id=pk) for pk in ids
+        ])
+
+class Tombstone(models.Model):
+    '''
+    Records a row deleted by one of the delete mutations, so delta sync
+    clients drop it too. Only the deleted row itself is recorded: clients
+    drop the categories and transactions under a deleted budget or category
+    '''
+
+    objects = TombstoneQuerySet.as_manager()
+
+    user = models.ForeignKey(
+        User,
+        related_name='tombstones',
+        on_delete=models.CASCADE
+    )
+    model = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    deleted = models.DateTimeField(default=now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted'], name='tombstone_user_deleted_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
@@ -0,0 +1 @@
+'''Tests for the budget app and the GraphQL API serving it'''
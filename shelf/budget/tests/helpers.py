@@ -0,0 +1,70 @@
+'''Users, budgets and operations shared by the tests'''
+
+from django.test import RequestFactory, TestCase
+
+from shelf.budget.models import MonthlyBudget, Category, MonthlyRollup, User
+from shelf.cache import get_result_cache
+from shelf.schema import schema
+
+def execute(user, query, variables=None):
+    '''Runs an operation as user like the GraphQL view would, without the HTTP layer'''
+    request = RequestFactory().post('/graphql')
+    request.user = user
+    return schema.execute(query, context_value=request, variables=variables)
+
+def create_user(test):
+    '''
+    Creates the user a test runs as. Usernames differ per test, as tokens
+    minted within the same second would otherwise hit the cached user of an
+    earlier test
+    '''
+    return User.objects.create_user(test.id(), password='password')
+
+def create_budget(user, day, income=3000.0, labels=('Groceries', 'Rent')):
+    '''Creates a budget and its categories directly, with nothing spent yet'''
+    budget = MonthlyBudget.objects.create(user=user, date=day, income=income, net=income)
+    categories = [
+        Category.objects.create(budget=budget, label=label, monthly_amount=100)
+        for label in labels
+    ]
+    MonthlyRollup.objects.refresh([(user.id, day)])
+    return budget, categories
+
+class GraphQLTestCase(TestCase):
+    '''Runs operations as a fresh user, with an empty result cache'''
+
+    def setUp(self):
+        get_result_cache().backend.clear()
+        self.user = create_user(self)
+
+    def execute(self, query, **variables):
+        '''Runs an operation, failing the test if it reports errors'''
+        result = execute(self.user, query, variables)
+        self.assertIsNone(result.errors)
+        return result.data
+
+CREATE_BUDGET = '''mutation($year: String, $month: String, $income: Int) {
+    createMonthlyBudget(year: $year, month: $month, income: $income) { monthlyBudget { id } }
+}'''
+EDIT_BUDGET = '''mutation($id: ID, $year: String, $month: String, $income: Int) {
+    editMonthlyBudget(id: $id, year: $year, month: $month, income: $income) {
+        monthlyBudget { id }
+    }
+}'''
+CREATE_CATEGORY = '''mutation($budgetId: ID, $label: String) {
+    createCategory(label: $label, monthlyAmount: 200, budgetId: $budgetId) { category { id } }
+}'''
+EDIT_CATEGORY = '''mutation($id: ID, $label: String, $amount: Int) {
+    editCategory(id: $id, label: $label, monthlyAmount: $amount) { category { id } }
+}'''
+CREATE_TRANSACTION = '''mutation($categoryId: ID, $amount: Float, $recurring: Boolean) {
+    createTransaction(
+        amount: $amount, source: "Shop", day: 3, description: "test",
+        categoryId: $categoryId, recurring: $recurring
+    ) { transaction { id } }
+}'''
+EDIT_TRANSACTION = '''mutation($id: ID, $amount: Float) {
+    editTransaction(
+        id: $id, amount: $amount, source: "Shop", day: 5, description: "edited", recurring: false
+    ) { transaction { id } }
+}'''
@@ -0,0 +1,108 @@
+'''Tests for the ASGI endpoints'''
+
+import asyncio
+import json
+from datetime import date
+
+from django.contrib.auth.models import AnonymousUser
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.models import Transaction
+from shelf.budget.tests.helpers import create_budget, create_user
+from shelf.cache import get_result_cache
+from shelf.concurrency import Overloaded, RequestLimiter, StreamingASGIHandler
+from shelf.views import ConcurrentGraphQLView, ShelfGraphQLView
+
+DASHBOARD = '''query Dashboard($id: ID!) {
+    allBudgetYears
+    category(id: $id) { label spent }
+    allCategories(budgetId: 0) { id }
+}'''
+
+class ConcurrentViewTest(TransactionTestCase):
+    '''
+    The async view resolves root fields on the DB thread pool with the same
+    results as the regular view. A TransactionTestCase, as pool threads use
+    their own connections
+    '''
+
+    def setUp(self):
+        get_result_cache().backend.clear()
+        self.user = create_user(self)
+        _, (self.category, _) = create_budget(self.user, date(2021, 3, 1))
+        Transaction.objects.create(
+            category=self.category, amount=40, source='Shop', description='test',
+            date=date(2021, 3, 2)
+        )
+
+    def request(self, query, **variables):
+        '''Builds a JSON request for the views, authenticated by JWT'''
+        request = RequestFactory().post(
+            '/graphql', json.dumps({'query': query, 'variables': variables}),
+            content_type='application/json', HTTP_AUTHORIZATION=f'JWT {get_token(self.user)}'
+        )
+        request.user = AnonymousUser()
+        return request
+
+    def test_root_fields(self):
+        '''A query with several root fields gets the regular view's response'''
+        view = ConcurrentGraphQLView.as_async_view()
+        response = asyncio.run(view(self.request(DASHBOARD, id=self.category.id)))
+        get_result_cache().backend.clear()
+        expected = ShelfGraphQLView.as_view()(self.request(DASHBOARD, id=self.category.id))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), json.loads(expected.content))
+        self.assertEqual(
+            list(json.loads(response.content)['data']),
+            ['allBudgetYears', 'category', 'allCategories']
+        )
+
+    def test_streaming(self):
+        '''/export streams every row under the ASGI handler'''
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/export', 'query_string': b'format=ndjson',
+            'headers': [
+                (b'host', b'testserver'),
+                (b'authorization', f'JWT {get_token(self.user)}'.encode()),
+            ],
+        }
+        asyncio.run(StreamingASGIHandler()(scope, receive, send))
+
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertEqual([json.loads(line)['amount'] for line in body.splitlines()], [40])
+        self.assertFalse(messages[-1].get('more_body'))
+
+class RequestLimiterTest(SimpleTestCase):
+    '''Requests beyond the slots and queue are turned away'''
+
+    def test_overloaded(self):
+        '''A full queue rejects straight away and a queued request times out'''
+        async def run():
+            limiter = RequestLimiter(max_concurrent=1, max_queued=1, timeout=0.05)
+
+            async def wait_for_slot():
+                async with limiter.slot():
+                    pass
+
+            async with limiter.slot():
+                queued = asyncio.ensure_future(wait_for_slot())
+                await asyncio.sleep(0)
+                with self.assertRaisesMessage(Overloaded, '2 requests already'):
+                    async with limiter.slot():
+                        pass
+                with self.assertRaisesMessage(Overloaded, 'No execution slot within 0.05s'):
+                    await queued
+            self.assertEqual(limiter.admitted, 0)
+
+        asyncio.run(run())
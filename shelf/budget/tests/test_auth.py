@@ -0,0 +1,65 @@
+'''Tests for the cached JWT user resolution'''
+
+import time
+from unittest import mock
+
+from django.test import RequestFactory, TestCase
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.shortcuts import get_token
+
+from shelf.auth import CachedJSONWebTokenBackend, TokenUserCache, get_user_by_token
+from shelf.budget.tests.helpers import create_user
+
+class TokenUserCacheTest(TestCase):
+    '''Tokens resolve to their user without a query until the user changes or it expires'''
+
+    def setUp(self):
+        self.user = create_user(self)
+        self.token = get_token(self.user)
+        self.cache = TokenUserCache(timeout=60)
+        patcher = mock.patch('shelf.auth.get_token_user_cache', return_value=self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached(self):
+        '''A cached token resolves to a copy of its user without any query'''
+        self.assertEqual(get_user_by_token(self.token), self.user)
+        with self.assertNumQueries(0):
+            user = get_user_by_token(self.token)
+
+        self.assertEqual(user, self.user)
+        user.first_name = 'changed'
+        self.assertEqual(get_user_by_token(self.token).first_name, self.user.first_name)
+
+    def test_invalidated(self):
+        '''Saving the user drops their cached lookups'''
+        get_user_by_token(self.token)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(JSONWebTokenError):
+            get_user_by_token(self.token)
+
+    def test_expired(self):
+        '''Entries live at most timeout seconds'''
+        get_user_by_token(self.token)
+        with mock.patch('shelf.auth.time.time', return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get(self.token))
+
+    def test_racing_change(self):
+        '''A lookup that raced with a change to any user isn't cached'''
+        invalidations = self.cache.invalidations
+        self.cache.invalidate(self.user.pk)
+        self.cache.set(self.token, self.user, {}, invalidations)
+
+        self.assertIsNone(self.cache.get(self.token))
+
+    def test_once_per_request(self):
+        '''Authenticating a request again reuses its resolved token'''
+        request = RequestFactory().post('/graphql', HTTP_AUTHORIZATION=f'JWT {self.token}')
+        backend = CachedJSONWebTokenBackend()
+        with mock.patch('shelf.auth.get_user_by_token', return_value=self.user) as lookup:
+            self.assertEqual(backend.authenticate(request), self.user)
+            self.assertEqual(backend.authenticate(request), self.user)
+
+        self.assertEqual(lookup.call_count, 1)
@@ -0,0 +1,72 @@
+'''Tests for /graphql/batch'''
+
+import json
+from datetime import date
+
+from django.test import TransactionTestCase
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.models import Transaction
+from shelf.budget.tests.helpers import CREATE_TRANSACTION, create_budget, create_user
+from shelf.cache import get_result_cache
+
+class BatchTest(TransactionTestCase):
+    '''
+    Each operation of a batch succeeds or fails on its own. A TransactionTestCase,
+    as consecutive queries of a batch run on the DB thread pool's connections
+    '''
+
+    def setUp(self):
+        get_result_cache().backend.clear()
+        self.user = create_user(self)
+        _, (self.category, _) = create_budget(self.user, date(2021, 3, 1))
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'JWT {get_token(self.user)}'
+
+    def batch(self, *entries):
+        '''Posts entries to /graphql/batch, returning the status code and results'''
+        response = self.client.post(
+            '/graphql/batch', json.dumps(list(entries)), content_type='application/json'
+        )
+        return response.status_code, response.json()
+
+    def test_failed_queries(self):
+        '''Invalid queries and resolver errors only fail their own entry'''
+        status, results = self.batch(
+            {'id': 1, 'query': '{ allBudgetYears }'},
+            {'id': 2, 'query': '{ missingField }'},
+            {'id': 3, 'query': 'query($id: ID!) { category(id: $id) { label } }',
+             'variables': {'id': self.category.id}},
+            {'id': 4, 'query': 'query { category(id: 0) { label } }'},
+        )
+
+        self.assertEqual(status, 400)
+        self.assertEqual([result['id'] for result in results], [1, 2, 3, 4])
+        self.assertEqual([result['status'] for result in results], [200, 400, 200, 200])
+        self.assertEqual(results[0]['data'], {'allBudgetYears': ['2021']})
+        self.assertNotIn('data', results[1])
+        self.assertEqual(results[2]['data'], {'category': {'label': 'Groceries'}})
+        self.assertEqual(results[3]['data'], {'category': None})
+        self.assertEqual(len(results[3]['errors']), 1)
+
+    def test_failed_mutations(self):
+        '''A failed mutation leaves the writes of the others in place'''
+        create = {'query': CREATE_TRANSACTION, 'variables': {
+            'categoryId': self.category.id, 'amount': 12.5, 'recurring': False
+        }}
+        status, results = self.batch(
+            create,
+            {'query': CREATE_TRANSACTION, 'variables': {
+                'categoryId': 0, 'amount': 99, 'recurring': False
+            }},
+            create,
+            {'query': 'query($id: ID!) { category(id: $id) { spent } }',
+             'variables': {'id': self.category.id}},
+        )
+
+        self.assertEqual(status, 200)
+        self.assertIsNone(results[0].get('errors'))
+        self.assertIsNone(results[1]['data']['createTransaction'])
+        self.assertIsNone(results[2].get('errors'))
+        # the query after the mutations sees both successful writes
+        self.assertEqual(results[3]['data'], {'category': {'spent': 25.0}})
+        self.assertEqual(Transaction.objects.filter(category=self.category).count(), 2)
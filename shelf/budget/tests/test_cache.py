@@ -0,0 +1,85 @@
+'''Tests for the per-user result cache'''
+
+import json
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.tests.helpers import CREATE_TRANSACTION, GraphQLTestCase, create_budget
+from shelf.cache import (
+    LocalMemoryBackend, check_shared_backend, get_result_cache, stale_results_warning
+)
+
+CATEGORY = 'query($id: ID!) { category(id: $id) { spent } }'
+
+class ResultCacheTest(GraphQLTestCase):
+    '''Repeated queries are served from the cache until the user writes'''
+
+    def setUp(self):
+        super().setUp()
+        _, (self.category, _) = create_budget(self.user, date(2021, 3, 1))
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'JWT {get_token(self.user)}'
+
+    def post(self, query, **variables):
+        '''Posts an operation to /graphql and returns the response body'''
+        return self.client.post(
+            '/graphql', json.dumps({'query': query, 'variables': variables}),
+            content_type='application/json'
+        ).json()
+
+    def test_hits(self):
+        '''A repeated query, however it's formatted, hits the cache with its extensions'''
+        cache = get_result_cache()
+        first = self.post(CATEGORY, id=self.category.id)
+        hits = cache.hits
+        second = self.post(CATEGORY.replace(' ', '\n  '), id=self.category.id)
+
+        self.assertEqual(cache.hits, hits + 1)
+        self.assertEqual(second, first)
+        self.assertIn('cost', second['extensions'])
+
+    def test_invalidation(self):
+        '''A mutation makes the user's cached results unreachable'''
+        self.post(CATEGORY, id=self.category.id)
+        self.post(CREATE_TRANSACTION, categoryId=self.category.id, amount=12.5, recurring=False)
+
+        body = self.post(CATEGORY, id=self.category.id)
+        self.assertEqual(body['data'], {'category': {'spent': 12.5}})
+
+    def test_command_warning(self):
+        '''Commands writing outside the server warn that locmem can't invalidate it'''
+        output = StringIO()
+        call_command('rebuild_rollups', stdout=StringIO(), stderr=output)
+        self.assertIn("The locmem result cache isn't shared", output.getvalue())
+
+class BackendTest(SimpleTestCase):
+    '''Backend behaviour and configuration checks'''
+
+    def test_locmem_expiry(self):
+        '''locmem entries expire and are evicted, while versions are kept'''
+        backend = LocalMemoryBackend(max_entries=2)
+        backend.incr_version('version')
+        with mock.patch('shelf.cache.time.monotonic', return_value=100):
+            backend.set('a', 1, timeout=10)
+            backend.set('b', 2)
+            backend.set('c', 3)
+        with mock.patch('shelf.cache.time.monotonic', return_value=111):
+            self.assertIsNone(backend.get('a'))
+            self.assertEqual((backend.get('b'), backend.get('c')), (2, 3))
+        self.assertEqual(backend.get_version('version'), 1)
+
+    def test_shared_backend(self):
+        '''Several workers need a shared backend, and commands can invalidate through one'''
+        with override_settings(WEB_CONCURRENCY=4):
+            with self.assertRaises(ImproperlyConfigured):
+                check_shared_backend()
+
+        redis = {'BACKEND': 'redis', 'LOCATION': 'redis://localhost', 'TIMEOUT': 300}
+        with override_settings(WEB_CONCURRENCY=4, GRAPHQL_RESULT_CACHE=redis):
+            check_shared_backend()
+            self.assertIsNone(stale_results_warning())
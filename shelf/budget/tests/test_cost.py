@@ -0,0 +1,82 @@
+'''Tests for the query depth and cost limits'''
+
+import json
+
+from django.conf import settings
+from django.test import override_settings
+from graphql import parse
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.tests.helpers import GraphQLTestCase
+from shelf.cost import check_query_cost
+from shelf.schema import schema
+
+NESTED_BUDGETS = '''query($first: Int) {
+    monthlyBudgets(year: "2021") {
+        categories { transactionsConnection(first: $first) { edges { node { id } } } }
+    }
+}'''
+
+class QueryCostTest(GraphQLTestCase):
+    '''Operations over the configured depth or cost are rejected before running'''
+
+    def setUp(self):
+        super().setUp()
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'JWT {get_token(self.user)}'
+
+    def cost(self, query, **variables):
+        '''Returns what an operation costs, whatever the configured maximum'''
+        limits = dict(settings.GRAPHQL_QUERY_LIMITS, MAX_COST=float('inf'))
+        with override_settings(GRAPHQL_QUERY_LIMITS=limits):
+            return check_query_cost(schema, parse(query), variables)['requested']
+
+    def post(self, query, **variables):
+        '''Posts an operation to /graphql, returning the status code and body'''
+        response = self.client.post(
+            '/graphql', json.dumps({'query': query, 'variables': variables}),
+            content_type='application/json'
+        )
+        return response.status_code, response.json()
+
+    def test_page_sizes_are_clamped(self):
+        '''first/last are costed between 1 and MAX_PAGE_SIZE, negatives included'''
+        limit = settings.GRAPHQL_QUERY_LIMITS['MAX_PAGE_SIZE']
+        self.assertEqual(
+            self.cost(NESTED_BUDGETS, first=-1000), self.cost(NESTED_BUDGETS, first=1)
+        )
+        self.assertEqual(
+            self.cost(NESTED_BUDGETS, first=1000000), self.cost(NESTED_BUDGETS, first=limit)
+        )
+        self.assertLess(self.cost(NESTED_BUDGETS, first=1), self.cost(NESTED_BUDGETS, first=2))
+
+    def test_within_limits(self):
+        '''Accepted operations report their cost'''
+        status, body = self.post('{ allBudgetYears }')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['data'], {'allBudgetYears': []})
+        self.assertEqual(body['extensions']['cost']['requested'], self.cost('{ allBudgetYears }'))
+
+    def test_too_costly(self):
+        '''Operations over MAX_COST are rejected without running'''
+        limits = dict(settings.GRAPHQL_QUERY_LIMITS, MAX_COST=50)
+        with override_settings(GRAPHQL_QUERY_LIMITS=limits):
+            status, body = self.post(NESTED_BUDGETS, first=20)
+
+        self.assertEqual(status, 400)
+        self.assertNotIn('data', body)
+        self.assertRegex(
+            body['errors'][0]['message'], r'^Query cost \d+ exceeds the maximum cost of 50$'
+        )
+
+    def test_too_deep(self):
+        '''Operations nested deeper than MAX_DEPTH are rejected'''
+        status, body = self.post('''{
+            transaction(id: 1) { category { budget { categories { transactions {
+                category { budget { categories { transactions { id } } } }
+            } } } } }
+        }''')
+
+        self.assertEqual(status, 400)
+        self.assertRegex(
+            body['errors'][0]['message'], r'^Query depth \d+ exceeds the maximum depth of 8$'
+        )
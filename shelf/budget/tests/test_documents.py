@@ -0,0 +1,82 @@
+'''Tests for the parsed document cache and persisted queries'''
+
+import hashlib
+import json
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase
+from graphql import parse
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.tests.helpers import GraphQLTestCase
+from shelf.documents import CachedDocumentBackend, PersistedQueries, PersistedQueryNotFound
+from shelf.schema import schema
+
+YEARS = '{ allBudgetYears }'
+YEARS_HASH = hashlib.sha256(YEARS.encode()).hexdigest()
+
+class DocumentCacheTest(SimpleTestCase):
+    '''Documents are parsed and validated once, errors included'''
+
+    def test_cached(self):
+        '''Repeated documents skip parsing and validation'''
+        backend = CachedDocumentBackend(max_documents=1)
+        with mock.patch('shelf.documents.parse', wraps=parse) as parsed:
+            first = backend.document_from_string(schema, YEARS)
+            self.assertIs(backend.document_from_string(schema, YEARS), first)
+            backend.document_from_string(schema, '{ missingField }')
+            backend.document_from_string(schema, YEARS)
+
+        # the invalid document evicted the first one
+        self.assertEqual(parsed.call_count, 3)
+
+    def test_invalid(self):
+        '''Validation errors are kept with the document and returned on execution'''
+        document = CachedDocumentBackend().document_from_string(schema, '{ missingField }')
+        self.assertEqual(len(document.errors), 1)
+        self.assertTrue(document.execute().invalid)
+
+class PersistedQueriesTest(GraphQLTestCase):
+    '''Clients can send the sha256 hash of a query in place of the query'''
+
+    def setUp(self):
+        super().setUp()
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'JWT {get_token(self.user)}'
+
+    def post(self, query=None, sha256_hash=YEARS_HASH):
+        '''Posts a query and/or its hash, returning the status code and body'''
+        payload = {'extensions': {'persistedQuery': {'version': 1, 'sha256Hash': sha256_hash}}}
+        if query is not None:
+            payload['query'] = query
+        response = self.client.post(
+            '/graphql', json.dumps(payload), content_type='application/json'
+        )
+        return response.status_code, response.json()
+
+    def test_automatic(self):
+        '''An unknown hash is asked for its query, which later requests can then omit'''
+        with mock.patch('shelf.views.get_persisted_queries', return_value=PersistedQueries()):
+            status, body = self.post()
+            self.assertEqual(status, 200)
+            self.assertEqual(body['errors'][0]['message'], 'PersistedQueryNotFound')
+
+            self.assertEqual(self.post(YEARS)[1]['data'], {'allBudgetYears': []})
+            self.assertEqual(self.post()[1]['data'], {'allBudgetYears': []})
+
+    def test_mismatch(self):
+        '''A query that doesn't match its hash is rejected'''
+        status, body = self.post('{ allBudgetYears __typename }')
+        self.assertEqual(status, 400)
+        self.assertEqual(body['errors'][0]['message'], 'provided sha does not match query')
+
+    def test_registry(self):
+        '''Hashes in the registry file resolve without a query ever being sent'''
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as registry:
+            json.dump({YEARS_HASH: YEARS}, registry)
+            registry.flush()
+            queries = PersistedQueries(registry.name)
+
+        self.assertEqual(queries.resolve(None, YEARS_HASH), YEARS)
+        with self.assertRaises(PersistedQueryNotFound):
+            queries.resolve(None, hashlib.sha256(b'{ other }').hexdigest())
@@ -0,0 +1,80 @@
+'''Tests for the /export endpoint'''
+
+import gzip
+import json
+from datetime import date
+from unittest import mock
+
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.models import Transaction
+from shelf.budget.tests.helpers import GraphQLTestCase, create_budget
+from shelf.views import _export_rows
+
+class ExportTest(GraphQLTestCase):
+    '''/export streams the user's transactions in (date, id) order'''
+
+    def setUp(self):
+        super().setUp()
+        _, (groceries, rent) = create_budget(self.user, date(2021, 3, 1))
+        # several transactions a day, so chunks split between ties on the date
+        Transaction.objects.bulk_create([
+            Transaction(
+                category=rent if index % 4 else groceries, amount=index, source='Shop',
+                description=f'item {index}', date=date(2021, 3, 1 + index // 3)
+            ) for index in range(20)
+        ])
+        self.expected = list(Transaction.objects.order_by('date', 'id').values_list(
+            'id', flat=True
+        ))
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'JWT {get_token(self.user)}'
+
+    def export(self, **params):
+        '''Returns the response to an export request and its body'''
+        response = self.client.get('/export', params)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_csv(self):
+        '''The CSV has a header line and one line per transaction'''
+        response, body = self.export()
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0], 'id,date,amount,source,description,recurring,category,month')
+        self.assertEqual([int(line.split(',')[0]) for line in lines[1:]], self.expected)
+
+    def test_ndjson_range(self):
+        '''from and to are inclusive, and the stream is gzipped when accepted'''
+        response = self.client.get(
+            '/export', {'format': 'ndjson', 'from': '2021-03-02', 'to': '2021-03-03'},
+            HTTP_ACCEPT_ENCODING='gzip'
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        rows = [
+            json.loads(line)
+            for line in gzip.decompress(b''.join(response.streaming_content)).splitlines()
+        ]
+        self.assertEqual([row['id'] for row in rows], self.expected[3:9])
+        self.assertEqual(rows[0]['month'], '2021-03')
+
+    def test_errors(self):
+        '''Unknown formats and dates are rejected and anonymous requests refused'''
+        self.assertEqual(self.export(format='xml')[0].status_code, 400)
+        self.assertEqual(self.export(to='March')[0].status_code, 400)
+        del self.client.defaults['HTTP_AUTHORIZATION']
+        self.assertEqual(self.export()[0].status_code, 401)
+
+    def test_chunks(self):
+        '''Keyset chunks read the same rows as the server-side cursor'''
+        queryset = Transaction.objects.order_by('date', 'id').values_list(
+            'id', 'date', 'amount', 'source', 'description', 'recurring',
+            'category__label', 'category__budget__date'
+        )
+        with mock.patch('shelf.views.EXPORT_CHUNK_SIZE', 4):
+            cursor = list(_export_rows(queryset))
+            keyset = list(_export_rows(queryset, keyset=True))
+
+        self.assertEqual([row['id'] for row in cursor], self.expected)
+        self.assertEqual(keyset, cursor)
@@ -0,0 +1,56 @@
+'''Tests for the forecast query'''
+
+from datetime import date
+
+from shelf.analytics import forecast
+from shelf.budget.models import Transaction
+from shelf.budget.tests.helpers import GraphQLTestCase, create_budget, execute
+
+FORECAST = '''query($months: Int) {
+    forecast(months: $months) {
+        year month income spent net cumulativeNet
+        categories { label budgeted recurring spent }
+    }
+}'''
+
+class ForecastTest(GraphQLTestCase):
+    '''Months after the latest budget spend its recurring transactions plus the usual rest'''
+
+    def setUp(self):
+        super().setUp()
+        for month, groceries in ((1, 30), (2, 60), (3, 90)):
+            _, categories = create_budget(self.user, date(2021, month, 1))
+            Transaction.objects.create(
+                category=categories[0], amount=groceries, source='Shop', description='food',
+                date=date(2021, month, 10)
+            )
+        # only the latest budget's recurring transactions are projected
+        Transaction.objects.create(
+            category=categories[1], amount=1200, source='Landlord', description='rent',
+            date=date(2021, 3, 1), recurring=True
+        )
+
+    def test_forecast(self):
+        '''Each month projects the mean non-recurring spend of the history'''
+        months = self.execute(FORECAST, months=2)['forecast']
+
+        self.assertEqual([(month['year'], month['month']) for month in months], [
+            (2021, 4), (2021, 5)
+        ])
+        self.assertEqual(months[0]['categories'], [
+            {'label': 'Groceries', 'budgeted': 100.0, 'recurring': 0.0, 'spent': 60.0},
+            {'label': 'Rent', 'budgeted': 100.0, 'recurring': 1200.0, 'spent': 1200.0},
+        ])
+        self.assertEqual(
+            [(month['income'], month['spent'], month['net'], month['cumulativeNet'])
+             for month in months],
+            [(3000.0, 1260.0, 1740.0, 1740.0), (3000.0, 1260.0, 1740.0, 3480.0)]
+        )
+
+    def test_limits(self):
+        '''months is bounded, and users without budgets get no forecast'''
+        result = execute(self.user, FORECAST, {'months': 0})
+        self.assertEqual(result.errors[0].message, 'months must be between 1 and 36')
+
+        self.user.budgets.all().delete()
+        self.assertEqual(forecast(self.user, 12), [])
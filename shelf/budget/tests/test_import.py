@@ -0,0 +1,125 @@
+'''Tests for bank statement imports'''
+
+import io
+import json
+from datetime import date
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from graphql_jwt.shortcuts import get_token
+
+from shelf.budget.importers import CategoryRules, import_transactions, parse_csv, parse_ofx
+from shelf.budget.models import Category, Transaction
+from shelf.budget.tests.helpers import GraphQLTestCase, create_budget
+from shelf.cache import get_result_cache
+
+STATEMENT = '''date,amount,source,description
+2021-03-02,-12.50,Safeway,weekly shop
+2021-03-02,-12.50,Safeway,weekly shop
+2021-03-04,-1200,Landlord,March rent
+2021-03-05,2500,Employer,salary
+2021-03-06,-30,Cinema,tickets
+2021-04-01,-9,Safeway,next month
+'''
+RULES = CategoryRules({
+    'rules': [
+        {'match': 'safeway|whole foods', 'category': 'Groceries'},
+        {'match': 'rent', 'category': 'Rent'},
+    ],
+})
+
+OFX = '''<OFX><BANKTRANLIST>
+<STMTTRN><DTPOSTED>20210303120000<TRNAMT>-20.00<NAME>Whole Foods<MEMO>groceries</STMTTRN>
+<STMTTRN><TRNAMT>-5.00<NAME>Missing date</STMTTRN>
+</BANKTRANLIST></OFX>
+'''
+
+class ImportTest(GraphQLTestCase):
+    '''Imports dedupe against existing transactions and categorize rows by rules'''
+
+    def setUp(self):
+        super().setUp()
+        _, (self.groceries, self.rent) = create_budget(self.user, date(2021, 3, 1))
+
+    def run_import(self, text, **options):
+        '''Imports a CSV statement as the test user'''
+        return import_transactions(self.user, parse_csv(io.StringIO(text)), RULES, **options)
+
+    def test_categorize(self):
+        '''Rows go to the first matching rule's category of their month'''
+        result = self.run_import(STATEMENT)
+
+        self.assertEqual(
+            (result.created, result.duplicates, result.uncategorized, result.skipped),
+            (3, 0, 2, 1)
+        )
+        self.assertEqual(Category.objects.get(pk=self.groceries.pk).spent, 25)
+        self.assertEqual(Category.objects.get(pk=self.rent.pk).spent, 1200)
+
+    def test_default_category(self):
+        '''Rows matching no rule go to the default category'''
+        rules = CategoryRules({'default': 'Groceries'})
+        result = import_transactions(self.user, parse_csv(io.StringIO(STATEMENT)), rules)
+
+        self.assertEqual((result.created, result.uncategorized), (4, 1))
+
+    def test_duplicates(self):
+        '''Re-importing creates nothing, while identical rows of one export are all kept'''
+        self.assertEqual(self.run_import(STATEMENT).created, 3)
+        result = self.run_import(STATEMENT)
+
+        self.assertEqual((result.created, result.duplicates), (0, 3))
+        self.assertEqual(Transaction.objects.filter(source='Safeway').count(), 2)
+
+        # a third identical row is new: only two existed before this import
+        result = self.run_import(STATEMENT + '2021-03-02,-12.50,Safeway,weekly shop\n')
+        self.assertEqual((result.created, result.duplicates), (1, 3))
+
+    def test_short_row(self):
+        '''A row with fewer fields than the header fails naming its line'''
+        with self.assertRaisesMessage(ValueError, 'Line 3: no value for amount, source'):
+            list(parse_csv(io.StringIO('date,amount,source\n2021-03-02,-1,Shop\n2021-03-03\n')))
+        with self.assertRaisesMessage(ValueError, 'Line 2: '):
+            list(parse_csv(io.StringIO('date,amount,source\n2021-03-02,lots,Shop\n')))
+
+    def test_ofx(self):
+        '''OFX blocks are parsed, and an incomplete one fails naming its line'''
+        rows = parse_ofx(io.StringIO(OFX))
+        self.assertEqual(next(rows).source, 'Whole Foods')
+        with self.assertRaisesMessage(ValueError, 'Line 3: transaction without DTPOSTED'):
+            next(rows)
+
+    def test_failed_import(self):
+        '''Chunks before a bad row are kept unless atomic, and cached results are invalidated'''
+        backend = get_result_cache().backend
+        version = backend.get_version(f'graphql:version:{self.user.id}')
+        statement = STATEMENT + '2021-03-09,-1\n'
+
+        with self.assertRaises(ValueError):
+            self.run_import(statement, chunk_size=2, atomic=True)
+        self.assertFalse(Transaction.objects.exists())
+
+        with self.assertRaises(ValueError):
+            self.run_import(statement, chunk_size=2)
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(backend.get_version(f'graphql:version:{self.user.id}'), version + 2)
+
+    def test_mutation(self):
+        '''importTransactions reads the upload and fails without importing any row'''
+        def post(text):
+            return self.client.post('/graphql', {
+                'query': '''mutation($rules: JSONString) {
+                    importTransactions(file: "statement", rules: $rules) { created skipped }
+                }''',
+                'variables': json.dumps({'rules': json.dumps({'default': 'Groceries'})}),
+                'statement': SimpleUploadedFile('statement.csv', text.encode()),
+            }, HTTP_AUTHORIZATION=f'JWT {get_token(self.user)}').json()
+
+        body = post(STATEMENT + '2021-03-09\n')
+        self.assertEqual(
+            body['errors'][0]['message'],
+            'Line 8: no value for amount, source, nothing was imported'
+        )
+        self.assertFalse(Transaction.objects.exists())
+
+        body = post(STATEMENT)
+        self.assertEqual(body['data']['importTransactions'], {'created': 4, 'skipped': 1})
@@ -0,0 +1,44 @@
+'''Tests for the spendingInsights query'''
+
+from datetime import date
+
+from shelf.budget.models import Category
+from shelf.budget.tests.helpers import GraphQLTestCase, create_budget
+
+INSIGHTS = '''query($year: Int!) {
+    spendingInsights(year: $year) {
+        month label spent budgeted rollingAverage change budgetRatio zScore anomaly
+    }
+}'''
+
+class InsightsTest(GraphQLTestCase):
+    '''Insights compare each month of a category with its recent and usual spending'''
+
+    def setUp(self):
+        super().setUp()
+        for month, spent in enumerate((100, 100, 100, 100, 100, 400), 1):
+            _, (groceries,) = create_budget(self.user, date(2021, month, 1), labels=['Groceries'])
+            Category.objects.add_spent([(groceries, spent)], count=1)
+
+    def test_insights(self):
+        '''Rolling averages, changes, budget ratios and z-score anomalies per month'''
+        insights = self.execute(INSIGHTS, year=2021)['spendingInsights']
+
+        self.assertEqual([insight['month'] for insight in insights], [1, 2, 3, 4, 5, 6])
+        january, june = insights[0], insights[-1]
+        self.assertEqual(
+            (january['rollingAverage'], january['change'], january['anomaly']),
+            (100.0, None, False)
+        )
+        self.assertEqual(
+            (june['spent'], june['budgeted'], june['rollingAverage'], june['change'],
+             june['budgetRatio']),
+            (400.0, 100.0, 200.0, 300.0, 4.0)
+        )
+        self.assertAlmostEqual(june['zScore'], 5 ** 0.5)
+        self.assertTrue(june['anomaly'])
+        self.assertFalse(any(insight['anomaly'] for insight in insights[:-1]))
+
+    def test_empty(self):
+        '''Years without budgets have no insights'''
+        self.assertEqual(self.execute(INSIGHTS, year=2019)['spendingInsights'], [])
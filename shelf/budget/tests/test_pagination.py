@@ -0,0 +1,81 @@
+'''Tests for keyset pagination of transactionsConnection'''
+
+from datetime import date
+from unittest import mock
+
+from shelf.budget.models import Transaction
+from shelf.budget.tests.helpers import GraphQLTestCase, create_budget, execute
+
+TRANSACTIONS_PAGE = '''query($id: ID!, $first: Int, $after: String, $last: Int, $before: String) {
+    category(id: $id) {
+        transactionsConnection(first: $first, after: $after, last: $last, before: $before) {
+            edges { node { id } }
+            pageInfo { hasNextPage hasPreviousPage startCursor endCursor }
+        }
+    }
+}'''
+
+class PaginationTest(GraphQLTestCase):
+    '''transactionsConnection pages by (date, id) keyset in both directions'''
+
+    def setUp(self):
+        super().setUp()
+        _, (self.category, _) = create_budget(self.user, date(2021, 3, 1))
+        # three transactions a day, so pages split between ties on the date
+        Transaction.objects.bulk_create([
+            Transaction(
+                category=self.category, amount=index, source='Shop', description='test',
+                date=date(2021, 3, 1 + index // 3)
+            ) for index in range(25)
+        ])
+        self.expected = [str(pk) for pk in Transaction.objects.filter(
+            category=self.category
+        ).order_by('-date', '-id').values_list('pk', flat=True)]
+
+    def page(self, **arguments):
+        '''Returns the transaction ids and page info of one page'''
+        data = self.execute(TRANSACTIONS_PAGE, id=self.category.id, **arguments)
+        connection = data['category']['transactionsConnection']
+        return [edge['node']['id'] for edge in connection['edges']], connection['pageInfo']
+
+    def test_forward(self):
+        '''first/after pages cover every transaction once, newest first'''
+        ids, info = self.page(first=10)
+        self.assertFalse(info['hasPreviousPage'])
+        while info['hasNextPage']:
+            page, info = self.page(first=10, after=info['endCursor'])
+            self.assertTrue(info['hasPreviousPage'])
+            ids += page
+
+        self.assertEqual(ids, self.expected)
+
+    def test_backward(self):
+        '''last/before pages cover every transaction once, newest first'''
+        ids, info = self.page(last=10)
+        self.assertFalse(info['hasNextPage'])
+        while info['hasPreviousPage']:
+            page, info = self.page(last=10, before=info['startCursor'])
+            self.assertTrue(info['hasNextPage'])
+            ids = page + ids
+
+        self.assertEqual(ids, self.expected)
+
+    def test_transactions_field(self):
+        '''The unpaginated transactions field breaks ties on the date in the same order'''
+        data = self.execute(
+            'query($id: ID!) { category(id: $id) { transactions { id } } }', id=self.category.id
+        )
+        self.assertEqual([row['id'] for row in data['category']['transactions']], self.expected)
+
+    def test_page_sizes(self):
+        '''Page sizes are capped at MAX_PAGE_SIZE and negative ones rejected'''
+        self.assertEqual(self.page(first=0)[0], [])
+        with mock.patch('shelf.schema.MAX_PAGE_SIZE', 7):
+            self.assertEqual(self.page(first=1000)[0], self.expected[:7])
+            self.assertEqual(self.page(last=1000)[0], self.expected[-7:])
+
+        for argument in ('first', 'last'):
+            result = execute(self.user, TRANSACTIONS_PAGE, {'id': self.category.id, argument: -5})
+            self.assertEqual(
+                result.errors[0].message, 'Page sizes cannot be negative, received -5'
+            )
@@ -0,0 +1,48 @@
+'''Tests for the repair_totals command'''
+
+from datetime import date
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from shelf.budget.models import MonthlyBudget, Category, Transaction
+from shelf.budget.tests.helpers import GraphQLTestCase, create_budget
+
+class RepairTotalsTest(GraphQLTestCase):
+    '''repair_totals finds drifted totals and locks the rows it repairs'''
+
+    def setUp(self):
+        super().setUp()
+        self.budget, (self.category, _) = create_budget(self.user, date(2021, 3, 1))
+        Transaction.objects.create(
+            category=self.category, amount=40, source='Shop', description='test',
+            date=date(2021, 3, 2)
+        )
+        # the transaction was inserted directly, so the stored totals missed it
+
+    def repair(self, *args):
+        '''Runs the command, returning its output and the SQL it issued'''
+        output = StringIO()
+        with CaptureQueriesContext(connection) as captured:
+            call_command('repair_totals', *args, stdout=output)
+        return output.getvalue(), [query['sql'] for query in captured.captured_queries]
+
+    def test_check(self):
+        '''--check reports drift without locking or writing'''
+        output, queries = self.repair('--check')
+
+        self.assertIn('Found 1 categories and 1 budgets with drift', output)
+        self.assertFalse([sql for sql in queries if 'FOR UPDATE' in sql])
+        self.assertEqual(Category.objects.get(pk=self.category.pk).spent, 0)
+
+    def test_repair(self):
+        '''Drifted rows are locked before their totals are read and written'''
+        output, queries = self.repair()
+
+        self.assertIn('Repaired 1 categories and 1 budgets with drift', output)
+        self.assertEqual(len([sql for sql in queries if 'FOR UPDATE' in sql]), 2)
+        self.assertEqual(Category.objects.get(pk=self.category.pk).spent, 40)
+        self.assertEqual(MonthlyBudget.objects.get(pk=self.budget.pk).net, 2960)
+        self.assertIn('Repaired 0 categories and 0 budgets', self.repair()[0])
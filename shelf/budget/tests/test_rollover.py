@@ -0,0 +1,65 @@
+'''Tests for the rollover_month command'''
+
+from datetime import date
+from io import StringIO
+
+from django.core.management import call_command
+
+from shelf.budget.models import MonthlyBudget, Category, Transaction, MonthlyRollup, User
+from shelf.budget.tests.helpers import GraphQLTestCase, create_budget
+from shelf.cache import get_result_cache
+
+class RolloverTest(GraphQLTestCase):
+    '''rollover_month copies each user's latest budget into a month they lack'''
+
+    def setUp(self):
+        super().setUp()
+        self.others = [
+            User.objects.create_user(f'{self.id()}.{index}') for index in range(2)
+        ]
+        _, (groceries, rent) = create_budget(self.user, date(2021, 3, 1), income=4000)
+        for category, amount, recurring in ((groceries, 30, False), (rent, 1200, True)):
+            Transaction.objects.create(
+                category=category, amount=amount, source='Shop', description='test',
+                date=date(2021, 3, 15), recurring=recurring
+            )
+        Category.objects.add_spent([(groceries, 30), (rent, 1200)], count=1)
+        # already has the month, and has no earlier budget to copy
+        create_budget(self.others[0], date(2021, 5, 1))
+
+    def roll_over(self):
+        '''Rolls every user over to May 2021 in this process'''
+        output = StringIO()
+        call_command(
+            'rollover_month', month='2021-05', workers=1, stdout=output, stderr=StringIO()
+        )
+        return output.getvalue()
+
+    def test_rollover(self):
+        '''Categories and recurring transactions are copied into the new month'''
+        version = get_result_cache().backend.get_version(f'graphql:version:{self.user.id}')
+        output = self.roll_over()
+
+        self.assertIn('Created 1 budgets, 2 categories and 1 transactions for 1 users', output)
+        budget = MonthlyBudget.objects.get(user=self.user, date=date(2021, 5, 1))
+        self.assertEqual((budget.income, budget.net), (4000, 2800))
+        self.assertEqual(
+            list(Transaction.objects.filter(category__budget=budget).values_list(
+                'date', 'amount', 'recurring'
+            )),
+            [(date(2021, 5, 15), 1200, True)]
+        )
+        self.assertEqual(
+            MonthlyRollup.objects.get(user=self.user, year=2021, month=5, label=None).spent, 1200
+        )
+        self.assertEqual(
+            get_result_cache().backend.get_version(f'graphql:version:{self.user.id}'),
+            version + 1
+        )
+        self.assertFalse(MonthlyBudget.objects.filter(user=self.others[1]).exists())
+
+    def test_rerun(self):
+        '''Running again skips the users who have the month'''
+        self.roll_over()
+        self.assertIn('Rolling 0 users over to May 2021', self.roll_over())
+        self.assertEqual(MonthlyBudget.objects.filter(date=date(2021, 5, 1)).count(), 2)
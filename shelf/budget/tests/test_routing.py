@@ -0,0 +1,58 @@
+'''Tests for read replica routing'''
+
+from unittest import mock
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.test import TransactionTestCase, override_settings
+
+from shelf.budget.models import Category
+from shelf.budget.tests.helpers import create_user
+from shelf.cache import LocalMemoryBackend, get_result_cache
+from shelf.routers import ReplicaRouter, is_sticky, routing_scope
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], DATABASE_REPLICA_LAG=10)
+class RoutingTest(TransactionTestCase):
+    '''
+    Reads go to a replica until the request or the user's recent requests
+    wrote. A TransactionTestCase, as reads in a transaction stay on the primary
+    '''
+
+    def setUp(self):
+        get_result_cache().backend.clear()
+        self.user = create_user(self)
+        self.router = ReplicaRouter()
+
+    def test_scope(self):
+        '''Reads outside a scope, in a transaction or after a write go to the primary'''
+        self.assertEqual(self.router.db_for_read(Category), DEFAULT_DB_ALIAS)
+        with routing_scope(self.user):
+            self.assertEqual(self.router.db_for_read(Category), 'replica_0')
+            with transaction.atomic():
+                self.assertEqual(self.router.db_for_read(Category), DEFAULT_DB_ALIAS)
+            self.router.db_for_write(Category)
+            self.assertEqual(self.router.db_for_read(Category), DEFAULT_DB_ALIAS)
+
+    def test_sticky(self):
+        '''After a write the user reads from the primary for DATABASE_REPLICA_LAG'''
+        with mock.patch('shelf.cache.time.monotonic', return_value=100):
+            with routing_scope(self.user):
+                self.router.db_for_write(Category)
+            self.assertTrue(is_sticky(self.user.id))
+            with routing_scope(self.user):
+                self.assertEqual(self.router.db_for_read(Category), DEFAULT_DB_ALIAS)
+
+        with mock.patch('shelf.cache.time.monotonic', return_value=111):
+            self.assertFalse(is_sticky(self.user.id))
+            with routing_scope(self.user):
+                self.assertEqual(self.router.db_for_read(Category), 'replica_0')
+
+    def test_expired_marks(self):
+        '''Marks that are never read again are swept out of locmem once expired'''
+        backend = LocalMemoryBackend(max_entries=10)
+        with mock.patch('shelf.cache.time.monotonic', return_value=100):
+            for user_id in range(10):
+                backend.set_persistent(f'graphql:primary:{user_id}', '1', 10)
+        with mock.patch('shelf.cache.time.monotonic', return_value=111):
+            backend.set_persistent('graphql:primary:10', '1', 10)
+
+        self.assertEqual(list(backend.persistent), ['graphql:primary:10'])
@@ -0,0 +1,69 @@
+'''Tests for searchTransactions'''
+
+from datetime import date
+
+from shelf.budget.models import Transaction, User
+from shelf.budget.tests.helpers import GraphQLTestCase, create_budget, execute
+
+SEARCH = '''query($terms: String!, $from: Date, $to: Date, $first: Int, $after: String) {
+    searchTransactions(query: $terms, from: $from, to: $to, first: $first, after: $after) {
+        edges { cursor node { id description } }
+        pageInfo { hasNextPage endCursor }
+    }
+}'''
+
+class SearchTest(GraphQLTestCase):
+    '''Searches match the user's transactions by words in their source and description'''
+
+    def setUp(self):
+        super().setUp()
+        _, (self.category, _) = create_budget(self.user, date(2021, 3, 1))
+        for day, source, description in (
+                (2, 'Safeway', 'weekly groceries'),
+                (3, 'Shell', 'fuel'),
+                (4, 'Whole Foods', 'grocery top up'),
+                (5, 'Safeway', 'party supplies'),
+        ):
+            Transaction.objects.create(
+                category=self.category, amount=day, source=source, description=description,
+                date=date(2021, 3, day)
+            )
+        other_user = User.objects.create_user(f'{self.id()}.other')
+        _, (other, _) = create_budget(other_user, date(2021, 3, 1))
+        Transaction.objects.create(
+            category=other, amount=1, source='Safeway', description='not yours',
+            date=date(2021, 3, 2)
+        )
+
+    def search(self, terms, **arguments):
+        '''Returns the descriptions found and the page info'''
+        data = self.execute(SEARCH, terms=terms, **arguments)['searchTransactions']
+        return [edge['node']['description'] for edge in data['edges']], data['pageInfo']
+
+    def test_words(self):
+        '''Words match stemmed, in the source or the description'''
+        self.assertCountEqual(
+            self.search('grocery')[0], ['weekly groceries', 'grocery top up']
+        )
+        self.assertCountEqual(
+            self.search('safeway')[0], ['weekly groceries', 'party supplies']
+        )
+        self.assertEqual(self.search('   ')[0], [])
+
+    def test_dates(self):
+        '''from and to restrict the dates searched, inclusively'''
+        self.assertEqual(
+            self.search('safeway', **{'from': '2021-03-03', 'to': '2021-03-05'})[0],
+            ['party supplies']
+        )
+
+    def test_pages(self):
+        '''first/after pages cover every match once'''
+        found, info = self.search('safeway', first=1)
+        self.assertTrue(info['hasNextPage'])
+        page, info = self.search('safeway', first=1, after=info['endCursor'])
+        self.assertFalse(info['hasNextPage'])
+        self.assertCountEqual(found + page, ['weekly groceries', 'party supplies'])
+
+        result = execute(self.user, SEARCH, {'terms': 'safeway', 'first': -1})
+        self.assertEqual(result.errors[0].message, 'Page sizes cannot be negative, received -1')
@@ -0,0 +1,70 @@
+'''Tests for changesSince delta sync'''
+
+import base64
+from datetime import date, timedelta
+from unittest import mock
+
+from django.utils.timezone import now
+
+from shelf.budget.tests.helpers import (
+    CREATE_TRANSACTION, EDIT_CATEGORY, GraphQLTestCase, create_budget, execute
+)
+from shelf.schema import encode_sync_cursor
+
+CHANGES = '''query($cursor: String) {
+    changesSince(cursor: $cursor) {
+        cursor reset
+        monthlyBudgets { id }
+        categories { id label }
+        transactions { id }
+        deleted { model objectId }
+    }
+}'''
+
+class DeltaSyncTest(GraphQLTestCase):
+    '''changesSince returns rows written and deleted since a cursor'''
+
+    def setUp(self):
+        super().setUp()
+        self.budget, (self.groceries, self.rent) = create_budget(self.user, date(2021, 3, 1))
+
+    def changes(self, cursor=None):
+        '''Returns the changes since a cursor'''
+        return self.execute(CHANGES, cursor=cursor)['changesSince']
+
+    def test_sync(self):
+        '''A full reset without a cursor, then only what changed since'''
+        first = self.changes()
+        self.assertTrue(first['reset'])
+        self.assertEqual(len(first['categories']), 2)
+
+        later = now() + timedelta(minutes=5)
+        with mock.patch('shelf.budget.models.now', return_value=later), \
+                mock.patch('django.utils.timezone.now', return_value=later):
+            self.execute(EDIT_CATEGORY, id=self.groceries.id, label='Food', amount=150)
+            self.execute(
+                CREATE_TRANSACTION, categoryId=self.rent.id, amount=900, recurring=False
+            )
+            self.execute(
+                'mutation($id: ID) { deleteCategory(id: $id) { deletedTransactions } }',
+                id=self.rent.id
+            )
+
+        changes = self.changes(first['cursor'])
+        self.assertFalse(changes['reset'])
+        self.assertEqual(changes['categories'], [{'id': str(self.groceries.id), 'label': 'Food'}])
+        # the new transaction went with its category, whose tombstone covers it
+        self.assertEqual(changes['transactions'], [])
+        self.assertEqual(changes['deleted'], [{'model': 'Category', 'objectId': self.rent.id}])
+
+    def test_expired_cursor(self):
+        '''Cursors older than TOMBSTONE_DAYS get a full reset'''
+        changes = self.changes(encode_sync_cursor(now() - timedelta(days=365)))
+        self.assertTrue(changes['reset'])
+        self.assertEqual(len(changes['categories']), 2)
+
+    def test_invalid_cursor(self):
+        '''Malformed cursors and cursors without a UTC offset are rejected'''
+        for cursor in ('not a cursor', base64.b64encode(b'2021-01-01T00:00:00').decode()):
+            result = execute(self.user, CHANGES, {'cursor': cursor})
+            self.assertEqual(result.errors[0].message, f'Invalid cursor {cursor}')
@@ -0,0 +1,129 @@
+'''Tests for stored totals and monthly rollups'''
+
+from django.db import transaction
+
+from shelf.budget.models import MonthlyBudget, Category, MonthlyRollup
+from shelf.budget.tests.helpers import (
+    CREATE_BUDGET, CREATE_CATEGORY, CREATE_TRANSACTION, EDIT_BUDGET, EDIT_CATEGORY,
+    EDIT_TRANSACTION, GraphQLTestCase
+)
+
+class TotalsTest(GraphQLTestCase):
+    '''Mutations keep stored totals and monthly rollups equal to recomputing them'''
+
+    def setUp(self):
+        super().setUp()
+        data = self.execute(CREATE_BUDGET, year='2021', month='March', income=3000)
+        self.budget_id = data['createMonthlyBudget']['monthlyBudget']['id']
+        self.category_ids = [
+            self.execute(CREATE_CATEGORY, budgetId=self.budget_id, label=label)[
+                'createCategory']['category']['id']
+            for label in ('Groceries', 'Rent')
+        ]
+
+    def add_transaction(self, category_id, amount, recurring=False):
+        '''Creates a transaction through the mutation and returns its id'''
+        data = self.execute(
+            CREATE_TRANSACTION, categoryId=category_id, amount=amount, recurring=recurring
+        )
+        return data['createTransaction']['transaction']['id']
+
+    def rollups(self):
+        '''Returns the user's rollup rows, rounded so they compare across summing orders'''
+        return sorted((
+            (year, month, label or '', count, round(spent, 6), round(budgeted, 6))
+            for year, month, label, count, spent, budgeted in MonthlyRollup.objects.filter(
+                user=self.user
+            ).values_list('year', 'month', 'label', 'count', 'spent', 'budgeted')
+        ))
+
+    def assert_consistent(self):
+        '''Checks stored totals against transactions and rollups against a rebuild'''
+        for category in Category.objects.with_totals().filter(budget__user=self.user):
+            self.assertAlmostEqual(category.spent, category.computed_spent)
+        for budget in MonthlyBudget.objects.with_totals().filter(user=self.user):
+            self.assertAlmostEqual(budget.net, budget.computed_net)
+
+        maintained = self.rollups()
+        with transaction.atomic():
+            MonthlyRollup.objects.filter(user=self.user).delete()
+            MonthlyRollup.objects.refresh(
+                MonthlyBudget.objects.filter(user=self.user).values_list('user_id', 'date')
+            )
+            rebuilt = self.rollups()
+            transaction.set_rollback(True)
+        self.assertEqual(maintained, rebuilt)
+
+    def test_transaction_mutations(self):
+        '''Creating, editing and deleting transactions'''
+        groceries, rent = self.category_ids
+        first = self.add_transaction(groceries, 25.5)
+        self.add_transaction(groceries, 10)
+        self.add_transaction(rent, 1200, recurring=True)
+        self.assert_consistent()
+
+        self.execute(EDIT_TRANSACTION, id=first, amount=40)
+        self.assert_consistent()
+
+        self.execute(
+            'mutation($id: ID) { deleteTransaction(id: $id) { transaction { amount } } }',
+            id=first
+        )
+        self.assert_consistent()
+        self.assertEqual(Category.objects.get(pk=groceries).spent, 10)
+
+    def test_bulk_transaction_mutations(self):
+        '''Creating and deleting transactions in bulk'''
+        groceries, rent = self.category_ids
+        data = self.execute(
+            '''mutation($transactions: [CreateTransactionInput!]!) {
+                createTransactions(transactions: $transactions) { transactions { id } }
+            }''',
+            transactions=[{
+                'amount': amount, 'source': 'Shop', 'day': 1, 'description': 'bulk',
+                'recurring': False, 'categoryId': category_id
+            } for category_id, amount in ((groceries, 5), (rent, 7), (groceries, 9))]
+        )
+        ids = [row['id'] for row in data['createTransactions']['transactions']]
+        self.assert_consistent()
+
+        self.execute(
+            'mutation($ids: [ID!]!) { deleteTransactions(ids: $ids) { transactions { id } } }',
+            ids=ids[:2]
+        )
+        self.assert_consistent()
+
+    def test_category_mutations(self):
+        '''Renaming a category, also onto a label of the month, and deleting one'''
+        groceries, rent = self.category_ids
+        self.add_transaction(groceries, 30)
+        self.add_transaction(rent, 900)
+
+        self.execute(EDIT_CATEGORY, id=groceries, label='Food', amount=150)
+        self.assert_consistent()
+        # two categories of the month sharing a label share its rollup row
+        self.execute(EDIT_CATEGORY, id=groceries, label='Rent', amount=150)
+        self.assert_consistent()
+
+        self.execute(
+            'mutation($id: ID) { deleteCategory(id: $id) { deletedTransactions } }', id=rent
+        )
+        self.assert_consistent()
+
+    def test_budget_mutations(self):
+        '''Moving a budget to another month, copying it forward and deleting it'''
+        groceries, rent = self.category_ids
+        self.add_transaction(groceries, 30)
+        self.add_transaction(rent, 900, recurring=True)
+
+        self.execute(EDIT_BUDGET, id=self.budget_id, year='2021', month='April', income=3500)
+        self.assert_consistent()
+
+        data = self.execute('mutation { autoCreateMonthlyBudget { monthlyBudget { id } } }')
+        self.assert_consistent()
+
+        self.execute(
+            'mutation($id: ID) { deleteMonthlyBudget(id: $id) { deletedCategories } }',
+            id=data['autoCreateMonthlyBudget']['monthlyBudget']['id']
+        )
+        self.assert_consistent()
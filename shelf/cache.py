@@ -0,0 +1,257 @@
+'''Per-user GraphQL result cache invalidated by data version counters'''
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+class LocalMemoryBackend:
+    '''
+    In-process LRU backend whose entries expire after timeout. Versions and
+    persistent values are kept apart so LRU eviction never drops them. Each
+    process has its own, so it only suits a single worker process (see
+    check_shared_backend)
+    '''
+
+    def __init__(self, max_entries=1000, **_):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.persistent = {}
+        # size at which expired persistent values are next swept out
+        self.persistent_limit = max_entries
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns the unexpired value of key, or None'''
+        with self.lock:
+            if key not in self.entries:
+                return None
+            value, expires = self.entries[key]
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        '''Stores value under key for timeout seconds (forever if None)'''
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_version(self, name):
+        '''Returns the counter name, 0 if it was never incremented'''
+        return self.versions.get(name, 0)
+
+    def incr_version(self, name):
+        '''Increments the counter name and returns its new value'''
+        with self.lock:
+            self.versions[name] = self.versions.get(name, 0) + 1
+            return self.versions[name]
+
+    def get_persistent(self, name):
+        '''Returns the unexpired persistent value name, or None'''
+        with self.lock:
+            if name not in self.persistent:
+                return None
+            value, expires = self.persistent[name]
+            if expires <= time.monotonic():
+                del self.persistent[name]
+                return None
+            return value
+
+    def set_persistent(self, name, value, timeout):
+        '''
+        Stores value as name for timeout seconds, beyond the reach of LRU
+        eviction. Values never read again are swept out once they expire,
+        whenever the number stored has doubled since the last sweep
+        '''
+        now = time.monotonic()
+        with self.lock:
+            self.persistent[name] = (value, now + timeout)
+            if len(self.persistent) > self.persistent_limit:
+                self.persistent = {
+                    key: stored for key, stored in self.persistent.items() if stored[1] > now
+                }
+                self.persistent_limit = max(self.max_entries, 2 * len(self.persistent))
+
+    def clear(self):
+        '''Drops every entry, version and persistent value'''
+        with self.lock:
+            self.entries.clear()
+            self.versions.clear()
+            self.persistent.clear()
+
+class RedisBackend:
+    '''Backend for Redis or any server speaking its protocol; entries expire after timeout'''
+
+    def __init__(self, location=None, **_):
+        try:
+            import redis #pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise ImproperlyConfigured('The redis result cache backend needs redis-py') from error
+
+        self.client = redis.Redis.from_url(location or 'redis://localhost:6379/0')
+
+    def get(self, key):
+        '''Returns the value of key, or None if it is missing or expired'''
+        return self.client.get(key)
+
+    def set(self, key, value, timeout=None):
+        '''Stores value under key, expiring after timeout seconds unless None'''
+        self.client.set(key, value, ex=timeout)
+
+    def get_version(self, name):
+        '''Returns the counter name, 0 if it was never incremented'''
+        return int(self.client.get(name) or 0)
+
+    def incr_version(self, name):
+        '''Atomically increments the counter name and returns its new value'''
+        return self.client.incr(name)
+
+    def get_persistent(self, name):
+        '''Returns the persistent value name, or None once it expired'''
+        return self.client.get(name)
+
+    def set_persistent(self, name, value, timeout):
+        '''Stores value as name, expiring after timeout seconds'''
+        self.client.set(name, value, ex=timeout)
+
+    def clear(self):
+        '''Empties the whole Redis database'''
+        self.client.flushdb()
+
+BACKENDS = {
+    'locmem': LocalMemoryBackend,
+    'redis': RedisBackend,
+}
+
+STRING_LITERAL = re.compile(r'("(?:[^"\\]|\\.)*")')
+
+def normalise_query(query):
+    '''Collapses whitespace outside string literals so formatting doesn't split the cache'''
+    parts = STRING_LITERAL.split(query.strip())
+    return ''.join(
+        part if index % 2 else ' '.join(part.split()) for index, part in enumerate(parts)
+    )
+
+class ResultCache:
+    '''
+    Caches query results per user. Keys include the user's data version, so
+    bumping it after a write makes every older entry unreachable
+    '''
+
+    def __init__(self, backend, timeout=300):
+        self.backend = backend
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, user_id, query, variables=None, operation_name=None):
+        '''Builds the cache key for a query at the user's current data version'''
+        digest = hashlib.sha256(json.dumps(
+            [normalise_query(query), variables or {}, operation_name],
+            sort_keys=True
+        ).encode()).hexdigest()
+
+        return self.user_key('result', user_id, digest)
+
+    def user_key(self, kind, user_id, name):
+        '''Builds a key for data derived from the user's budgets, valid until their next write'''
+        version = self.backend.get_version(f'graphql:version:{user_id}')
+        return f'graphql:{kind}:{user_id}:{version}:{name}'
+
+    def get(self, key):
+        '''Returns the cached result's data and extensions as a dict, or None on a miss'''
+        value = self.backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        return json.loads(value)
+
+    def set(self, key, data, extensions=None):
+        '''Caches a result's data and extensions under key for the configured timeout'''
+        self.backend.set(
+            key, json.dumps({'data': data, 'extensions': extensions or {}}), self.timeout
+        )
+
+    def bump_version(self, user_id):
+        '''Invalidates every cached result of the user'''
+        self.backend.incr_version(f'graphql:version:{user_id}')
+
+    def stats(self):
+        '''Returns the hits and misses counted by this process'''
+        return {'hits': self.hits, 'misses': self.misses}
+
+_result_cache = None
+
+def get_result_cache():
+    '''Returns the process-wide result cache configured by GRAPHQL_RESULT_CACHE'''
+    global _result_cache #pylint: disable=global-statement
+    if _result_cache is None:
+        config = {key.lower(): value for key, value in settings.GRAPHQL_RESULT_CACHE.items()}
+        backend = BACKENDS[config.pop('backend', 'locmem')](**config)
+        _result_cache = ResultCache(backend, timeout=config.get('timeout', 300))
+
+    return _result_cache
+
+def check_shared_backend():
+    '''
+    Refuses to serve several worker processes (WEB_CONCURRENCY) from the
+    locmem backend: a write handled by one worker would only invalidate that
+    worker's copy, leaving the others serving stale results
+    '''
+    if settings.WEB_CONCURRENCY > 1 and settings.GRAPHQL_RESULT_CACHE['BACKEND'] == 'locmem':
+        raise ImproperlyConfigured(
+            f'WEB_CONCURRENCY runs {settings.WEB_CONCURRENCY} worker processes, which need '
+            'a shared result cache: set GRAPHQL_CACHE_URL to a Redis server'
+        )
+
+def stale_results_warning():
+    '''
+    Returns a warning for commands writing users' data when the backend is
+    locmem, or None. Their version bumps only reach the command's own
+    process, so servers keep serving the results they cached before it
+    '''
+    if settings.GRAPHQL_RESULT_CACHE['BACKEND'] != 'locmem':
+        return None
+
+    return (
+        "The locmem result cache isn't shared with the server, which serves results cached "
+        f"before this command for up to {settings.GRAPHQL_RESULT_CACHE['TIMEOUT']}s. "
+        'Set GRAPHQL_CACHE_URL to a Redis server shared with it'
+    )
+
+def bump_user_version(user_id):
+    '''
+    Invalidates the cached results of a user after their data changed, for
+    every process sharing the backend (see stale_results_warning)
+    '''
+    get_result_cache().bump_version(user_id)
+
+class ResultCacheMiddleware:
+    '''Graphene middleware bumping the user's data version after each root mutation field'''
+
+    def resolve(self, next, root, info, **kwargs): #pylint: disable=redefined-builtin
+        '''Calls the next resolver, then bumps the version if it ran a root mutation field'''
+        result = next(root, info, **kwargs)
+        if root is None and info.operation.operation == 'mutation':
+            info.context.mutated = True
+            user = getattr(info.context, 'user', None)
+            if user is not None and user.is_authenticated:
+                bump_user_version(user.id)
+
+        return result
@@ -0,0 +1,134 @@
+'''Bounded DB thread pool and admission control for the async endpoints'''
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections
+
+class Overloaded(Exception):
+    '''Raised when a request can't get an execution slot in time'''
+
+class RequestLimiter:
+    '''
+    Lets up to max_concurrent requests execute at once. Up to max_queued more
+    wait at most timeout seconds for a slot; anything beyond is turned away
+    straight away, so a burst can't pile up unbounded work
+    '''
+
+    def __init__(self, max_concurrent, max_queued, timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        # requests executing or waiting; only touched from the event loop
+        self.admitted = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        '''Holds an execution slot for the block, raising Overloaded if none is available'''
+        if self.admitted >= self.max_concurrent + self.max_queued:
+            raise Overloaded(f'{self.admitted} requests already executing or waiting')
+
+        self.admitted += 1
+        try:
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+            except asyncio.TimeoutError as error:
+                raise Overloaded(f'No execution slot within {self.timeout}s') from error
+
+            try:
+                yield
+            finally:
+                self.semaphore.release()
+        finally:
+            self.admitted -= 1
+
+def _in_db_thread(func, *args):
+    '''Runs ORM work in a pool thread, closing its connection if it's expired'''
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+async def run_in_db_thread(func, *args):
+    '''
+    Awaits func(*args) run on the DB thread pool. Like sync_to_async with
+    thread_sensitive=False, but on a pool sized by GRAPHQL_ASYNC['DB_THREADS']
+    so concurrent ORM work never needs more connections than that
+    '''
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_db_executor(), functools.partial(context.run, _in_db_thread, func, *args)
+    )
+
+def map_in_db_threads(func, *iterables):
+    '''
+    Runs func over the items of iterables on the DB thread pool and returns
+    the results in order. For synchronous callers; never call it from a pool
+    thread, which could leave the pool waiting on itself
+    '''
+    futures = [
+        get_db_executor().submit(contextvars.copy_context().run, _in_db_thread, func, *args)
+        for args in zip(*iterables)
+    ]
+    return [future.result() for future in futures]
+
+class StreamingASGIHandler(ASGIHandler):
+    '''
+    ASGIHandler producing the parts of streaming responses on the DB thread
+    pool. Django 3.2 iterates them on the event loop, where a generator
+    reading the database raises SynchronousOnlyOperation mid response
+    '''
+
+    async def send_response(self, response, send):
+        '''Sends the response, pulling streamed parts one at a time off the loop'''
+        if not response.streaming:
+            return await super().send_response(response, send)
+
+        parts = iter(response)
+        # the parent only sends the headers, the parts go out before its final message
+        response.streaming_content = ()
+
+        async def send_parts(message):
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                while True:
+                    part = await run_in_db_thread(next, parts, None)
+                    if part is None:
+                        break
+                    for chunk, _ in self.chunk_bytes(part):
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+            await send(message)
+
+        return await super().send_response(response, send_parts)
+
+_db_executor = None
+_limiters = {}
+
+def get_db_executor():
+    '''Returns the process-wide pool running ORM work for async requests'''
+    global _db_executor #pylint: disable=global-statement
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(
+            max_workers=settings.GRAPHQL_ASYNC['DB_THREADS'], thread_name_prefix='graphql-db'
+        )
+
+    return _db_executor
+
+def get_request_limiter():
+    '''Returns the request limiter of the running event loop'''
+    loop = asyncio.get_running_loop()
+    if loop not in _limiters:
+        config = settings.GRAPHQL_ASYNC
+        _limiters[loop] = RequestLimiter(
+            config['MAX_CONCURRENT_REQUESTS'],
+            config['MAX_QUEUED_REQUESTS'],
+            config['QUEUE_TIMEOUT']
+        )
+
+    return _limiters[loop]
@@ -0,0 +1,135 @@
+'''Static depth and cost analysis of GraphQL operations, run before execution'''
+
+from django.conf import settings
+from graphql.error import GraphQLError
+from graphql.language import ast
+from graphql.type.definition import GraphQLList, GraphQLNonNull, get_named_type
+from graphql.utils.get_operation_ast import get_operation_ast
+
+PAGE_ARGUMENTS = ('first', 'last')
+
+class QueryCost:
+    '''
+    Estimates the work an operation asks for. Every field with a selection
+    costs 1 per object it returns and list fields multiply their subtree by
+    the page size requested (first/last) or by the expected size in list_sizes,
+    so cycles like budget -> categories -> transactions -> category -> budget
+    grow geometrically. Page sizes count as between 1 and max_page_size, so
+    negative or oversized arguments can't lower the cost or inflate it past
+    what the resolvers return. Leaf fields are free and introspection is not
+    counted
+    '''
+
+    def __init__( #pylint: disable=too-many-arguments
+            self, schema, document_ast, variables=None, list_sizes=None,
+            default_list_size=10, max_page_size=100
+    ):
+        self.schema = schema
+        self.variables = variables or {}
+        self.list_sizes = list_sizes or {}
+        self.default_list_size = default_list_size
+        self.max_page_size = max_page_size
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document_ast.definitions
+            if isinstance(definition, ast.FragmentDefinition)
+        }
+
+    def operation(self, operation):
+        '''Returns the (cost, depth) of an operation definition'''
+        root_type = {
+            'query': self.schema.get_query_type,
+            'mutation': self.schema.get_mutation_type,
+            'subscription': self.schema.get_subscription_type,
+        }[operation.operation]()
+
+        return self.selection_set(root_type, operation.selection_set)
+
+    def selection_set(self, parent_type, selection_set, page_size=None):
+        '''Returns the summed cost and the maximum depth of a selection set'''
+        cost = depth = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, ast.Field):
+                field_cost, field_depth = self.field(parent_type, selection, page_size)
+            else:
+                if isinstance(selection, ast.FragmentSpread):
+                    selection = self.fragments[selection.name.value]
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value)
+                field_cost, field_depth = self.selection_set(
+                    fragment_type, selection.selection_set, page_size
+                )
+            cost += field_cost
+            depth = max(depth, field_depth)
+
+        return cost, depth
+
+    def field(self, parent_type, field, page_size=None):
+        '''Returns the (cost, depth) of a single field and its subtree'''
+        name = field.name.value
+        if name.startswith('__'):
+            return 0, 0
+        if field.selection_set is None:
+            return 0, 1
+
+        field_type = parent_type.fields[name].type
+        arguments = {argument.name.value: argument.value for argument in field.arguments or []}
+        requested = [
+            self.value(arguments[argument]) for argument in PAGE_ARGUMENTS if argument in arguments
+        ]
+        requested = max((size for size in requested if size is not None), default=None)
+        if requested is not None:
+            requested = max(1, min(requested, self.max_page_size))
+
+        child_cost, child_depth = self.selection_set(
+            get_named_type(field_type), field.selection_set, requested
+        )
+        if isinstance(field_type, GraphQLNonNull):
+            field_type = field_type.of_type
+        size = 1
+        if isinstance(field_type, GraphQLList):
+            size = requested or page_size or self.list_sizes.get(
+                f'{parent_type.name}.{name}', self.default_list_size
+            )
+
+        return size * (1 + child_cost), 1 + child_depth
+
+    def value(self, value):
+        '''Returns the integer an argument was given, resolving variables'''
+        if isinstance(value, ast.Variable):
+            value = self.variables.get(value.name.value)
+            return value if isinstance(value, int) else None
+        if isinstance(value, ast.IntValue):
+            return int(value.value)
+
+        return None
+
+def check_query_cost(schema, document_ast, variables=None, operation_name=None):
+    '''
+    Returns the extensions entry describing the cost of the operation that
+    will run, raising GraphQLError if it exceeds GRAPHQL_QUERY_LIMITS
+    '''
+    operation = get_operation_ast(document_ast, operation_name)
+    if operation is None:
+        # execution reports the missing or ambiguous operation itself
+        return None
+
+    limits = settings.GRAPHQL_QUERY_LIMITS
+    cost, depth = QueryCost(
+        schema, document_ast, variables,
+        list_sizes=limits['LIST_SIZES'],
+        default_list_size=limits['DEFAULT_LIST_SIZE'],
+        max_page_size=limits['MAX_PAGE_SIZE']
+    ).operation(operation)
+
+    if depth > limits['MAX_DEPTH']:
+        raise GraphQLError(
+            f'Query depth {depth} exceeds the maximum depth of {limits["MAX_DEPTH"]}'
+        )
+    if cost > limits['MAX_COST']:
+        raise GraphQLError(
+            f'Query cost {cost} exceeds the maximum cost of {limits["MAX_COST"]}'
+        )
+
+    return {'requested': cost, 'maximum': limits['MAX_COST'], 'depth': depth}
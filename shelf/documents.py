@@ -0,0 +1,161 @@
+'''Parsed document cache and persisted query registry for the GraphQL endpoint'''
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from graphql.backend import GraphQLCoreBackend
+from graphql.backend.base import GraphQLDocument
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult, execute as execute_document
+from graphql.language.parser import parse
+from graphql.validation import validate
+
+from shelf.cost import check_query_cost
+
+class LRUDict:
+    '''Thread safe mapping keeping only the max_entries most recently used keys'''
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns the value of key, marking it most recently used, or None'''
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        '''Stores value under key, evicting the least recently used keys over max_entries'''
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pop(self, key):
+        '''Removes key, returning its value or None'''
+        with self.lock:
+            return self.entries.pop(key, None)
+
+    def __len__(self):
+        return len(self.entries)
+
+def _invalid(errors, **_):
+    return ExecutionResult(errors=errors, invalid=True)
+
+def _execute(schema, document_ast, **options):
+    '''Executes a validated document unless it's over the configured cost limits'''
+    try:
+        cost = check_query_cost(
+            schema, document_ast, options.get('variable_values'), options.get('operation_name')
+        )
+    except GraphQLError as error:
+        return ExecutionResult(errors=[error], invalid=True)
+
+    result = execute_document(schema, document_ast, **options)
+    if cost is not None and isinstance(result, ExecutionResult):
+        result.extensions['cost'] = cost
+
+    return result
+
+class ValidatedDocument(GraphQLDocument):
+    '''GraphQLDocument keeping the errors its validation found'''
+
+    def __init__(self, schema, document_string, document_ast, execute, errors=None):
+        super().__init__(schema, document_string, document_ast, execute)
+        self.errors = errors or []
+
+class CachedDocumentBackend(GraphQLCoreBackend):
+    '''
+    Parses and validates each distinct document once; repeated documents are
+    executed straight from the cache, skipping both steps. Operations over the
+    depth or cost limits are rejected before execution
+    '''
+
+    def __init__(self, max_documents=500):
+        super().__init__()
+        self.documents = LRUDict(max_documents)
+
+    def document_from_string(self, schema, document_string):
+        key = (id(schema), hashlib.sha256(document_string.encode()).hexdigest())
+        document = self.documents.get(key)
+        if document is None:
+            document_ast = parse(document_string)
+            errors = validate(schema, document_ast)
+            document = ValidatedDocument(
+                schema=schema,
+                document_string=document_string,
+                document_ast=document_ast,
+                execute=partial(_invalid, errors) if errors else partial(
+                    _execute, schema, document_ast
+                ),
+                errors=errors
+            )
+            self.documents.set(key, document)
+
+        return document
+
+class PersistedQueryNotFound(Exception):
+    '''Raised when a client sends a hash the server has no document for'''
+
+class PersistedQueries:
+    '''
+    Maps sha256 hashes to query documents. Documents come from the registry
+    file and from clients that send a query along with its hash
+    '''
+
+    def __init__(self, path=None, max_automatic=1000):
+        self.registered = {}
+        if path:
+            with open(path, encoding='utf-8') as registry:
+                self.registered = json.load(registry)
+        self.automatic = LRUDict(max_automatic)
+
+    def resolve(self, query, sha256_hash):
+        '''Returns the query to run for a (query, hash) pair sent by the client'''
+        if query is None:
+            query = self.registered.get(sha256_hash) or self.automatic.get(sha256_hash)
+            if query is None:
+                raise PersistedQueryNotFound('PersistedQueryNotFound')
+            return query
+
+        if hashlib.sha256(query.encode()).hexdigest() != sha256_hash:
+            raise ValueError('provided sha does not match query')
+        self.automatic.set(sha256_hash, query)
+
+        return query
+
+def persisted_query_hash(request, data):
+    '''Returns the sha256Hash of a persistedQuery extension in the request, if any'''
+    extensions = request.GET.get('extensions') or data.get('extensions')
+    if isinstance(extensions, str):
+        extensions = json.loads(extensions)
+
+    return ((extensions or {}).get('persistedQuery') or {}).get('sha256Hash')
+
+_backend = None
+_persisted_queries = None
+
+def get_document_backend():
+    '''Returns the process-wide document cache backend'''
+    global _backend #pylint: disable=global-statement
+    if _backend is None:
+        _backend = CachedDocumentBackend(settings.GRAPHQL_DOCUMENT_CACHE_SIZE)
+
+    return _backend
+
+def get_persisted_queries():
+    '''Returns the process-wide persisted query registry'''
+    global _persisted_queries #pylint: disable=global-statement
+    if _persisted_queries is None:
+        _persisted_queries = PersistedQueries(settings.GRAPHQL_PERSISTED_QUERIES_PATH)
+
+    return _persisted_queries
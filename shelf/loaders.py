@@ -0,0 +1,117 @@
+'''Per-request DataLoaders used by the GraphQL schema'''
+#pylint: disable=no-member
+#pylint: disable=method-hidden
+
+from collections import defaultdict
+from django.db.models import Count, Sum
+from promise import Promise
+from promise.dataloader import DataLoader
+
+from shelf.budget.models import User, MonthlyBudget, Category, Transaction
+
+class UserLoader(DataLoader):
+    '''Loads users by id'''
+
+    def batch_load_fn(self, keys):
+        '''Resolves a batch of user ids'''
+        users = User.objects.in_bulk(keys)
+        return Promise.resolve([users.get(key) for key in keys])
+
+class BudgetLoader(DataLoader):
+    '''Loads monthly budgets by id'''
+
+    def batch_load_fn(self, keys):
+        '''Resolves a batch of monthly budget ids'''
+        budgets = MonthlyBudget.objects.in_bulk(keys)
+        return Promise.resolve([budgets.get(key) for key in keys])
+
+class CategoryLoader(DataLoader):
+    '''Loads categories by id'''
+
+    def batch_load_fn(self, keys):
+        '''Resolves a batch of category ids'''
+        categories = Category.objects.in_bulk(keys)
+        return Promise.resolve([categories.get(key) for key in keys])
+
+class CategoriesByBudgetLoader(DataLoader):
+    '''Loads the categories of each monthly budget'''
+
+    def __init__(self, category_loader):
+        super().__init__()
+        self.category_loader = category_loader
+
+    def batch_load_fn(self, keys):
+        '''Resolves a batch of budget ids to their categories, priming the category loader'''
+        categories_by_budget = defaultdict(list)
+        for category in Category.objects.filter(budget_id__in=keys).order_by('created'):
+            categories_by_budget[category.budget_id].append(category)
+            self.category_loader.prime(category.id, category)
+
+        return Promise.resolve([categories_by_budget[key] for key in keys])
+
+class TransactionsByCategoryLoader(DataLoader):
+    '''
+    Loads the transactions of each category, most recent first and by id
+    within a date, in the (date, id) order of transactionsConnection
+    '''
+
+    def batch_load_fn(self, keys):
+        '''Resolves a batch of category ids to their transactions'''
+        transactions_by_category = defaultdict(list)
+        for transaction in Transaction.objects.filter(
+                category_id__in=keys
+        ).order_by('-date', '-id'):
+            transactions_by_category[transaction.category_id].append(transaction)
+
+        return Promise.resolve([transactions_by_category[key] for key in keys])
+
+class TotalsByCategoryLoader(DataLoader):
+    '''Loads the spent and transaction_count aggregates of each category'''
+
+    def batch_load_fn(self, keys):
+        '''Resolves a batch of category ids to their totals'''
+        totals = {
+            row['category_id']: row for row in Transaction.objects.filter(
+                category_id__in=keys
+            ).values('category_id').annotate(
+                spent=Sum('amount'), transaction_count=Count('id')
+            ).order_by()
+        }
+        empty = {'spent': 0.0, 'transaction_count': 0}
+
+        return Promise.resolve([totals.get(key, empty) for key in keys])
+
+class TotalsByBudgetLoader(DataLoader):
+    '''Loads the spent and transaction_count aggregates of each monthly budget'''
+
+    def batch_load_fn(self, keys):
+        '''Resolves a batch of budget ids to their totals'''
+        totals = {
+            row['category__budget_id']: row for row in Transaction.objects.filter(
+                category__budget_id__in=keys
+            ).values('category__budget_id').annotate(
+                spent=Sum('amount'), transaction_count=Count('id')
+            ).order_by()
+        }
+        empty = {'spent': 0.0, 'transaction_count': 0}
+
+        return Promise.resolve([totals.get(key, empty) for key in keys])
+
+class Loaders:
+    '''Holds one instance of every loader for the lifetime of a request'''
+
+    def __init__(self):
+        self.users = UserLoader()
+        self.budgets = BudgetLoader()
+        self.categories = CategoryLoader()
+        self.categories_by_budget = CategoriesByBudgetLoader(self.categories)
+        self.transactions_by_category = TransactionsByCategoryLoader()
+        self.totals_by_category = TotalsByCategoryLoader()
+        self.totals_by_budget = TotalsByBudgetLoader()
+
+def get_loaders(context):
+    '''Returns the loaders attached to the request, creating them on first use'''
+    if not hasattr(context, 'loaders'):
+        context.loaders = Loaders()
+
+    return context.loaders
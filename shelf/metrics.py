@@ -0,0 +1,236 @@
+'''Resolver timing and SQL instrumentation, aggregated into Prometheus histograms'''
+
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+
+from django.db import connections
+from graphene.types.resolver import attr_resolver, dict_resolver, dict_or_attr_resolver
+from graphql.type.definition import get_named_type, is_leaf_type
+from promise import Promise
+
+from shelf.cache import get_result_cache
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Operations recorded under their own label, the rest are counted as 'other'
+MAX_OPERATIONS = 200
+DEFAULT_RESOLVERS = (attr_resolver, dict_resolver, dict_or_attr_resolver)
+
+def _format_labels(labels):
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+        for name, value in labels
+    )
+
+class Histogram:
+    '''
+    Thread safe cumulative histogram with one series per label combination, up
+    to max_series of them before further combinations are recorded as 'other'
+    '''
+
+    def __init__(
+        self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, max_series=None
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.max_series = max_series
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        '''Records value in the series of the given labels'''
+        key = tuple(labels[name] for name in self.labelnames)
+        with self.lock:
+            if (
+                self.max_series is not None and key not in self.series
+                and len(self.series) >= self.max_series
+            ):
+                key = ('other',) * len(self.labelnames)
+            counts, total = self.series.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self.series[key] = (counts, total + value)
+
+    def render(self):
+        '''Returns the histogram in the Prometheus text exposition format'''
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        with self.lock:
+            series = sorted(
+                (key, (list(counts), total)) for key, (counts, total) in self.series.items()
+            )
+
+        for key, (counts, total) in series:
+            labels = list(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                bucket_labels = _format_labels(labels + [('le', bound)])
+                lines.append(f'{self.name}_bucket{{{bucket_labels}}} {count}')
+            suffix = f'{{{_format_labels(labels)}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {counts[-1]}')
+
+        return '\n'.join(lines)
+
+OPERATION_DURATION = Histogram(
+    'graphql_operation_duration_seconds',
+    'Time spent handling a GraphQL operation, result cache hits included',
+    labelnames=('operation',),
+    max_series=MAX_OPERATIONS
+)
+RESOLVER_DURATION = Histogram(
+    'graphql_resolver_duration_seconds',
+    'Time from calling a field resolver until its value is available',
+    labelnames=('field',)
+)
+SQL_QUERIES = Histogram(
+    'graphql_request_sql_queries',
+    'SQL statements executed per GraphQL operation',
+    labelnames=('operation',),
+    buckets=(0,) + COUNT_BUCKETS,
+    max_series=MAX_OPERATIONS
+)
+SQL_DURATION = Histogram(
+    'graphql_request_sql_duration_seconds',
+    'Time spent in the database per GraphQL operation',
+    labelnames=('operation',),
+    max_series=MAX_OPERATIONS
+)
+
+HISTOGRAMS = [OPERATION_DURATION, RESOLVER_DURATION, SQL_QUERIES, SQL_DURATION]
+
+def render_metrics():
+    '''Returns every metric in the Prometheus text exposition format'''
+    stats = get_result_cache().stats()
+    lines = [histogram.render() for histogram in HISTOGRAMS]
+    for name in ('hits', 'misses'):
+        lines.append('\n'.join([
+            f'# HELP graphql_result_cache_{name}_total Result cache {name} in this process',
+            f'# TYPE graphql_result_cache_{name}_total counter',
+            f'graphql_result_cache_{name}_total {stats[name]}',
+        ]))
+
+    return '\n'.join(lines) + '\n'
+
+class SqlRecorder:
+    '''Database execute wrapper counting statements and the time spent running them'''
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            with self.lock:
+                self.queries += 1
+                self.duration += time.perf_counter() - start
+
+class RequestMetrics:
+    '''Timings of a single GraphQL operation, collected while it runs'''
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.duration = 0.0
+        self.sql = SqlRecorder()
+        self.resolvers = defaultdict(float)
+        self.lock = threading.Lock()
+
+    def record_resolver(self, field, duration):
+        '''Adds the time a field resolver took to the operation and the histogram'''
+        RESOLVER_DURATION.observe(duration, field=field)
+        with self.lock:
+            self.resolvers[field] += duration
+
+    def as_extension(self):
+        '''Returns the timings of this operation for the response extensions'''
+        return {
+            'duration': round(self.duration, 6),
+            'sqlQueries': self.sql.queries,
+            'sqlDuration': round(self.sql.duration, 6),
+            'resolvers': {
+                field: round(duration, 6) for field, duration in sorted(
+                    self.resolvers.items(), key=lambda item: item[1], reverse=True
+                )
+            },
+        }
+
+@contextmanager
+def record_operation(request, operation_name):
+    '''
+    Times an operation and the SQL it runs on every database connection,
+    exposing the RequestMetrics as request.metrics to the resolver middleware
+    '''
+    metrics = RequestMetrics(operation_name or 'anonymous')
+    request.metrics = metrics
+    start = time.perf_counter()
+    try:
+        with recording_sql(metrics.sql):
+            yield metrics
+    finally:
+        metrics.duration = time.perf_counter() - start
+        OPERATION_DURATION.observe(metrics.duration, operation=metrics.operation)
+        SQL_QUERIES.observe(metrics.sql.queries, operation=metrics.operation)
+        SQL_DURATION.observe(metrics.sql.duration, operation=metrics.operation)
+
+@contextmanager
+def recording_sql(wrapper):
+    '''Installs wrapper on every database connection of the current thread'''
+    installed = []
+    try:
+        for connection in connections.all():
+            connection.execute_wrappers.append(wrapper)
+            installed.append(connection)
+        yield
+    finally:
+        for connection in installed:
+            connection.execute_wrappers.remove(wrapper)
+
+def is_default_scalar(info):
+    '''Whether the field is a scalar read off its parent by graphene's default resolver'''
+    resolver = info.parent_type.fields[info.field_name].resolver
+    return (
+        isinstance(resolver, partial) and resolver.func in DEFAULT_RESOLVERS
+        and is_leaf_type(get_named_type(info.return_type))
+    )
+
+class MetricsMiddleware:
+    '''
+    Graphene middleware timing each field resolver of the request, up to the
+    moment its value (or the batch of its DataLoader) is available. Scalars
+    read off their parent aren't timed, they'd only add overhead and series
+    '''
+
+    def resolve(self, next, root, info, **kwargs): #pylint: disable=redefined-builtin
+        '''Calls the next resolver, recording how long its value took'''
+        metrics = getattr(info.context, 'metrics', None)
+        if metrics is None or is_default_scalar(info):
+            return next(root, info, **kwargs)
+
+        field = f'{info.parent_type.name}.{info.field_name}'
+        start = time.perf_counter()
+        result = next(root, info, **kwargs)
+        if not isinstance(result, Promise) or not result.is_pending:
+            metrics.record_resolver(field, time.perf_counter() - start)
+            return result
+
+        def fulfilled(value):
+            metrics.record_resolver(field, time.perf_counter() - start)
+            return value
+
+        def rejected(error):
+            metrics.record_resolver(field, time.perf_counter() - start)
+            raise error
+
+        return result.then(fulfilled, rejected)
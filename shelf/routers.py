@@ -0,0 +1,105 @@
+'''Database routing between the primary and read replicas'''
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from shelf.cache import get_result_cache
+
+class RoutingState:
+    '''Where the reads of one request go'''
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+        self.replica = None
+
+_state = ContextVar('shelf_db_routing', default=None)
+
+def _sticky_key(user_id):
+    return f'graphql:primary:{user_id}'
+
+def mark_sticky(user_id):
+    '''
+    Sends the user's reads to the primary until the replicas have caught up.
+    The mark is a persistent value of the result cache backend expiring after
+    DATABASE_REPLICA_LAG, which result eviction can't drop and every worker
+    process shares
+    '''
+    get_result_cache().backend.set_persistent(
+        _sticky_key(user_id), '1', settings.DATABASE_REPLICA_LAG
+    )
+
+def is_sticky(user_id):
+    '''Whether the user wrote recently enough that replicas may not have the write yet'''
+    return get_result_cache().backend.get_persistent(_sticky_key(user_id)) is not None
+
+@contextmanager
+def routing_scope(user=None):
+    '''
+    Scopes routing to a request. Its reads go to a replica until its first
+    write, after which they go to the primary; users who wrote within the
+    last DATABASE_REPLICA_LAG seconds read from the primary throughout
+    '''
+    user_id = getattr(user, 'id', None)
+    state = RoutingState(pinned=user_id is not None and is_sticky(user_id))
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+        if state.wrote and user_id is not None:
+            mark_sticky(user_id)
+
+def pin_to_primary():
+    '''Sends the rest of the current request's reads to the primary'''
+    state = _state.get()
+    if state is not None:
+        state.pinned = True
+
+class ReplicaRouter:
+    '''
+    Routes reads made inside a routing_scope to the DATABASE_REPLICAS and
+    everything else, writes and transactions included, to the primary
+    '''
+    #pylint: disable=unused-argument
+
+    def db_for_read(self, model, **hints):
+        '''Returns the request's replica, or the primary if it's pinned or in a transaction'''
+        state = _state.get()
+        if state is None or state.pinned or not settings.DATABASE_REPLICAS or \
+                connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+
+        if state.replica is None:
+            # one replica per request, so its reads see a single snapshot
+            state.replica = random.choice(settings.DATABASE_REPLICAS)
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        '''Returns the primary, pinning the rest of the request to it'''
+        state = _state.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        '''Allows every relation, the replicas holding the same data as the primary'''
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        '''Only migrates the primary, replicas follow it through replication'''
+        return db == DEFAULT_DB_ALIAS
+
+class PrimaryForMutationsMiddleware:
+    '''Graphene middleware sending every query of a mutation operation to the primary'''
+
+    def resolve(self, next, root, info, **kwargs): #pylint: disable=redefined-builtin
+        '''Pins the request to the primary before the root fields of a mutation'''
+        if root is None and info.operation.operation == 'mutation':
+            pin_to_primary()
+
+        return next(root, info, **kwargs)
@@ -6,16 +6,63 @@
 #pylint: disable=missing-function-docstring
 #pylint: disable=no-self-argument
 #pylint: disable=no-self-use
+#pylint: disable=too-many-lines
 
-from datetime import datetime
+import base64
+import io
+from datetime import date, datetime, timedelta
 import graphene
 import graphql_jwt
 from graphene_django import DjangoObjectType
 from graphql_jwt.decorators import login_required
-from django.db.models import Prefetch
+from graphql_relay.connection.arrayconnection import cursor_to_offset, offset_to_cursor
+from graphql.error import GraphQLError
+from graphql.language import ast
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import F, Q
+from django.utils.timezone import now
 from dateutil.relativedelta import relativedelta
 
-from shelf.budget.models import User, MonthlyBudget, Category, Transaction
+from shelf.analytics import forecast, spending_insights
+from shelf.budget.importers import PARSERS, CategoryRules, import_transactions, parse_csv
+from shelf.budget.models import (
+    User, MonthlyBudget, Category, Transaction, MonthlyRollup, Tombstone
+)
+from shelf.loaders import get_loaders
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = settings.GRAPHQL_QUERY_LIMITS['MAX_PAGE_SIZE']
+
+def requested_fields(info):
+    '''Returns the names of all fields selected anywhere in the current operation'''
+    if not hasattr(info.context, 'requested_fields'):
+        info.context.requested_fields = {}
+
+    key = id(info.operation)
+    if key not in info.context.requested_fields:
+        fields = set()
+        pending = [info.operation.selection_set]
+        while pending:
+            for selection in pending.pop().selections:
+                if isinstance(selection, ast.FragmentSpread):
+                    pending.append(info.fragments[selection.name.value].selection_set)
+                    continue
+                if isinstance(selection, ast.Field):
+                    fields.add(selection.name.value)
+                if selection.selection_set:
+                    pending.append(selection.selection_set)
+
+        info.context.requested_fields[key] = fields
+
+    return info.context.requested_fields[key]
+
+def with_totals(queryset, info):
+    '''Annotates aggregated totals when the client asked for transaction counts'''
+    if 'transactionCount' not in requested_fields(info):
+        return queryset
+
+    return queryset.with_totals()
 
 class UserType(DjangoObjectType):
     '''GraphQL User type'''
@@ -45,6 +92,106 @@ class TransactionType(DjangoObjectType):
             'category'
         )
 
+    def resolve_category(self, info):
+        '''resolve category field for TransactionType'''
+        return get_loaders(info.context).categories.load(self.category_id)
+
+class TransactionConnection(graphene.relay.Connection):
+    '''GraphQL Transaction connection, most recent first'''
+    class Meta:
+        node = TransactionType
+
+def encode_cursor(transaction):
+    '''Encodes the (date, id) keyset position of a transaction'''
+    return base64.b64encode(f'{transaction.date.isoformat()}:{transaction.id}'.encode()).decode()
+
+def decode_cursor(cursor):
+    '''Decodes a cursor made by encode_cursor into (date, id)'''
+    try:
+        day, pk = base64.b64decode(cursor).decode().split(':')
+        return date.fromisoformat(day), int(pk)
+    except ValueError as error:
+        raise ValueError(f'Invalid cursor {cursor}') from error
+
+def page_size(size):
+    '''
+    Validates a first/last argument, returning the number of rows the page
+    holds: DEFAULT_PAGE_SIZE when omitted and at most MAX_PAGE_SIZE
+    '''
+    if size is None:
+        return DEFAULT_PAGE_SIZE
+    if size < 0:
+        raise GraphQLError(f'Page sizes cannot be negative, received {size}')
+
+    return min(size, MAX_PAGE_SIZE)
+
+def paginate_transactions(transactions, first=None, after=None, last=None, before=None):
+    '''
+    Slices transactions ordered by (-date, -id) with keyset conditions instead
+    of OFFSET, so every page costs the same regardless of its position
+    '''
+    if after:
+        day, pk = decode_cursor(after)
+        transactions = transactions.filter(Q(date__lt=day) | Q(date=day, id__lt=pk))
+    if before:
+        day, pk = decode_cursor(before)
+        transactions = transactions.filter(Q(date__gt=day) | Q(date=day, id__gt=pk))
+
+    if last is not None and first is None:
+        size = page_size(last)
+        rows = list(transactions.order_by('date', 'id')[:size + 1])
+        has_previous_page, has_next_page = len(rows) > size, bool(before)
+        rows = rows[:size][::-1]
+    else:
+        size = page_size(first)
+        rows = list(transactions.order_by('-date', '-id')[:size + 1])
+        has_previous_page, has_next_page = bool(after), len(rows) > size
+        rows = rows[:size]
+
+    edges = [
+        TransactionConnection.Edge(node=transaction, cursor=encode_cursor(transaction))
+        for transaction in rows
+    ]
+
+    return TransactionConnection(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=has_previous_page,
+            has_next_page=has_next_page
+        )
+    )
+
+def paginate_ranked(transactions, first=None, after=None):
+    '''
+    Slices ranked transactions by offset. Ranks are computed per query rather
+    than stored, so there is no keyset to seek on as in paginate_transactions
+    '''
+    offset = 0
+    if after:
+        position = cursor_to_offset(after)
+        if position is None:
+            raise ValueError(f'Invalid cursor {after}')
+        offset = position + 1
+
+    size = page_size(first)
+    rows = list(transactions[offset:offset + size + 1])
+    edges = [
+        TransactionConnection.Edge(node=transaction, cursor=offset_to_cursor(offset + index))
+        for index, transaction in enumerate(rows[:size])
+    ]
+
+    return TransactionConnection(
+        edges=edges,
+        page_info=graphene.relay.PageInfo(
+            start_cursor=edges[0].cursor if edges else None,
+            end_cursor=edges[-1].cursor if edges else None,
+            has_previous_page=offset > 0,
+            has_next_page=len(rows) > size
+        )
+    )
+
 class CategoryType(DjangoObjectType):
     '''GraphQL Category type'''
     class Meta:
@@ -60,20 +207,65 @@ class CategoryType(DjangoObjectType):
         )
 
     spent = graphene.Float()
+    transaction_count = graphene.Int()
     month = graphene.String()
     year = graphene.String()
+    transactions_connection = graphene.relay.ConnectionField(
+        TransactionConnection,
+        date_from=graphene.Date(),
+        date_to=graphene.Date(),
+        source=graphene.String(),
+        recurring=graphene.Boolean()
+    )
+
+    def resolve_budget(self, info):
+        '''resolve budget field for CategoryType'''
+        return get_loaders(info.context).budgets.load(self.budget_id)
+
+    def resolve_transactions(self, info):
+        '''resolve transactions field for CategoryType'''
+        return get_loaders(info.context).transactions_by_category.load(self.id)
+
+    def resolve_transactions_connection(self, _, **args):
+        '''resolve transactions_connection field for CategoryType'''
+        transactions = Transaction.objects.filter(category_id=self.id)
+        if args.get('date_from'):
+            transactions = transactions.filter(date__gte=args['date_from'])
+        if args.get('date_to'):
+            transactions = transactions.filter(date__lte=args['date_to'])
+        if args.get('source'):
+            transactions = transactions.filter(source__icontains=args['source'])
+        if args.get('recurring') is not None:
+            transactions = transactions.filter(recurring=args['recurring'])
+
+        return paginate_transactions(
+            transactions,
+            first=args.get('first'),
+            after=args.get('after'),
+            last=args.get('last'),
+            before=args.get('before')
+        )
 
-    def resolve_spent(self, _):
-        '''resolve spent field for CategoryType'''
-        return self.spent()
+    def resolve_transaction_count(self, info):
+        '''resolve transaction_count field for CategoryType'''
+        if hasattr(self, 'transaction_count'):
+            return self.transaction_count
 
-    def resolve_month(self, _):
+        return get_loaders(info.context).totals_by_category.load(self.id).then(
+            lambda totals: totals['transaction_count']
+        )
+
+    def resolve_month(self, info):
         '''resolve month field for CategoryType'''
-        return self.budget.date.strftime('%B')
+        return get_loaders(info.context).budgets.load(self.budget_id).then(
+            lambda budget: budget.date.strftime('%B')
+        )
 
-    def resolve_year(self, _):
+    def resolve_year(self, info):
         '''resolve year field for CategoryType'''
-        return self.budget.date.strftime('%Y')
+        return get_loaders(info.context).budgets.load(self.budget_id).then(
+            lambda budget: budget.date.strftime('%Y')
+        )
 
 class MonthlyBudgetType(DjangoObjectType):
     '''GraphQL Monthly Budget type'''
@@ -89,6 +281,7 @@ class MonthlyBudgetType(DjangoObjectType):
     month = graphene.String()
     year = graphene.String()
     net = graphene.Float()
+    transaction_count = graphene.Int()
 
     def resolve_month(self, _):
         '''resolve month field for CategoryType'''
@@ -98,9 +291,105 @@ class MonthlyBudgetType(DjangoObjectType):
         '''resolve year field for CategoryType'''
         return self.date.strftime('%Y')
 
-    def resolve_net(self, _):
-        '''resolve net field for CategoryType'''
-        return self.income - sum(c.spent() for c in self.categories.all())
+    def resolve_user(self, info):
+        '''resolve user field for MonthlyBudgetType'''
+        return get_loaders(info.context).users.load(self.user_id)
+
+    def resolve_categories(self, info):
+        '''resolve categories field for MonthlyBudgetType'''
+        return get_loaders(info.context).categories_by_budget.load(self.id)
+
+    def resolve_transaction_count(self, info):
+        '''resolve transaction_count field for MonthlyBudgetType'''
+        if hasattr(self, 'transaction_count'):
+            return self.transaction_count
+
+        return get_loaders(info.context).totals_by_budget.load(self.id).then(
+            lambda totals: totals['transaction_count']
+        )
+
+class TombstoneType(DjangoObjectType):
+    '''GraphQL Tombstone type, a row deleted since a delta sync cursor'''
+    class Meta:
+        model = Tombstone
+        fields = (
+            'model',
+            'object_id',
+            'deleted'
+        )
+
+class ChangesType(graphene.ObjectType):
+    '''
+    GraphQL delta sync payload. Pass cursor to the next changesSince; when
+    reset is set the payload holds everything and replaces the local copy
+    '''
+    cursor = graphene.String()
+    reset = graphene.Boolean()
+    monthly_budgets = graphene.List(MonthlyBudgetType)
+    categories = graphene.List(CategoryType)
+    transactions = graphene.List(TransactionType)
+    deleted = graphene.List(TombstoneType)
+
+def encode_sync_cursor(moment):
+    '''Encodes the time a delta sync was served'''
+    return base64.b64encode(moment.isoformat().encode()).decode()
+
+def decode_sync_cursor(cursor):
+    '''Decodes a cursor made by encode_sync_cursor, which always has a UTC offset'''
+    try:
+        moment = datetime.fromisoformat(base64.b64decode(cursor).decode())
+    except ValueError as error:
+        raise ValueError(f'Invalid cursor {cursor}') from error
+
+    if moment.tzinfo is None:
+        raise ValueError(f'Invalid cursor {cursor}')
+    return moment
+
+class MonthlyRollupType(DjangoObjectType):
+    '''GraphQL Monthly Rollup type (rows without a label total the whole month)'''
+    class Meta:
+        model = MonthlyRollup
+        fields = (
+            'year',
+            'month',
+            'label',
+            'spent',
+            'count',
+            'budgeted'
+        )
+
+class ForecastCategoryType(graphene.ObjectType):
+    '''GraphQL projected spending of a category in a forecast month'''
+    label = graphene.String()
+    budgeted = graphene.Float()
+    recurring = graphene.Float()
+    spent = graphene.Float()
+
+class ForecastMonthType(graphene.ObjectType):
+    '''GraphQL projected month, cumulative_net adding up net from the first forecast month'''
+    year = graphene.Int()
+    month = graphene.Int()
+    income = graphene.Float()
+    spent = graphene.Float()
+    net = graphene.Float()
+    cumulative_net = graphene.Float()
+    categories = graphene.List(ForecastCategoryType)
+
+class SpendingInsightType(graphene.ObjectType):
+    '''
+    GraphQL spending of a category in a month compared with its trailing
+    average, the previous month, its budget and its usual spending
+    '''
+    year = graphene.Int()
+    month = graphene.Int()
+    label = graphene.String()
+    spent = graphene.Float()
+    budgeted = graphene.Float()
+    rolling_average = graphene.Float()
+    change = graphene.Float()
+    budget_ratio = graphene.Float()
+    z_score = graphene.Float()
+    anomaly = graphene.Boolean()
 
 class CreateMonthlyBudget(graphene.Mutation):
     '''GraphQL create Monthly Budget mutation'''
@@ -113,12 +402,17 @@ class CreateMonthlyBudget(graphene.Mutation):
 
     @login_required
     def mutate(root, info, year, month, income):
-        monthly_budget = MonthlyBudget(
-            date=datetime.strptime(f'{year} {month}', '%Y %B'),
-            income=income,
-            user=info.context.user
-        )
-        monthly_budget.save()
+        with db_transaction.atomic():
+            monthly_budget = MonthlyBudget(
+                date=datetime.strptime(f'{year} {month}', '%Y %B'),
+                income=income,
+                net=income,
+                user=info.context.user
+            )
+            monthly_budget.save()
+            MonthlyRollup.objects.add([
+                (monthly_budget.user_id, monthly_budget.date, None, 0.0, 0, monthly_budget.income)
+            ])
 
         return CreateMonthlyBudget(monthly_budget=monthly_budget)
 
@@ -128,24 +422,24 @@ class AutoCreateMonthlyBudget(graphene.Mutation):
 
     @login_required
     def mutate(root, info):
-        transaction_prefetch = Prefetch(
-            'transactions', queryset=Transaction.objects.filter(recurring=True)
-        )
-        category_prefetch = Prefetch(
-            'categories', queryset=Category.objects.prefetch_related(transaction_prefetch)
-        )
-
-        latest_budget = MonthlyBudget.objects.prefetch_related(category_prefetch).filter(
+        latest_budget = MonthlyBudget.objects.filter(
             user=info.context.user
         ).order_by('date').last()
 
-        monthly_budget = MonthlyBudget(
-            date=latest_budget.date + relativedelta(months=1),
-            income=latest_budget.income,
-            user=info.context.user
-        )
-        monthly_budget.save()
-        monthly_budget.copy_from(latest_budget)
+        with db_transaction.atomic():
+            monthly_budget = MonthlyBudget(
+                date=latest_budget.date + relativedelta(months=1),
+                income=latest_budget.income,
+                net=latest_budget.income,
+                user=info.context.user
+            )
+            monthly_budget.save()
+            MonthlyRollup.objects.add([
+                (monthly_budget.user_id, monthly_budget.date, None, 0.0, 0, monthly_budget.income)
+            ])
+            monthly_budget.copy_from(latest_budget)
+
+        monthly_budget.refresh_from_db(fields=['net'])
 
         return AutoCreateMonthlyBudget(monthly_budget=monthly_budget)
 
@@ -161,12 +455,16 @@ class CreateCategory(graphene.Mutation):
     @login_required
     def mutate(root, info, label, monthly_amount, budget_id):
         monthly_budget = MonthlyBudget.objects.get(id=budget_id, user=info.context.user)
-        category = Category(
-            label=label,
-            monthly_amount=monthly_amount,
-            budget=monthly_budget
-        )
-        category.save()
+        with db_transaction.atomic():
+            category = Category(
+                label=label,
+                monthly_amount=monthly_amount,
+                budget=monthly_budget
+            )
+            category.save()
+            MonthlyRollup.objects.add([
+                (monthly_budget.user_id, monthly_budget.date, label, 0.0, 0, monthly_amount)
+            ])
 
         return CreateCategory(category=category)
 
@@ -187,13 +485,15 @@ class CreateTransaction(graphene.Mutation):
         category = Category.objects.get(budget__user=info.context.user, id=fields['category_id'])
         budget = category.budget
 
-        transaction = category.transactions.create(
-            amount=fields['amount'],
-            source=fields['source'],
-            date=budget.date.replace(day=fields['day']),
-            description=fields['description'],
-            recurring=fields['recurring']
-        )
+        with db_transaction.atomic():
+            transaction = category.transactions.create(
+                amount=fields['amount'],
+                source=fields['source'],
+                date=budget.date.replace(day=fields['day']),
+                description=fields['description'],
+                recurring=fields['recurring']
+            )
+            Category.objects.add_spent([(category, transaction.amount)], count=1)
 
         return CreateTransaction(transaction=transaction)
 
@@ -211,17 +511,20 @@ class EditTransaction(graphene.Mutation):
 
     @login_required
     def mutate(root, info, **fields):
-        transaction = Transaction.objects.get(
-            id=fields['id'], category__budget__user=info.context.user
-        )
-        budget = transaction.category.budget
-
-        transaction.amount = fields['amount']
-        transaction.source = fields['source']
-        transaction.date = budget.date.replace(day=fields['day'])
-        transaction.description = fields['description']
-        transaction.recurring = fields['recurring']
-        transaction.save()
+        with db_transaction.atomic():
+            transaction = Transaction.objects.select_for_update(of=('self',)).get(
+                id=fields['id'], category__budget__user=info.context.user
+            )
+            budget = transaction.category.budget
+            difference = fields['amount'] - transaction.amount
+
+            transaction.amount = fields['amount']
+            transaction.source = fields['source']
+            transaction.date = budget.date.replace(day=fields['day'])
+            transaction.description = fields['description']
+            transaction.recurring = fields['recurring']
+            transaction.save()
+            Category.objects.add_spent([(transaction.category, difference)])
 
         return EditTransaction(transaction=transaction)
 
@@ -236,10 +539,27 @@ class EditCategory(graphene.Mutation):
 
     @login_required
     def mutate(root, info, **fields):
-        category = Category.objects.get(id=fields['id'], budget__user=info.context.user)
-        category.label = fields['label']
-        category.monthly_amount = fields['monthly_amount']
-        category.save()
+        with db_transaction.atomic():
+            # locked so transactions written meanwhile are counted under one label only
+            category = Category.objects.select_for_update(of=('self',)).select_related(
+                'budget'
+            ).get(id=fields['id'], budget__user=info.context.user)
+            previous_label, previous_amount = category.label, category.monthly_amount
+            category.label = fields['label']
+            category.monthly_amount = fields['monthly_amount']
+            category.save()
+
+            user_id, day = category.budget.user_id, category.budget.date
+            if category.label == previous_label:
+                difference = category.monthly_amount - previous_amount
+                MonthlyRollup.objects.add([(user_id, day, category.label, 0.0, 0, difference)])
+            else:
+                count = category.transactions.count()
+                MonthlyRollup.objects.add([
+                    (user_id, day, previous_label, -category.spent, -count, -previous_amount),
+                    (user_id, day, category.label, category.spent, count, category.monthly_amount)
+                ])
+                MonthlyRollup.objects.prune(user_id, day, [previous_label])
 
         return EditCategory(category=category)
 
@@ -256,28 +576,62 @@ class EditMonthlyBudget(graphene.Mutation):
 
     @login_required
     def mutate(root, info, **fields):
-        monthly_budget = MonthlyBudget.objects.get(id=fields['id'], user=info.context.user)
-        monthly_budget.income = fields['income']
-        monthly_budget.date = datetime.strptime(f"{fields['year']} {fields['month']}", '%Y %B')
-        monthly_budget.save()
+        with db_transaction.atomic():
+            monthly_budget = MonthlyBudget.objects.select_for_update().get(
+                id=fields['id'], user=info.context.user
+            )
+            previous_date = monthly_budget.date
+            difference = fields['income'] - monthly_budget.income
+            monthly_budget.net += difference
+            monthly_budget.income = fields['income']
+            monthly_budget.date = datetime.strptime(
+                f"{fields['year']} {fields['month']}", '%Y %B'
+            ).date()
+            monthly_budget.save()
+            if monthly_budget.date != previous_date:
+                MonthlyRollup.objects.move(
+                    monthly_budget.user_id, previous_date, monthly_budget.date
+                )
+            MonthlyRollup.objects.add([
+                (monthly_budget.user_id, monthly_budget.date, None, 0.0, 0, difference)
+            ])
+
         return EditMonthlyBudget(monthly_budget=monthly_budget)
 
 class DeleteCategory(graphene.Mutation):
-    '''GraphQL delete Category mutation'''
+    '''
+    GraphQL delete Category mutation. Returns the number of transactions
+    deleted with the category rather than the deleted rows
+    '''
     class Arguments:
         id = graphene.ID()
 
-    category = graphene.Field(CategoryType)
+    id = graphene.ID()
+    deleted_transactions = graphene.Int()
 
     @login_required
     def mutate(root, info, **fields):
-        category = Category.objects.get(
-            id=fields['id'],
-            budget__user=info.context.user
-        )
-        category.delete()
-
-        return DeleteCategory(category=category)
+        with db_transaction.atomic():
+            category = Category.objects.select_for_update(of=('self',)).select_related(
+                'budget'
+            ).get(
+                id=fields['id'],
+                budget__user=info.context.user
+            )
+            MonthlyBudget.objects.filter(pk=category.budget_id).update(
+                net=F('net') + category.spent, modified=now()
+            )
+            Tombstone.objects.record(info.context.user, Category, [category.id])
+            _, transactions = Category.objects.filter(pk=category.pk).delete_cascading()
+
+            user_id, day = category.budget.user_id, category.budget.date
+            MonthlyRollup.objects.add([(
+                user_id, day, category.label, -category.spent, -transactions,
+                -category.monthly_amount
+            )])
+            MonthlyRollup.objects.prune(user_id, day, [category.label])
+
+        return DeleteCategory(id=category.id, deleted_transactions=transactions)
 
 class DeleteTransaction(graphene.Mutation):
     '''GraphQL delete Transaction mutation'''
@@ -288,30 +642,246 @@ class DeleteTransaction(graphene.Mutation):
 
     @login_required
     def mutate(root, info, **fields):
-        transaction = Transaction.objects.get(
-            id=fields['id'],
-            category__budget__user=info.context.user
-        )
-        transaction.delete()
+        with db_transaction.atomic():
+            transaction = Transaction.objects.select_for_update(of=('self',)).get(
+                id=fields['id'],
+                category__budget__user=info.context.user
+            )
+            Category.objects.add_spent([(transaction.category, -transaction.amount)], count=-1)
+            Tombstone.objects.record(info.context.user, Transaction, [transaction.id])
+            transaction.delete()
 
         return DeleteTransaction(transaction=transaction)
 
+def delete_monthly_budgets(user, ids):
+    '''
+    Deletes budgets of the user along with their categories and transactions
+    and returns the number of budgets, categories and transactions deleted
+    '''
+    with db_transaction.atomic():
+        budgets = list(MonthlyBudget.objects.select_for_update().filter(
+            id__in=ids,
+            user=user
+        ).values_list('id', 'date'))
+        if len(budgets) != len(ids):
+            raise MonthlyBudget.DoesNotExist('MonthlyBudget matching query does not exist.')
+
+        Tombstone.objects.record(user, MonthlyBudget, ids)
+        counts = MonthlyBudget.objects.filter(id__in=ids).delete_cascading()
+        MonthlyRollup.objects.delete_months([(user.id, day) for _, day in budgets])
+
+    return counts
+
 class DeleteMonthlyBudget(graphene.Mutation):
-    '''GraphQL delete Monthly Budget mutation'''
+    '''
+    GraphQL delete Monthly Budget mutation. Returns the number of categories
+    and transactions deleted with the budget rather than the deleted rows
+    '''
     class Arguments:
         id = graphene.ID()
 
-    monthly_budget = graphene.Field(MonthlyBudgetType)
+    id = graphene.ID()
+    deleted_categories = graphene.Int()
+    deleted_transactions = graphene.Int()
 
     @login_required
     def mutate(root, info, **fields):
-        monthly_budget = MonthlyBudget.objects.get(
+        _, categories, transactions = delete_monthly_budgets(
+            info.context.user, {int(fields['id'])}
+        )
+
+        return DeleteMonthlyBudget(
             id=fields['id'],
-            user=info.context.user
+            deleted_categories=categories,
+            deleted_transactions=transactions
+        )
+
+class TransactionInput(graphene.InputObjectType):
+    '''GraphQL Transaction input for batch mutations'''
+    amount = graphene.Float()
+    source = graphene.String()
+    day = graphene.Int()
+    description = graphene.String()
+    recurring = graphene.Boolean()
+
+class CreateTransactionInput(TransactionInput):
+    '''GraphQL Transaction input for createTransactions'''
+    category_id = graphene.ID()
+
+class EditTransactionInput(TransactionInput):
+    '''GraphQL Transaction input for editTransactions'''
+    id = graphene.ID()
+
+class CreateTransactions(graphene.Mutation):
+    '''GraphQL batch create Transactions mutation'''
+    class Arguments:
+        transactions = graphene.List(graphene.NonNull(CreateTransactionInput), required=True)
+
+    transactions = graphene.List(TransactionType)
+
+    @login_required
+    def mutate(root, info, transactions):
+        category_ids = {int(fields['category_id']) for fields in transactions}
+        categories = Category.objects.select_related('budget').filter(
+            budget__user=info.context.user
+        ).in_bulk(category_ids)
+        if len(categories) != len(category_ids):
+            raise Category.DoesNotExist('Category matching query does not exist.')
+
+        created = []
+        for fields in transactions:
+            category = categories[int(fields['category_id'])]
+            created.append(Transaction(
+                amount=fields['amount'],
+                source=fields['source'],
+                date=category.budget.date.replace(day=fields['day']),
+                description=fields['description'],
+                recurring=fields['recurring'],
+                category=category
+            ))
+
+        with db_transaction.atomic():
+            created = Transaction.objects.bulk_create(created)
+            Category.objects.add_spent(((t.category, t.amount) for t in created), count=1)
+
+        return CreateTransactions(transactions=created)
+
+class EditTransactions(graphene.Mutation):
+    '''GraphQL batch edit Transactions mutation'''
+    class Arguments:
+        transactions = graphene.List(graphene.NonNull(EditTransactionInput), required=True)
+
+    transactions = graphene.List(TransactionType)
+
+    @login_required
+    def mutate(root, info, transactions):
+        edits = {int(fields['id']): fields for fields in transactions}
+
+        with db_transaction.atomic():
+            edited = list(Transaction.objects.select_for_update(of=('self',)).select_related(
+                'category__budget'
+            ).filter(id__in=edits, category__budget__user=info.context.user))
+            if len(edited) != len(edits):
+                raise Transaction.DoesNotExist('Transaction matching query does not exist.')
+
+            differences = []
+            for transaction in edited:
+                fields = edits[transaction.id]
+                differences.append((transaction.category, fields['amount'] - transaction.amount))
+
+                transaction.amount = fields['amount']
+                transaction.source = fields['source']
+                transaction.date = transaction.category.budget.date.replace(day=fields['day'])
+                transaction.description = fields['description']
+                transaction.recurring = fields['recurring']
+                transaction.modified = now()
+
+            Transaction.objects.bulk_update(edited, [
+                'amount', 'source', 'date', 'description', 'recurring', 'modified'
+            ])
+            Category.objects.add_spent(differences)
+
+        return EditTransactions(transactions=edited)
+
+class DeleteTransactions(graphene.Mutation):
+    '''GraphQL batch delete Transactions mutation'''
+    class Arguments:
+        ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    transactions = graphene.List(TransactionType)
+
+    @login_required
+    def mutate(root, info, ids):
+        ids = {int(pk) for pk in ids}
+
+        with db_transaction.atomic():
+            deleted = list(Transaction.objects.select_for_update(of=('self',)).select_related(
+                'category'
+            ).filter(id__in=ids, category__budget__user=info.context.user))
+            if len(deleted) != len(ids):
+                raise Transaction.DoesNotExist('Transaction matching query does not exist.')
+
+            Category.objects.add_spent(((t.category, -t.amount) for t in deleted), count=-1)
+            Tombstone.objects.record(info.context.user, Transaction, ids)
+            Transaction.objects.filter(id__in=ids).delete()
+
+        return DeleteTransactions(transactions=deleted)
+
+class DeleteMonthlyBudgets(graphene.Mutation):
+    '''GraphQL batch delete Monthly Budgets mutation'''
+    class Arguments:
+        ids = graphene.List(graphene.NonNull(graphene.ID), required=True)
+
+    deleted_budgets = graphene.Int()
+    deleted_categories = graphene.Int()
+    deleted_transactions = graphene.Int()
+
+    @login_required
+    def mutate(root, info, ids):
+        budgets, categories, transactions = delete_monthly_budgets(
+            info.context.user, {int(pk) for pk in ids}
         )
-        monthly_budget.delete()
 
-        return DeleteMonthlyBudget(monthly_budget=monthly_budget)
+        return DeleteMonthlyBudgets(
+            deleted_budgets=budgets,
+            deleted_categories=categories,
+            deleted_transactions=transactions
+        )
+
+class ImportTransactions(graphene.Mutation):
+    '''
+    GraphQL import Transactions mutation. The export is sent as a multipart
+    upload and file names the form field holding it. The import is all or
+    nothing: a row that can't be read fails it without importing any row
+    '''
+    class Arguments:
+        file = graphene.String(required=True)
+        format = graphene.String()
+        rules = graphene.JSONString()
+        date_format = graphene.String()
+        spend_positive = graphene.Boolean()
+
+    created = graphene.Int()
+    duplicates = graphene.Int()
+    uncategorized = graphene.Int()
+    skipped = graphene.Int()
+
+    @login_required
+    def mutate(root, info, **fields):
+        upload = info.context.FILES.get(fields['file'])
+        if upload is None:
+            raise GraphQLError(f"No file was uploaded in the form field {fields['file']}")
+
+        file_format = fields.get('format') or upload.name.rsplit('.', 1)[-1].lower()
+        if file_format not in PARSERS:
+            raise GraphQLError(
+                f"Unsupported import format {file_format}, expected one of {', '.join(PARSERS)}"
+            )
+
+        lines = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+
+        if file_format == 'csv':
+            rows = parse_csv(lines, date_format=fields.get('date_format') or '%Y-%m-%d')
+        else:
+            rows = PARSERS[file_format](lines)
+
+        try:
+            result = import_transactions(
+                info.context.user,
+                rows,
+                CategoryRules(fields.get('rules')),
+                spend_sign=1 if fields.get('spend_positive') else -1,
+                atomic=True
+            )
+        except ValueError as error:
+            raise GraphQLError(f'{error}, nothing was imported') from error
+
+        return ImportTransactions(
+            created=result.created,
+            duplicates=result.duplicates,
+            uncategorized=result.uncategorized,
+            skipped=result.skipped
+        )
 
 class Query(graphene.ObjectType):
     '''GraphQL queries'''
@@ -321,44 +891,120 @@ class Query(graphene.ObjectType):
     category = graphene.Field(CategoryType, id=graphene.ID(required=True))
     transaction = graphene.Field(TransactionType, id=graphene.ID(required=True))
     monthly_budget = graphene.Field(MonthlyBudgetType, id=graphene.ID(required=True))
+    spending_history = graphene.List(
+        MonthlyRollupType,
+        from_year=graphene.Int(required=True),
+        to_year=graphene.Int(required=True)
+    )
+    search_transactions = graphene.Field(
+        TransactionConnection,
+        query=graphene.String(required=True),
+        date_from=graphene.Date(name='from'),
+        date_to=graphene.Date(name='to'),
+        first=graphene.Int(),
+        after=graphene.String()
+    )
+    changes_since = graphene.Field(ChangesType, cursor=graphene.String())
+    forecast = graphene.List(ForecastMonthType, months=graphene.Int(default_value=12))
+    spending_insights = graphene.List(SpendingInsightType, year=graphene.Int(required=True))
 
     @login_required
     def resolve_all_categories(self, info, budget_id):
-        return Category.objects.prefetch_related('transactions').filter(
+        categories = Category.objects.filter(
             budget_id=budget_id, budget__user=info.context.user
         ).order_by('created')
 
+        return with_totals(categories, info)
+
     @login_required
     def resolve_monthly_budgets(self, info, year):
-        return MonthlyBudget.objects.prefetch_related('categories__transactions').filter(
+        monthly_budgets = MonthlyBudget.objects.filter(
             user=info.context.user, date__year=year
         ).order_by('date__month')
 
+        return with_totals(monthly_budgets, info)
+
     @login_required
     def resolve_all_budget_years(self, info):
-        years = MonthlyBudget.objects.filter(
-            user=info.context.user
-        ).values_list('date__year').distinct().order_by('-date__year')
+        return MonthlyRollup.objects.filter(
+            user=info.context.user, label__isnull=True
+        ).values_list('year', flat=True).distinct().order_by('-year')
 
-        return [year[0] for year in years]
+    @login_required
+    def resolve_spending_history(self, info, from_year, to_year):
+        return MonthlyRollup.objects.filter(
+            user=info.context.user, year__range=(from_year, to_year)
+        ).order_by('year', 'month', 'label')
 
     @login_required
     def resolve_category(self, info, **fields):
-        # category also uses transactions when calculating 'spent'.
-        # This avoids hitting the db twice when getting 'spent' as well as transaction fields
-        prefetch = Prefetch('transactions', queryset=Transaction.objects.order_by('-date'))
-        return Category.objects.prefetch_related(prefetch).get(
+        return with_totals(Category.objects, info).get(
             id=fields['id'], budget__user=info.context.user
         )
 
     @login_required
     def resolve_monthly_budget(self, info, **fields):
-        return MonthlyBudget.objects.get(id=fields['id'], user=info.context.user)
+        return with_totals(MonthlyBudget.objects, info).get(
+            id=fields['id'], user=info.context.user
+        )
 
     @login_required
     def resolve_transaction(self, info, **fields):
         return Transaction.objects.get(id=fields['id'], category__budget__user=info.context.user)
 
+    @login_required
+    def resolve_search_transactions(self, info, query, **args):
+        transactions = Transaction.objects.filter(category__budget__user=info.context.user)
+        if args.get('date_from'):
+            transactions = transactions.filter(date__gte=args['date_from'])
+        if args.get('date_to'):
+            transactions = transactions.filter(date__lte=args['date_to'])
+        if not query.strip():
+            transactions = transactions.none()
+
+        return paginate_ranked(
+            transactions.search(query.strip()).order_by('-search_rank', '-date', '-id'),
+            first=args.get('first'),
+            after=args.get('after')
+        )
+
+    @login_required
+    def resolve_changes_since(self, info, cursor=None):
+        served = now()
+        config = settings.GRAPHQL_DELTA_SYNC
+        since = decode_sync_cursor(cursor) if cursor else None
+        # tombstones older than TOMBSTONE_DAYS are pruned, so such cursors can't be served
+        reset = since is None or since < served - timedelta(days=config['TOMBSTONE_DAYS'])
+
+        user = info.context.user
+        monthly_budgets = MonthlyBudget.objects.filter(user=user)
+        categories = Category.objects.filter(budget__user=user)
+        transactions = Transaction.objects.filter(category__budget__user=user)
+        deleted = Tombstone.objects.none()
+        if not reset:
+            since -= timedelta(seconds=config['OVERLAP'])
+            monthly_budgets = monthly_budgets.filter(modified__gt=since)
+            categories = categories.filter(modified__gt=since)
+            transactions = transactions.filter(modified__gt=since)
+            deleted = Tombstone.objects.filter(user=user, deleted__gt=since)
+
+        return ChangesType(
+            cursor=encode_sync_cursor(served),
+            reset=reset,
+            monthly_budgets=monthly_budgets.order_by('pk'),
+            categories=categories.order_by('pk'),
+            transactions=transactions.order_by('pk'),
+            deleted=deleted.order_by('deleted')
+        )
+
+    @login_required
+    def resolve_forecast(self, info, months):
+        return forecast(info.context.user, months)
+
+    @login_required
+    def resolve_spending_insights(self, info, year):
+        return spending_insights(info.context.user, year)
+
 class Mutation(graphene.ObjectType):
     '''GraphQL mutations'''
     token_auth = graphql_jwt.ObtainJSONWebToken.Field()
@@ -372,6 +1018,11 @@ class Mutation(graphene.ObjectType):
     delete_category = DeleteCategory.Field()
     delete_transaction = DeleteTransaction.Field()
     delete_monthly_budget = DeleteMonthlyBudget.Field()
+    create_transactions = CreateTransactions.Field()
+    edit_transactions = EditTransactions.Field()
+    delete_transactions = DeleteTransactions.Field()
+    delete_monthly_budgets = DeleteMonthlyBudgets.Field()
+    import_transactions = ImportTransactions.Field()
     # verify_token = graphql_jwt.Verify.Field()
     # refresh_token = graphql_jwt.Refresh.Field()
 
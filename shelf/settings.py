@@ -97,6 +97,22 @@ DATABASES = {
     }
 }
 
+# read replicas of the default database, e.g. DATABASE_REPLICA_HOSTS=replica1,replica2.
+# Pointing one at the primary's own host tries the routing out locally
+DATABASE_REPLICAS = []
+for index, host in enumerate(filter(None, os.getenv('DATABASE_REPLICA_HOSTS', '').split(','))):
+    DATABASES[f'replica_{index}'] = {
+        **DATABASES['default'],
+        'HOST': host.strip(),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica_{index}')
+
+DATABASE_ROUTERS = ['shelf.routers.ReplicaRouter']
+
+# seconds a user's reads stay on the primary after they write, to cover replica lag
+DATABASE_REPLICA_LAG = int(os.getenv('DATABASE_REPLICA_LAG', '10'))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -167,16 +183,108 @@ AUTH_USER_MODEL = 'budget.User'
 
 GRAPHENE = {
     "SCHEMA": "shelf.schema.schema",
+    # the last middleware runs first, so users are authenticated before the cache sees them
+    # and resolver timings exclude the other middleware
     "MIDDLEWARE": [
+        "shelf.metrics.MetricsMiddleware",
+        "shelf.routers.PrimaryForMutationsMiddleware",
+        "shelf.cache.ResultCacheMiddleware",
         "graphql_jwt.middleware.JSONWebTokenMiddleware",
     ],
 }
 
+# number of parsed and validated documents kept per process
+GRAPHQL_DOCUMENT_CACHE_SIZE = 500
+
+# JSON file mapping sha256 hashes to the queries clients may send by hash only
+GRAPHQL_PERSISTED_QUERIES_PATH = os.getenv('GRAPHQL_PERSISTED_QUERIES_PATH')
+
+# worker processes the server runs (uvicorn and gunicorn read it as their --workers default)
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', '1'))
+
+GRAPHQL_RESULT_CACHE = {
+    # 'locmem' (per process, LRU, single worker only) or 'redis' (any Redis-compatible
+    # server at LOCATION), the default once a LOCATION is set
+    'BACKEND': os.getenv(
+        'GRAPHQL_CACHE_BACKEND', 'redis' if os.getenv('GRAPHQL_CACHE_URL') else 'locmem'
+    ),
+    'LOCATION': os.getenv('GRAPHQL_CACHE_URL'),
+    'MAX_ENTRIES': 1000,
+    'TIMEOUT': 300,
+}
+
+GRAPHQL_QUERY_LIMITS = {
+    # operations nested deeper or costing more than this are rejected before execution
+    'MAX_DEPTH': 8,
+    'MAX_COST': 20000,
+    # operations accepted in one request to /graphql/batch
+    'MAX_BATCH_SIZE': 20,
+    # largest page a first/last argument returns, which also caps what it is costed at
+    'MAX_PAGE_SIZE': 100,
+    # expected number of items returned by list fields without first/last arguments
+    'DEFAULT_LIST_SIZE': 10,
+    'LIST_SIZES': {
+        'Query.monthlyBudgets': 12,
+        'Query.allCategories': 10,
+        'Query.spendingHistory': 120,
+        'MonthlyBudgetType.categories': 10,
+        'CategoryType.transactions': 50,
+        'TransactionConnection.edges': 20,
+        'Query.forecast': 12,
+        'Query.spendingInsights': 120,
+    },
+}
+
+GRAPHQL_ASYNC = {
+    # serve /graphql from ConcurrentGraphQLView; shelf/asgi.py turns this on
+    'ENABLED': os.getenv('GRAPHQL_ASYNC'),
+    # threads running ORM work for async requests, i.e. at most this many DB connections
+    'DB_THREADS': int(os.getenv('GRAPHQL_DB_THREADS', '8')),
+    # requests executing at once; up to MAX_QUEUED_REQUESTS more wait up to
+    # QUEUE_TIMEOUT seconds for a slot and the rest get a 503
+    'MAX_CONCURRENT_REQUESTS': 32,
+    'MAX_QUEUED_REQUESTS': 64,
+    'QUEUE_TIMEOUT': 5,
+}
+
+# add per-operation timings and SQL counts to the extensions of every response
+GRAPHQL_METRICS_EXTENSIONS = os.getenv('GRAPHQL_METRICS_EXTENSIONS')
+
+# bearer token the metrics endpoint requires, when set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
 AUTHENTICATION_BACKENDS = [
-    "graphql_jwt.backends.JSONWebTokenBackend",
+    "shelf.auth.CachedJSONWebTokenBackend",
     'django.contrib.auth.backends.ModelBackend',
 ]
 
+# users resolved from JWTs, cached per process and dropped when the user is saved or deleted
+GRAPHQL_JWT_USER_CACHE = {
+    'MAX_ENTRIES': 10000,
+    'TIMEOUT': 60,
+}
+
+# changesSince resends rows modified up to OVERLAP seconds before the cursor, covering
+# writes committed after it was issued; older cursors than TOMBSTONE_DAYS get a full reset
+GRAPHQL_DELTA_SYNC = {
+    'OVERLAP': 60,
+    'TOMBSTONE_DAYS': 90,
+}
+
+# forecast projects at most MAX_MONTHS ahead from spending over the last HISTORY_MONTHS budgets
+GRAPHQL_FORECAST = {
+    'MAX_MONTHS': 36,
+    'HISTORY_MONTHS': 6,
+}
+
+# spendingInsights averages over WINDOW months and flags months whose z-score reaches
+# ANOMALY_Z in categories with MIN_MONTHS of history; results are cached until the next write
+GRAPHQL_INSIGHTS = {
+    'WINDOW': 3,
+    'ANOMALY_Z': 2.0,
+    'MIN_MONTHS': 4,
+}
+
 GRAPHQL_JWT = {
     'JWT_VERIFY_EXPIRATION': True,
     "JWT_EXPIRATION_DELTA": timedelta(hours=1),
@@ -13,12 +13,24 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
+
+from shelf.views import ConcurrentGraphQLView, ShelfGraphQLView, export_transactions, metrics
+
+if settings.GRAPHQL_ASYNC['ENABLED']:
+    graphql_view = ConcurrentGraphQLView.as_async_view(graphiql=True)
+    batch_view = ConcurrentGraphQLView.as_async_view(batch=True)
+else:
+    graphql_view = csrf_exempt(ShelfGraphQLView.as_view(graphiql=True))
+    batch_view = csrf_exempt(ShelfGraphQLView.as_view(batch=True))
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path("graphql", csrf_exempt(GraphQLView.as_view(graphiql=True)))
+    path("graphql", graphql_view),
+    path("graphql/batch", batch_view),
+    path("export", export_transactions),
+    path("metrics", metrics)
 ]
@@ -0,0 +1,563 @@
+'''Views for shelf (GraphQL endpoint and exports)'''
+
+import asyncio
+import copy
+import csv
+import io
+import json
+import zlib
+from collections import OrderedDict, namedtuple
+from datetime import date
+from itertools import repeat
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql.error import GraphQLError
+from graphql.execution import ExecutionResult, execute
+from graphql.language import ast
+from graphql.utils.get_operation_ast import get_operation_ast
+from graphql_jwt.exceptions import JSONWebTokenError
+
+from shelf.budget.models import Transaction
+from shelf.cache import get_result_cache
+from shelf.concurrency import (
+    Overloaded, get_request_limiter, map_in_db_threads, run_in_db_thread
+)
+from shelf.cost import check_query_cost
+from shelf.documents import (
+    PersistedQueryNotFound, get_document_backend, get_persisted_queries, persisted_query_hash
+)
+from shelf.loaders import Loaders
+from shelf.metrics import record_operation, recording_sql, render_metrics
+from shelf.routers import routing_scope
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_BUFFER_SIZE = 64 * 1024
+EXPORT_FIELDS = (
+    'id', 'date', 'amount', 'source', 'description', 'recurring', 'category', 'month'
+)
+
+def request_user(request):
+    '''Returns the user authenticated by session or JWT, or None'''
+    if request.user.is_authenticated:
+        return request.user
+
+    try:
+        return authenticate(request=request)
+    except JSONWebTokenError:
+        return None
+
+class ShelfGraphQLView(GraphQLView):
+    '''
+    GraphQLView serving repeated queries from the per-user result cache, with
+    cached document parsing/validation and persisted queries. Each operation
+    is timed for the metrics endpoint and execution extensions (e.g. the
+    query cost) are included in the response. With batch set, consecutive
+    queries of a batch run concurrently on the DB thread pool and mutations
+    run one at a time, in batch order
+    '''
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.batch or request.method.lower() != 'post':
+            return super().dispatch(request, *args, **kwargs)
+
+        try:
+            groups = self.prepare_batch(request)
+        except HttpError as error:
+            return self.error_response(request, error)
+
+        responses = []
+        for group in groups:
+            # the operations of a group share loaders, which mutations leave stale
+            request.loaders = Loaders()
+            if len(group) == 1:
+                responses.append(self.execute_entry(request, group[0]))
+            else:
+                responses.extend(map_in_db_threads(
+                    self.execute_entry, repeat(request, len(group)), group
+                ))
+
+        return self.batch_response(responses)
+
+    def prepare_batch(self, request):
+        '''
+        Parses a batch and authenticates it once for all its operations,
+        splitting it into runs of queries and single mutations, in order
+        '''
+        entries = self.parse_body(request)
+        limit = settings.GRAPHQL_QUERY_LIMITS['MAX_BATCH_SIZE']
+        if len(entries) > limit:
+            raise HttpError(HttpResponseBadRequest(
+                f'Batches are limited to {limit} operations, received {len(entries)}'
+            ))
+
+        user = request_user(request)
+        if user is not None:
+            request.user = user
+
+        groups = [[]]
+        for entry in entries:
+            if self.operation_type(request, entry) == 'mutation':
+                groups += [[entry], []]
+            else:
+                groups[-1].append(entry)
+
+        return [group for group in groups if group]
+
+    def operation_type(self, request, entry):
+        '''Returns the type of the operation a batch entry runs, or None if it's invalid'''
+        try:
+            query, _, operation_name, _ = self.get_graphql_params(request, entry)
+            document = self.get_backend(request).document_from_string(self.schema, query)
+            return document.get_operation_type(operation_name)
+        except Exception: #pylint: disable=broad-except
+            return None
+
+    def execute_entry(self, request, entry):
+        '''
+        Runs one operation of a batch on a copy of the request, sharing its
+        user and loaders but keeping metrics, flags and errors to itself
+        '''
+        try:
+            if not isinstance(entry, dict):
+                raise HttpError(HttpResponseBadRequest('Batch entries must be JSON objects'))
+            return self.get_response(copy.copy(request), entry)
+        except HttpError as error:
+            status_code = error.response.status_code
+            return self.json_encode(request, {
+                'errors': [self.format_error(error)],
+                'id': entry.get('id') if isinstance(entry, dict) else None,
+                'status': status_code
+            }), status_code
+
+    def batch_response(self, responses):
+        '''Joins the encoded responses of a batch, with the highest status code as its own'''
+        return HttpResponse(
+            status=max(status_code for _, status_code in responses),
+            content='[' + ','.join(content for content, _ in responses) + ']',
+            content_type='application/json'
+        )
+
+    def error_response(self, request, error):
+        '''Encodes an HttpError raised before any operation ran'''
+        response = error.response
+        response['Content-Type'] = 'application/json'
+        response.content = self.json_encode(request, {'errors': [self.format_error(error)]})
+        return response
+
+    def get_backend(self, request):
+        return get_document_backend()
+
+    @staticmethod
+    def get_graphql_params(request, data):
+        '''Reads the operation's parameters, resolving the query of persisted queries'''
+        query, variables, operation_name, request_id = GraphQLView.get_graphql_params(
+            request, data
+        )
+
+        try:
+            sha256_hash = persisted_query_hash(request, data)
+            if sha256_hash:
+                query = get_persisted_queries().resolve(query, sha256_hash)
+        except PersistedQueryNotFound as error:
+            raise HttpError(HttpResponse(), str(error)) from error
+        except ValueError as error:
+            raise HttpError(HttpResponseBadRequest(str(error))) from error
+
+        return query, variables, operation_name, request_id
+
+    def operation_label(self, query, operation_name):
+        '''
+        Returns the name metrics are recorded under: the name of the operation
+        the validated document runs, 'anonymous' if it has none or 'invalid'.
+        The operationName sent only selects the operation, so clients can't
+        make up labels that aren't in a valid document
+        '''
+        if not query:
+            return 'invalid'
+        try:
+            document = self.get_backend(None).document_from_string(self.schema, query)
+        except Exception: #pylint: disable=broad-except
+            return 'invalid'
+
+        operation = get_operation_ast(document.document_ast, operation_name)
+        if document.errors or operation is None:
+            return 'invalid'
+        return operation.name.value if operation.name else 'anonymous'
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, request_id = self.get_graphql_params(request, data)
+
+        label = self.operation_label(query, operation_name)
+        with record_operation(request, label) as operation_metrics:
+            execution_result = self.execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+
+        return self.encode_result(
+            request, execution_result, operation_metrics, request_id, show_graphiql
+        )
+
+    def encode_result(self, request, execution_result, operation_metrics, request_id=None,
+                      show_graphiql=False):
+        '''Returns the JSON body and status code of the response for an execution result'''
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        if not execution_result:
+            return None, 200
+
+        status_code = 200
+        response = {}
+        if execution_result.errors:
+            set_rollback()
+            response['errors'] = [self.format_error(e) for e in execution_result.errors]
+
+        if execution_result.invalid:
+            status_code = 400
+        else:
+            response['data'] = execution_result.data
+
+        if settings.GRAPHQL_METRICS_EXTENSIONS:
+            execution_result.extensions['metrics'] = operation_metrics.as_extension()
+        if execution_result.extensions:
+            response['extensions'] = execution_result.extensions
+
+        if self.batch:
+            response['id'] = request_id
+            response['status'] = status_code
+
+        return self.json_encode(request, response, pretty=show_graphiql), status_code
+
+    def execute_graphql_request( #pylint: disable=too-many-arguments
+            self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        user = request_user(request) if query else None
+        with routing_scope(user):
+            if user is None:
+                return super().execute_graphql_request(
+                    request, data, query, variables, operation_name, show_graphiql
+                )
+
+            # authenticating here also spares the JWT middleware from doing it again
+            request.user = user
+            cache = get_result_cache()
+            key = cache.key(user.id, query, variables, operation_name)
+            cached = cache.get(key)
+            if cached is not None:
+                return ExecutionResult(data=cached['data'], extensions=cached['extensions'])
+
+            result = super().execute_graphql_request(
+                request, data, query, variables, operation_name, show_graphiql
+            )
+            if result is not None and not result.errors and not result.invalid and \
+                    not getattr(request, 'mutated', False):
+                cache.set(key, result.data, result.extensions)
+
+            return result
+
+ConcurrentOperation = namedtuple('ConcurrentOperation', [
+    'document_ast', 'operation', 'fragments', 'variables', 'label', 'cache_key', 'cached', 'cost'
+])
+
+class ConcurrentGraphQLView(ShelfGraphQLView):
+    '''
+    ShelfGraphQLView for the ASGI app. Requests wait for one of a bounded
+    number of execution slots, ORM work runs on the sized DB thread pool and
+    the root fields of a query are resolved concurrently, one pool thread
+    each, as are the queries of a batch. Other mutations and GraphiQL go
+    through the regular view
+    '''
+
+    @classmethod
+    def as_async_view(cls, **initkwargs):
+        '''Returns an async view function serving GraphQL requests'''
+        view = cls(**initkwargs)
+        sync_view = ShelfGraphQLView.as_view(**initkwargs)
+
+        async def graphql(request):
+            try:
+                async with get_request_limiter().slot():
+                    if view.batch:
+                        return await view.execute_batch_concurrently(request)
+                    operation = await run_in_db_thread(view.prepare, request)
+                    if operation is None:
+                        return await run_in_db_thread(sync_view, request)
+                    return await view.execute_concurrently(request, operation)
+            except Overloaded as error:
+                response = HttpResponse(
+                    json.dumps({'errors': [{'message': f'Server busy: {error}'}]}),
+                    status=503,
+                    content_type='application/json'
+                )
+                response['Retry-After'] = '1'
+                return response
+
+        graphql.csrf_exempt = True
+        return graphql
+
+    def prepare(self, request):
+        '''
+        Parses and authenticates a request, returning a ConcurrentOperation if
+        it's a query with several root fields, or None if the regular view
+        should handle it (including every kind of error)
+        '''
+        try:
+            data = self.parse_body(request)
+            if self.batch or (self.graphiql and self.can_display_graphiql(request, data)):
+                return None
+            query, variables, operation_name, _ = self.get_graphql_params(request, data)
+            if not query:
+                return None
+            document = self.get_backend(request).document_from_string(self.schema, query)
+            operation = get_operation_ast(document.document_ast, operation_name)
+            if document.errors or operation is None or operation.operation != 'query' or len(
+                    operation.selection_set.selections
+            ) < 2 or not all(
+                isinstance(selection, ast.Field)
+                for selection in operation.selection_set.selections
+            ):
+                return None
+            cost = check_query_cost(self.schema, document.document_ast, variables, operation_name)
+        except (HttpError, GraphQLError, TypeError, ValueError):
+            return None
+
+        user = request_user(request)
+        cache_key = cached = None
+        if user is not None:
+            request.user = user
+            cache = get_result_cache()
+            cache_key = cache.key(user.id, query, variables, operation_name)
+            cached = cache.get(cache_key)
+
+        return ConcurrentOperation(
+            document_ast=document.document_ast,
+            operation=operation,
+            fragments=[
+                definition for definition in document.document_ast.definitions
+                if isinstance(definition, ast.FragmentDefinition)
+            ],
+            variables=variables,
+            label=operation.name.value if operation.name else 'anonymous',
+            cache_key=cache_key,
+            cached=cached,
+            cost=cost
+        )
+
+    async def execute_concurrently(self, request, operation):
+        '''Resolves each root field in its own pool thread and merges the results'''
+        with record_operation(request, operation.label) as operation_metrics, \
+                routing_scope(getattr(request, 'user', None)):
+            if operation.cached is not None:
+                result = ExecutionResult(
+                    data=operation.cached['data'], extensions=operation.cached['extensions']
+                )
+            else:
+                results = await asyncio.gather(*[
+                    run_in_db_thread(self.execute_root_field, request, operation, field)
+                    for field in operation.operation.selection_set.selections
+                ])
+                result = ExecutionResult(
+                    data=OrderedDict(),
+                    errors=[error for field in results for error in field.errors or []],
+                    extensions={'cost': operation.cost}
+                )
+                for field in results:
+                    result.data.update(field.data or {})
+
+        content, status_code = await run_in_db_thread(
+            self.store_result, request, operation, result, operation_metrics
+        )
+        return HttpResponse(status=status_code, content=content, content_type='application/json')
+
+    async def execute_batch_concurrently(self, request):
+        '''Like ShelfGraphQLView.dispatch for batches, awaiting the DB thread pool'''
+        try:
+            groups = await run_in_db_thread(self.prepare_batch, request)
+        except HttpError as error:
+            return self.error_response(request, error)
+
+        responses = []
+        for group in groups:
+            request.loaders = Loaders()
+            responses.extend(await asyncio.gather(*[
+                run_in_db_thread(self.execute_entry, request, entry) for entry in group
+            ]))
+
+        return self.batch_response(responses)
+
+    def execute_root_field(self, request, operation, field):
+        '''Executes the operation restricted to one of its root fields'''
+        document_ast = ast.Document(definitions=[
+            ast.OperationDefinition(
+                operation=operation.operation.operation,
+                name=operation.operation.name,
+                variable_definitions=operation.operation.variable_definitions,
+                directives=operation.operation.directives,
+                selection_set=ast.SelectionSet(selections=[field])
+            )
+        ] + operation.fragments)
+
+        with recording_sql(request.metrics.sql):
+            return execute(
+                self.schema,
+                document_ast,
+                root_value=self.get_root_value(request),
+                variable_values=operation.variables,
+                context_value=request,
+                middleware=self.get_middleware(request)
+            )
+
+    def store_result(self, request, operation, result, operation_metrics):
+        '''Caches a successful result and encodes the response'''
+        if operation.cached is None and operation.cache_key and not result.errors:
+            get_result_cache().set(operation.cache_key, result.data, result.extensions)
+
+        return self.encode_result(request, result, operation_metrics)
+
+@require_GET
+def metrics(request):
+    '''Serves the GraphQL metrics in the Prometheus text format'''
+    token = settings.METRICS_TOKEN
+    if token and request.META.get('HTTP_AUTHORIZATION') != f'Bearer {token}':
+        return HttpResponse(status=401)
+
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4')
+
+def _export_rows(queryset, keyset=False):
+    '''
+    Yields one dict per transaction, reading EXPORT_CHUNK_SIZE of them at a
+    time from a server-side cursor, or with keyset after the last (date, id)
+    read by a new query per chunk
+    '''
+    rows = _keyset_chunks(queryset) if keyset else queryset.iterator(
+        chunk_size=EXPORT_CHUNK_SIZE
+    )
+    for row in rows:
+        yield {
+            'id': row[0],
+            'date': row[1].isoformat(),
+            'amount': row[2],
+            'source': row[3],
+            'description': row[4],
+            'recurring': row[5],
+            'category': row[6],
+            'month': row[7].strftime('%Y-%m')
+        }
+
+def _keyset_chunks(queryset):
+    '''
+    Yields the rows of a queryset ordered by (date, id), one query per chunk.
+    Unlike a server-side cursor the queries don't share a connection, so under
+    ASGI any DB thread can run them. Each query sorts the user's transactions
+    again, so this costs more than the cursor and is only used there
+    '''
+    rows = list(queryset[:EXPORT_CHUNK_SIZE])
+    while rows:
+        yield from rows
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            return
+        last_id, last_date = rows[-1][:2]
+        rows = list(queryset.filter(
+            Q(date__gt=last_date) | Q(date=last_date, id__gt=last_id)
+        )[:EXPORT_CHUNK_SIZE])
+
+def _csv_lines(rows):
+    '''Encodes rows as CSV lines, header first'''
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+def _ndjson_lines(rows):
+    '''Encodes rows as newline delimited JSON'''
+    for row in rows:
+        yield json.dumps(row) + '\n'
+
+def _buffered(lines):
+    '''Joins lines into chunks of roughly EXPORT_BUFFER_SIZE bytes'''
+    chunk = []
+    size = 0
+    for line in lines:
+        data = line.encode()
+        chunk.append(data)
+        size += len(data)
+        if size >= EXPORT_BUFFER_SIZE:
+            yield b''.join(chunk)
+            chunk = []
+            size = 0
+
+    yield b''.join(chunk)
+
+def _gzipped(chunks):
+    '''Compresses chunks on the fly into a single gzip stream'''
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+EXPORT_FORMATS = {
+    'csv': (_csv_lines, 'text/csv'),
+    'ndjson': (_ndjson_lines, 'application/x-ndjson'),
+}
+
+@require_GET
+def export_transactions(request):
+    '''
+    Streams the user's transactions with their category label and budget month.
+    Query parameters: format (csv or ndjson), from and to (YYYY-MM-DD, inclusive).
+    The stream is gzipped when the client accepts it
+    '''
+    user = request_user(request)
+    if user is None:
+        return HttpResponse(status=401)
+
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return HttpResponseBadRequest(f'Unknown format {export_format}')
+
+    transactions = Transaction.objects.filter(category__budget__user=user)
+    try:
+        if 'from' in request.GET:
+            transactions = transactions.filter(date__gte=date.fromisoformat(request.GET['from']))
+        if 'to' in request.GET:
+            transactions = transactions.filter(date__lte=date.fromisoformat(request.GET['to']))
+    except ValueError as error:
+        return HttpResponseBadRequest(str(error))
+
+    queryset = transactions.order_by('date', 'id').values_list(
+        'id', 'date', 'amount', 'source', 'description', 'recurring',
+        'category__label', 'category__budget__date'
+    )
+    encode, content_type = EXPORT_FORMATS[export_format]
+    # ASGI produces each chunk on whichever DB thread is free (see StreamingASGIHandler)
+    chunks = _buffered(encode(_export_rows(queryset, keyset=isinstance(request, ASGIRequest))))
+
+    gzip = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    response = StreamingHttpResponse(
+        _gzipped(chunks) if gzip else chunks,
+        content_type=content_type
+    )
+    response['Content-Disposition'] = f'attachment; filename="transactions.{export_format}"'
+    response['Vary'] = 'Accept-Encoding'
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+
+    return response
@@ -11,6 +11,9 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from shelf.cache import check_shared_backend
+
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shelf.settings')
 
 application = get_wsgi_application()
+check_shared_backend()